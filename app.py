@@ -1,13 +1,67 @@
 import os
-from flask import Flask, request, jsonify, render_template_string
+import atexit
+import json
+import queue
+import time
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
 import serial
 import serial.tools.list_ports
-from sensor_comm_v3 import SensorComm
+from serial_pool import SerialPool
+from device_broker import BrokerClient, RemoteJobManager, RemoteTelemetryHub
+from register_cache import RegisterCache
+from telemetry import TelemetryHub
+from single_flight import SingleFlight
+from write_coalescer import WriteCoalescer
+from register_map import REGISTER_MAP, FPGA
+from fleet import Fleet
+from port_discovery import PortDiscovery
+from device_metrics import DEVICE_METRICS
+from cmd_cls_v3 import DeadlineExceeded
+from jobs import JobManager, JobRejected, FINISHED_STATES
+from link_profile import LINK_PROFILES
 
 app = Flask(__name__)
 CORS(app)
 
+broker_socket = os.environ.get('DEVICE_BROKER_SOCKET')
+
+if os.environ.get('REGISTER_CACHE_TTL'):
+    register_cache_ttl = float(os.environ['REGISTER_CACHE_TTL'])
+else:
+    # Other workers write through the broker too, so without a TTL this
+    # worker's copy of mutable registers could go stale
+    register_cache_ttl = 0 if broker_socket else None
+register_cache = RegisterCache(default_ttl=register_cache_ttl)
+
+if broker_socket:
+    # The key comes from DEVICE_BROKER_AUTHKEY or the key file the broker wrote
+    serial_pool = BrokerClient(broker_socket)
+    job_manager = RemoteJobManager(broker_socket)
+else:
+    serial_pool = SerialPool(dev_name='Athena640', idd='new', timeout=5,
+                             idle_timeout=float(os.environ.get('SERIAL_IDLE_TIMEOUT', 60)),
+                             on_close=lambda com_port, baud_rate: register_cache.invalidate(com_port))
+    job_manager = JobManager(serial_pool, max_queued=int(os.environ.get('JOB_QUEUE_LIMIT', 4)))
+read_flight = SingleFlight()
+fleet = Fleet(max_workers=int(os.environ.get('FLEET_CONCURRENCY', 8)),
+              groups_file=os.environ.get('FLEET_GROUPS_FILE', 'fleet_groups.json'))
+write_coalescer = WriteCoalescer()
+port_discovery = PortDiscovery(serial_pool,
+                               baud_rate=int(os.environ.get('DISCOVERY_BAUD_RATE', 115200)),
+                               probe_timeout=float(os.environ.get('DISCOVERY_PROBE_TIMEOUT', 0.5)),
+                               interval=float(os.environ.get('DISCOVERY_INTERVAL', 2.0)),
+                               retry_interval=float(os.environ.get('DISCOVERY_RETRY_INTERVAL', 10.0)),
+                               validate_interval=float(os.environ.get('DISCOVERY_VALIDATE_INTERVAL', 10.0)))
+# PORT_DISCOVERY=0 leaves the host's serial ports alone
+port_discovery_enabled = os.environ.get('PORT_DISCOVERY', '1') != '0'
+request_timeout = float(os.environ.get('REQUEST_TIMEOUT', 10))
+if broker_socket:
+    # One poller per device in the broker, whatever the number of workers
+    telemetry_hub = RemoteTelemetryHub(broker_socket)
+else:
+    telemetry_hub = TelemetryHub(serial_pool, interval=float(os.environ.get('TELEMETRY_INTERVAL', 1.0)))
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -256,8 +310,16 @@ HTML_TEMPLATE = '''
                 if (result.status === "success") {
                     console.log("Available COM ports:", result.com_ports);
                     const comPortInput = document.getElementById('com-port');
-                    connectedComPort = await findConnectedComPort(result.com_ports);
+                    const device = findConnectedComPort(result.devices);
+                    if (!device && result.scanning) {
+                        // Ports are still being probed, ask again shortly
+                        setTimeout(fetchComPorts, 1000);
+                    }
+                    connectedComPort = device ? device.com_port : null;
                     comPortInput.value = connectedComPort ? connectedComPort : 'No connected COM port found';
+                    if (device && device.fw_version) {
+                        document.getElementById('fw-version-input').value = device.fw_version;
+                    }
                     console.log("Connected COM port:", connectedComPort);
                 } else {
                     throw new Error(result.message || 'Unknown error occurred');
@@ -268,32 +330,14 @@ HTML_TEMPLATE = '''
             }
         }
 
-        async function findConnectedComPort(availablePorts) {
-            console.log("Checking for a single connected COM port");
-            if (!Array.isArray(availablePorts) || availablePorts.length === 0) {
-                console.warn("No available ports to check");
+        function findConnectedComPort(devices) {
+            // The server pings every port, devices only lists the ones that answered
+            if (!Array.isArray(devices) || devices.length === 0) {
+                console.log("No connected COM port found among available ports");
                 return null;
             }
-            for (const port of availablePorts) {
-                console.log(`Checking port: ${port}`);
-                const isConnected = await checkPortConnection(port);
-                if (isConnected) {
-                    console.log(`${port} is connected and communicating with the device`);
-                    return port;
-                }
-            }
-            console.log("No connected COM port found among available ports");
-            return null;
-        }
-
-        function checkPortConnection(port) {
-            return new Promise((resolve) => {
-                setTimeout(() => {
-                    const isConnected = port === "COM7";  // Replace this with the correct logic to check connection
-                    console.log(`Port ${port} connection check result: ${isConnected}`);
-                    resolve(isConnected);
-                }, 100);
-            });
+            console.log(`${devices[0].com_port} is connected and communicating with the device`);
+            return devices[0];
         }
 
         function updateComPortInput() {
@@ -428,7 +472,56 @@ async function setDZoom(value) {
             await setParameter('reticle_colour', value);
         }
 
+        const defaultRegisters = [
+            ['brightness-input', 0xd0], ['contrast-input', 0xd4], ['dzoom-input', 0x86],
+            ['polarity-input', 0x52], ['agc-input', 0x51], ['nuc-input', 0x91],
+            ['reticle-input', 0x66], ['reticle-colour-input', 0x67], ['fw-version-input', 0x10]
+        ];
+
+        async function getAllDefaults() {
+            const comPort = document.getElementById('com-port').value;
+            const baudRate = document.getElementById('baud-rate').value;
+
+            try {
+                const response = await fetch('/registers/batch', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        com_port: comPort,
+                        baud_rate: baudRate,
+                        operations: defaultRegisters.map(([, address]) => ({op: 'read', address: address}))
+                    })
+                });
+
+                const result = await response.json();
+                if (!result.results) {
+                    throw new Error(result.message);
+                }
+
+                result.results.forEach((item, index) => {
+                    const inputId = defaultRegisters[index][0];
+                    if (item.status !== 'success') {
+                        logError(`Error reading ${item.register}`, item.message);
+                        return;
+                    }
+                    document.getElementById(inputId).value =
+                        inputId === 'fw-version-input' ? item.data.join('.') : item.value;
+                    logResult(item, inputId);
+                });
+            } catch (error) {
+                console.error('Error getting defaults:', error);
+                logError('Error getting defaults', error.message);
+            }
+        }
+
         document.addEventListener('DOMContentLoaded', () => {
+            const getAllDefaultsButton = document.getElementById('get-all-defaults-button');
+            if (getAllDefaultsButton) {
+                getAllDefaultsButton.addEventListener('click', getAllDefaults);
+            }
+
             const autoDetectButton = document.getElementById('auto-detect-button');
             if (autoDetectButton) {
                 autoDetectButton.addEventListener('click', autoDetectComPort);
@@ -443,6 +536,22 @@ async function setDZoom(value) {
 </html>
 '''
 
+def start_background():
+    '''Starts the threads serving the app, stop_background stops them'''
+    if port_discovery_enabled:
+        port_discovery.start()
+
+def stop_background():
+    port_discovery.stop()
+    telemetry_hub.stop()
+
+atexit.register(stop_background)
+
+@app.before_request
+def ensure_background():
+    # WSGI servers give no startup hook, the first request starts them
+    start_background()
+
 @app.route('/')
 def home():
     return render_template_string(HTML_TEMPLATE)
@@ -450,58 +559,266 @@ def home():
 @app.route('/get_com_ports', methods=['GET'])
 def get_com_ports():
     try:
-        ports = serial.tools.list_ports.comports()
-        com_ports = [port.device for port in ports]
-        return jsonify({"status": "success", "com_ports": com_ports}), 200
+        # Probing happens in the discovery thread, a request only waits
+        # briefly for the very first scan
+        if port_discovery_enabled:
+            if request.args.get('refresh'):
+                port_discovery.request_refresh()
+            port_discovery.wait_scanned(port_discovery.probe_timeout)
+        com_ports, devices = port_discovery.snapshot()
+        return jsonify({
+            "status": "success",
+            "com_ports": com_ports,
+            "devices": [device for device in devices if device["responsive"]],
+            "connected_ports": [device["com_port"] for device in devices if device["responsive"]],
+            "scanning": port_discovery_enabled and port_discovery.scanning()
+        }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def request_deadline():
+    '''
+    Deadline for the device work of the current request. Clients can ask for
+    less than REQUEST_TIMEOUT with an X-Request-Timeout header in seconds.
+    '''
+    timeout = request_timeout
+    header = request.headers.get('X-Request-Timeout')
+    if header:
+        try:
+            timeout = min(float(header), timeout)
+        except ValueError:
+            pass
+    return time.monotonic() + timeout
+
+def error_response(e):
+    if isinstance(e, DeadlineExceeded):
+        return jsonify({"status": "error", "message": str(e)}), 504
+    return jsonify({"status": "error", "message": str(e)}), 500
+
+def device_fpga_read(com_port, baud_rate, address, deadline=None):
+    with serial_pool.connection(com_port, baud_rate, deadline=deadline) as cmd_gen:
+        response = cmd_gen.fpga_read(address)
+        # Update the cache before releasing the port so a later write wins
+        register_cache.put(com_port, address, response)
+    return response
+
+def cached_fpga_read(com_port, baud_rate, address, deadline=None):
+    response = register_cache.get(com_port, address)
+    if response is None:
+        # Identical reads arriving together share one trip over the UART
+        response = read_flight.do((com_port, address), device_fpga_read,
+                                  com_port, baud_rate, address, deadline, deadline=deadline)
+    return response
+
+def with_etag(result, com_port, address, response):
+    body, code = result
+    if code == 200:
+        etag = register_cache.etag(com_port, address, response)
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': '"%s"' % etag}
+        body.set_etag(etag)
+    return body, code
+
+def device_fpga_write(com_port, baud_rate, address, take_value, deadline=None):
+    with serial_pool.connection(com_port, baud_rate, deadline=deadline) as cmd_gen:
+        # Take the value only now, newer writes queued meanwhile replace it
+        value = take_value()
+        ack = cmd_gen.fpga_write(address, value)
+        # Only the read back may be cached, an ack carries no register value
+        register_cache.invalidate(com_port, address)
+        response = cmd_gen.fpga_read(address)
+        register_cache.put(com_port, address, response)
+    return value, ack, response
+
 def handle_serial_communication(com_port, baud_rate, address, value=None):
+    deadline = request_deadline()
     try:
-        ser = serial.Serial(com_port, baud_rate, timeout=5)
-        cmd_gen = SensorComm(ser, dev_name='Athena640', idd='new')
-        
         if value is not None:
-            command_sent = [0xe0, 0x0, 0x1, 0x3e, 0xff, 0x3, 0x52, 0x50, address, int(value), 0xff, 0xfe]
-            cmd_gen.fpga_write(address, int(value))
-            response = cmd_gen.fpga_read(address)
-        else:
-            command_sent = [0xe0, 0x0, 0x1, 0x3e, 0xff, 0x3, 0x52, 0x50, address]
-            response = cmd_gen.fpga_read(address)
-        
-        ser.close()
-        
-        return format_response(response, command_sent)
+            written, ack, response = write_coalescer.write(
+                (com_port, address), int(value),
+                lambda take_value: device_fpga_write(com_port, baud_rate, address, take_value,
+                                                     deadline),
+                deadline)
+            command_sent = [0xe0, 0x0, 0x1, 0x3e, 0xff, 0x3, 0x52, 0x50, address, written, 0xff, 0xfe]
+            extra = {"requested_value": int(value), "coalesced": written != int(value)}
+            if ack is not None:
+                extra["ack_response"] = ','.join(response_frame(ack))
+            return format_response(response, command_sent, extra)
+
+        command_sent = [0xe0, 0x0, 0x1, 0x3e, 0xff, 0x3, 0x52, 0x50, address]
+        response = cached_fpga_read(com_port, baud_rate, address, deadline)
+        return with_etag(format_response(response, command_sent), com_port, address, response)
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return error_response(e)
 
-def format_response(response, command_sent):
+def response_frame(response):
+    data = response.payload
     response_list = [
-        response['header'], response['packet_sequence'] >> 8, response['packet_sequence'] & 0xFF,
-        response['device_id'], response['device_number'], response['length'],
-        response['cmd_type'], response['cmd_status'], response['cmd'] >> 8, response['cmd'] & 0xFF,
-        response['data'][0], response['data'][1], response['data'][2], response['data'][3],
-        response['chksum'], response['footer1'], response['footer2']
+        response.header, response.packet_sequence >> 8, response.packet_sequence & 0xFF,
+        response.device_id, response.device_number, response.length,
+        response.cmd_type, response.cmd_status, response.cmd >> 8, response.cmd & 0xFF,
+        data[0], data[1], data[2], data[3],
+        response.chksum, response.footer1, response.footer2
     ]
-    command_response = [hex(x) for x in response_list if isinstance(x, int)]
+    return [hex(x) for x in response_list if isinstance(x, int)]
+
+def response_value(response):
+    return response.u32()
+
+def format_response(response, command_sent, extra=None):
+    command_response = response_frame(response)
     
     if response['cmd_status'] != 0x00:
         return jsonify({"status": "error", "message": "Communication Failed"}), 500
     
-    result = (
-        (response['data'][0] << 24) |
-        (response['data'][1] << 16) |
-        (response['data'][2] << 8) |
-        response['data'][3]
-    )
-
-    return jsonify({
+    result = response_value(response)
+
+    body = {
         "status": "success",
         "value": result,
         "command_sent": ','.join([f'0x{cmd:02x}' for cmd in command_sent]),
         "command_response": ','.join(command_response),
         "register": hex(command_sent[8])
-    }), 200
+    }
+    if extra:
+        body.update(extra)
+    return jsonify(body), 200
+
+def run_register_operation(cmd_gen, com_port, operation):
+    op = operation.get('op', 'read')
+    name = operation.get('name')
+    if name is not None:
+        if name not in REGISTER_MAP or REGISTER_MAP[name].bus != FPGA:
+            return {"op": op, "name": name, "status": "error",
+                    "message": "Unknown FPGA register"}
+        address = REGISTER_MAP[name].address
+    else:
+        address = int(str(operation.get('address')), 0)
+    register = REGISTER_MAP.lookup(FPGA, address)
+
+    if op == 'write':
+        value = int(str(operation.get('value')), 0)
+        if register is not None:
+            value = register.encode(value)
+        response = cmd_gen.fpga_write(address, value)
+        # The ack is not a read of the register, the next read goes to the device
+        register_cache.invalidate(com_port, address)
+    elif op == 'read':
+        response = cmd_gen.fpga_read(address)
+        register_cache.put(com_port, address, response)
+    else:
+        return {"op": op, "register": hex(address), "status": "error",
+                "message": "Unknown operation"}
+
+    if response is None or response['cmd_status'] != 0x00 or len(response.payload) < 4:
+        return {"op": op, "register": hex(address), "status": "error",
+                "cmd_status": None if response is None else response['cmd_status'],
+                "message": "Communication Failed"}
+
+    result = {
+        "op": op,
+        "register": hex(address),
+        "status": "success",
+        "value": response_value(response),
+        "data": response.payload[-4:].tolist(),
+        "cmd_status": response['cmd_status'],
+        "command_response": ','.join(response_frame(response))
+    }
+    if register is not None:
+        result["name"] = register.name
+        result["decoded"] = register.decode(response.payload)
+    return result
+
+def run_batch(com_port, baud_rate, operations, deadline=None):
+    results = []
+    with serial_pool.connection(com_port, baud_rate, deadline=deadline) as cmd_gen:
+        for operation in operations:
+            results.append(run_register_operation(cmd_gen, com_port, operation))
+    return results
+
+@app.route('/registers/batch', methods=['POST'])
+def registers_batch():
+    data = request.json
+    com_port = data.get('com_port')
+    baud_rate = int(data.get('baud_rate'))
+    operations = data.get('operations') or []
+
+    try:
+        results = run_batch(com_port, baud_rate, operations, request_deadline())
+    except Exception as e:
+        return error_response(e)
+
+    if all(result['status'] == 'success' for result in results):
+        return jsonify({"status": "success", "results": results}), 200
+    return jsonify({"status": "error", "message": "One or more operations failed",
+                    "results": results}), 500
+
+# UI parameter names used by the set_* routes and their registers
+FLEET_SETTINGS = {
+    'brightness': 'brightness', 'contrast': 'contrast', 'dzoom': 'digital_zoom',
+    'polarity': 'polarity', 'agc': 'agc_mode', 'nuc': 'nuc_mode',
+    'reticle': 'reticle_type', 'reticle_colour': 'reticle_colour'
+}
+
+def fleet_response(results):
+    body = {"status": "success", "results": results}
+    if any(result['status'] != 'success' for result in results):
+        body["status"] = "error"
+        body["message"] = "One or more devices failed"
+    return jsonify(body), 200 if body["status"] == "success" else 500
+
+@app.route('/fleet/groups', methods=['GET'])
+def fleet_groups():
+    try:
+        return jsonify({"status": "success", "groups": fleet.groups()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/fleet/set', methods=['POST'])
+def fleet_set():
+    data = request.json
+    baud_rate = int(data.get('baud_rate'))
+    setting = data.get('setting')
+    if setting not in FLEET_SETTINGS:
+        return jsonify({"status": "error", "message": "Unknown setting %s" % setting}), 400
+    register = REGISTER_MAP[FLEET_SETTINGS[setting]]
+    value = register.encode(int(data.get('value')))
+    try:
+        ports = fleet.resolve_ports(data.get('ports'), data.get('group'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    deadline = request_deadline()
+
+    def apply(com_port):
+        written, ack, response = write_coalescer.write(
+            (com_port, register.address), value,
+            lambda take_value: device_fpga_write(com_port, baud_rate, register.address, take_value,
+                                                 deadline),
+            deadline)
+        if response is None or response['cmd_status'] != 0x00 or len(response.payload) < 4:
+            return {"status": "error", "message": "Communication Failed"}
+        return {"status": "success", "value": response_value(response),
+                "command_response": ','.join(response_frame(response))}
+
+    return fleet_response(fleet.run(ports, apply))
+
+@app.route('/fleet/registers/batch', methods=['POST'])
+def fleet_registers_batch():
+    data = request.json
+    baud_rate = int(data.get('baud_rate'))
+    operations = data.get('operations') or []
+    try:
+        ports = fleet.resolve_ports(data.get('ports'), data.get('group'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    deadline = request_deadline()
+
+    def apply(com_port):
+        results = run_batch(com_port, baud_rate, operations, deadline)
+        status = 'success' if all(r['status'] == 'success' for r in results) else 'error'
+        return {"status": status, "results": results}
+
+    return fleet_response(fleet.run(ports, apply))
 
 @app.route('/set_brightness', methods=['POST'])
 def set_brightness():
@@ -642,31 +959,170 @@ def get_fw_version():
     baud_rate = int(request.args.get('baud_rate'))
     
     try:
-        ser = serial.Serial(com_port, baud_rate, timeout=5)
-        cmd_gen = SensorComm(ser, dev_name='Athena640', idd='new')
-        
         # Reading FW version from address 0x10
-        fw_version = cmd_gen.fpga_read(0x10)
-        
-        ser.close()
+        fw_version = cached_fpga_read(com_port, baud_rate, 0x10, request_deadline())
         
         if fw_version['cmd_status'] != 0x00:
             return jsonify({"status": "error", "message": "Communication Failed"}), 500
         
-        fw_ver_out = [fw_version['data'][0], fw_version['data'][1], fw_version['data'][2], fw_version['data'][3]]
+        fw_ver_out = fw_version.payload[:4].tolist()
         
-        return jsonify({
+        return with_etag((jsonify({
             "status": "success",
             "fw_version": '.'.join(map(str, fw_ver_out)),
             "command_sent": "0xe0,0x00,0x01,0x3e,0xff,0x03,0x52,0x50,0x10",
-            "command_response": ','.join([f'0x{x:02x}' for x in fw_version['data']]),
+            "command_response": ','.join([f'0x{x:02x}' for x in fw_version.payload]),
             "register": "0x10"
-        }), 200
+        }), 200), com_port, 0x10, fw_version)
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/stream/telemetry', methods=['GET'])
+def stream_telemetry():
+    com_port = request.args.get('com_port')
+    baud_rate = int(request.args.get('baud_rate'))
+
+    def events():
+        subscription = telemetry_hub.subscribe(com_port, baud_rate)
+        try:
+            while True:
+                try:
+                    sample = subscription.get(timeout=15)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'data: %s\n\n' % json.dumps(sample)
+        finally:
+            telemetry_hub.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def sdram_chunks(com_port, baud_rate, address, size):
+    # The port stays locked until the last chunk is sent or the client goes away
+    with serial_pool.connection(com_port, baud_rate) as cmd_gen:
+        block_size = cmd_gen.sdram_block_size()
+        offset = 0
+        while offset < size:
+            data = cmd_gen.read_sdram_block(address + offset, min(size - offset, block_size))
+            if not data:
+                raise IOError('SDRAM read failed at 0x%x' % (address + offset))
+            yield data
+            offset += len(data)
+
+@app.route('/sdram', methods=['GET'])
+def download_sdram():
+    com_port = request.args.get('com_port')
+    baud_rate = int(request.args.get('baud_rate'))
+    try:
+        address = int(request.args.get('addr'), 0)
+        size = int(request.args.get('size'), 0)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "addr and size are required"}), 400
+    if size <= 0 or size % 4 != 0:
+        return jsonify({"status": "error", "message": "size must be a positive multiple of 4"}), 400
+
+    stream = sdram_chunks(com_port, baud_rate, address, size)
+    try:
+        # Read the first chunk up front so a dead device still gets a proper error
+        first = next(stream)
+    except Exception as e:
+        return error_response(e)
+
+    def body():
+        try:
+            yield first
+            yield from stream
+        finally:
+            stream.close()
+
+    return Response(body(), mimetype='application/octet-stream',
+                    headers={'Content-Disposition': 'attachment; filename="sdram_0x%x.bin"' % address,
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data = request.json
+    try:
+        job = job_manager.submit(data.get('com_port'), int(data.get('baud_rate')),
+                                 data.get('operation'), data.get('params'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except JobRejected as e:
+        return jsonify({"status": "error", "message": str(e)}), 429
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "job": job}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"status": "success", "jobs": job_manager.list()}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify({"status": "success", "job": job}), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job, result = job_manager.result(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    if job['state'] != 'succeeded':
+        return jsonify({"status": "error", "message": "Job is %s" % job['state'], "job": job}), 409
+    return jsonify({"status": "success", "job": job, "result": result}), 200
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify({"status": "success", "job": job}), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+
+    def events(job):
+        yield 'data: %s\n\n' % json.dumps(job)
+        while job['state'] not in FINISHED_STATES:
+            changed = job_manager.wait(job_id, job['version'], 15)
+            if changed is None:
+                return
+            if changed['version'] == job['version']:
+                yield ': keepalive\n\n'
+                continue
+            job = changed
+            yield 'data: %s\n\n' % json.dumps(job)
+
+    return Response(events(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/link_profile', methods=['GET'])
+def get_link_profile():
+    # Measured by the characterize_link job
+    profile = LINK_PROFILES.get(request.args.get('com_port'))
+    if profile is None:
+        return jsonify({"status": "error", "message": "Link not characterized"}), 404
+    return jsonify({"status": "success", "profile": profile.to_dict()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # In broker mode the serial traffic, and so the counters, live in the broker
+    if broker_socket:
+        text = serial_pool.metrics_text()
+    else:
+        text = DEVICE_METRICS.render()
+    return Response(text, mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     # Use environment variable for port, defaulting to 8000 if not set
     port = int(os.environ.get('PORT', 8000))
+    start_background()
     # In production, you typically want to set debug to False
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,231 @@
+import asyncio
+import time
+
+import serial
+from cmd_cls_v3 import CMD
+from command_journal import SENT, RECEIVED
+from register_map import REGISTER_MAP
+from sensor_comm_v3 import SensorComm
+
+
+class AsyncSerialTransport:
+    '''
+    Non-blocking wrapper around a pyserial port for use from asyncio.
+    Incoming bytes are collected by an event loop reader callback, so
+    waiting for a reply never blocks the loop or needs a thread.
+    '''
+
+    def __init__(self, ser, loop=None):
+        self.ser = ser
+        self.loop = loop or asyncio.get_running_loop()
+        self._buffer = bytearray()
+        self._data_event = asyncio.Event()
+        self._closed = False
+        self.loop.add_reader(self.ser.fileno(), self._on_readable)
+
+    @classmethod
+    async def open(cls, com_port, baud_rate):
+        ser = serial.Serial(com_port, baud_rate, timeout=0)
+        return cls(ser)
+
+    def _on_readable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError):
+            self.close()
+            return
+        if data:
+            self._buffer += data
+            self._data_event.set()
+
+    async def read(self, size, timeout):
+        # Same contract as Serial.read: returns fewer bytes on timeout
+        deadline = time.monotonic() + timeout
+        while len(self._buffer) < size and not self._closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._data_event.clear()
+            try:
+                await asyncio.wait_for(self._data_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    @property
+    def port(self):
+        return self.ser.port
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def reset_buffers(self):
+        self._buffer.clear()
+        self.ser.reset_input_buffer()
+        self.ser.reset_output_buffer()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._data_event.set()
+        self.loop.remove_reader(self.ser.fileno())
+        self.ser.close()
+
+
+class AsyncSensorComm(CMD):
+    '''
+    asyncio version of the CMD command set. Every command method
+    (fpga_read, fpga_write, i2c_read, get_sdram_data, ...) builds its packet
+    with con_cmd as usual and returns an awaitable that resolves to the same
+    response dict as the blocking driver. Transactions on one device are
+    serialized by a lock, different devices run concurrently on one loop.
+    Only the new IDD framing is supported.
+    '''
+
+    register_map = REGISTER_MAP
+    sdram_chunk_size = SensorComm.sdram_chunk_size
+
+    def __init__(self, transport, dev_name=None, idd='new', timeout=5):
+        if(idd!='new'):
+            raise ValueError('AsyncSensorComm only supports the new IDD')
+        CMD.__init__(self, None, dev_name=dev_name, idd=idd)
+        self.transport = transport
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, com_port, baud_rate, dev_name=None, timeout=5):
+        transport = await AsyncSerialTransport.open(com_port, baud_rate)
+        return cls(transport, dev_name=dev_name, timeout=timeout)
+
+    def close(self):
+        self.transport.close()
+
+    def port_name(self):
+        return self.transport.port
+
+    def baud_rate(self):
+        return self.transport.ser.baudrate
+
+    async def write_packet(self, cmd):
+        self.transport.reset_buffers()
+        self.framer.clear()
+        self.transport.write(cmd)
+        self.metrics.inc('device_bytes_sent_total', self.port_name(), len(cmd))
+        if(self.journal!=None):
+            self.journal.record(SENT, self.port_name(), cmd)
+        self.last_cmd = cmd
+
+    async def read_packet(self, sequence, cmd_id, cmd_type, timeout=None):
+        if(timeout==None):
+            timeout = self.timeout
+        framer = self.framer
+        metrics = self.metrics
+        port = self.port_name()
+        try:
+            while(1):
+                frame = framer.next_frame()
+                if(frame==None):
+                    data = await self.transport.read(min(framer.needed(), framer.free()), timeout)
+                    metrics.inc('device_bytes_received_total', port, len(data))
+                    if(len(data)!=0):
+                        if(self.journal!=None):
+                            self.journal.record(RECEIVED, port, data)
+                        framer.feed(data)
+                        continue
+                    frame = self.resync_frame()
+                    if(frame==None):
+                        metrics.inc('device_timeouts_total', port)
+                        return -1, None
+                if((frame[1]<<8 | frame[2])!=sequence):
+                    metrics.inc('device_response_mismatches_total', port)
+                    continue
+                if((frame[8]<<8 | frame[9])==cmd_id and frame[6]==cmd_type):
+                    return 0, frame
+                metrics.inc('device_response_mismatches_total', port)
+                self.logger.warning('Mismatched response to command %s'%[hex(i) for i in self.last_cmd])
+                return -1, None
+        finally:
+            self.record_framer_stats(port)
+
+    def send_receive_response(self, cmd, retry=2):
+        # Expected reply fields are taken from the packet itself, con_cmd
+        # may already have built the next packet by the time this runs
+        sequence = cmd[1]<<8 | cmd[2]
+        cmd_type = cmd[6]
+        cmd_id = cmd[7]<<8 | cmd[8]
+        return self._send_receive(cmd, sequence, cmd_id, cmd_type, retry)
+
+    async def _send_receive(self, cmd, sequence, cmd_id, cmd_type, retry):
+        port = self.port_name()
+        key = self.cmd_key(cmd_id)
+        policy = self.timeout_policy
+        wire = 0.0 if policy==None else self.wire_time(cmd)
+        async with self._lock:
+            start = time.perf_counter()
+            for i in range(retry):
+                if(i>0):
+                    self.metrics.inc('device_command_retries_total', port)
+                timeout = self.timeout
+                if(policy!=None):
+                    timeout = policy.timeout(port, key, i, self.timeout, wire)
+                sent = time.perf_counter()
+                await self.write_packet(cmd)
+                status, rd_cmd = await self.read_packet(sequence, cmd_id, cmd_type, timeout)
+                end = time.perf_counter()
+                if(status==0):
+                    self.metrics.observe(port, key, end-start)
+                    if(policy!=None and i==0):
+                        policy.observe(port, key, end-sent, wire)
+                    return self.parse_response(rd_cmd)
+                if(policy!=None and end-sent>=timeout):
+                    policy.timed_out(port, key)
+                self.logger.warning('Read Unsuccessful')
+        self.metrics.inc('device_command_failures_total', port)
+        self.logger.critical('Communication Link seems to be broken')
+        return None
+
+    async def ping_device(self):
+        response = await self.ping(5)
+        return response!=None
+
+    async def read_register(self, name):
+        register = self.register_map[name]
+        responses = []
+        for method, args in register.read_calls():
+            response = await getattr(self, method)(*args)
+            if(response==None):
+                return register.error
+            responses.append(response)
+        data = register.raw_from_responses(responses)
+        if(data==None):
+            return register.error
+        return register.decode(data)
+
+    async def read_registers(self, names):
+        values = {}
+        for name in names:
+            values[name] = await self.read_register(name)
+        return values
+
+    async def get_device_firmware_version(self):
+        return await self.read_register('firmware_version')
+
+    async def read_data_sdram(self, address, size):
+        if(size%4!=0):
+            self.logger.info('Size not a multiple of 4')
+            return None
+        data = []
+        while(size>0):
+            chunk = min(size, self.sdram_chunk_size)
+            await self.set_sdram_addr(address)
+            response = await self.get_sdram_data(chunk)
+            if(response==None):
+                return None
+            data.extend(response.payload)
+            address += chunk
+            size -= chunk
+        return data
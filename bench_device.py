@@ -0,0 +1,350 @@
+'''
+End to end benchmarks of the device stack against device_simulator. Every
+scenario runs SensorComm (and for the page load the Flask app with its
+serial pool) over a pty, so the numbers cover framing, the serial port,
+timeouts and pipelining but no hardware.
+
+    python bench_device.py --output bench_results.json
+    python bench_device.py --save-baseline bench_baseline.json
+    python bench_device.py --baseline bench_baseline.json
+
+With --baseline every metric is compared against the saved run and the
+exit status is 1 when one got worse by more than --tolerance. Metrics
+ending in _per_second are better higher, all others are seconds.
+'''
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import serial
+
+from command_trace import TraceRing
+from device_simulator import DeviceSimulator, Faults
+from register_map import REGISTER_MAP, FPGA
+from sensor_comm_v3 import SensorComm
+
+# The registers the "Get All Defaults" button reads, see getAllDefaults in app.py
+DEFAULT_REGISTERS = (0xd0, 0xd4, 0x86, 0x52, 0x51, 0x91, 0x66, 0x67, 0x10)
+
+ERASE_METHODS = (('erase_qspi_64KB', '64K'), ('erase_qspi_32KB', '32K'), ('erase_qspi_4KB', '4K'))
+QSPI_STATUS = 0xA008
+
+
+class QuietJob:
+    '''Stands in for a job so progress goes nowhere instead of the console'''
+
+    def progress(self, stage, done=None, total=None):
+        pass
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class Bench:
+    def __init__(self, simulator, comm, options):
+        self.simulator = simulator
+        self.comm = comm
+        self.options = options
+        # A pty takes any baud rate, the simulator does the pacing
+        self.baud_rate = options.baud or 115200
+
+
+def percentile(values, fraction):
+    '''Nearest rank percentile of a non empty list'''
+    values = sorted(values)
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def latency_metrics(samples):
+    return {
+        "p50_seconds": percentile(samples, 0.50),
+        "p99_seconds": percentile(samples, 0.99),
+        "mean_seconds": sum(samples) / len(samples),
+    }
+
+
+def timed(function, count):
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        function(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def require(condition, message):
+    if not condition:
+        raise RuntimeError(message)
+
+
+def bench_fpga_read(bench):
+    comm = bench.comm
+    timed(lambda i: comm.fpga_read(0x10), bench.options.warmup)
+    responses = []
+    samples = timed(lambda i: responses.append(comm.fpga_read(0x10)), bench.options.samples)
+    require(all(r is not None for r in responses), 'fpga_read failed')
+    return latency_metrics(samples), {}
+
+
+def bench_fpga_write(bench):
+    comm = bench.comm
+    timed(lambda i: comm.fpga_write(0x77, i), bench.options.warmup)
+    responses = []
+    samples = timed(lambda i: responses.append(comm.fpga_write(0x77, i)), bench.options.samples)
+    require(all(r is not None for r in responses), 'fpga_write failed')
+    return latency_metrics(samples), {}
+
+
+def bench_register_ops(bench):
+    '''Sequential reads and writes, then pipelined reads of the register map'''
+    comm = bench.comm
+    count = bench.options.samples
+    start = time.perf_counter()
+    for i in range(count):
+        if i % 2:
+            comm.fpga_write(0xD0, i & 0xFF)
+        else:
+            comm.fpga_read(0xD0)
+    sequential = time.perf_counter() - start
+
+    names = [name for name, register in REGISTER_MAP.registers.items() if register.bus == FPGA]
+    rounds = max(count // len(names), 1)
+    start = time.perf_counter()
+    for i in range(rounds):
+        comm.read_registers(names)
+    pipelined = time.perf_counter() - start
+    return {
+        "ops_per_second": count / sequential,
+        "pipelined_reads_per_second": rounds * len(names) / pipelined,
+    }, {"registers": len(names)}
+
+
+def bench_read_data_sdram(bench):
+    comm = bench.comm
+    size = bench.options.sdram_size
+    address = 0x100000
+    rng = random.Random(1)
+    bench.simulator.model.sdram[address:address+size] = bytes(rng.getrandbits(8) for i in range(size))
+    start = time.perf_counter()
+    data = comm.read_data_sdram(address, size)
+    elapsed = time.perf_counter() - start
+    require(bytes(data) == bytes(bench.simulator.model.sdram[address:address+size]),
+            'read_data_sdram returned wrong data')
+    return {"kb_per_second": size / 1024.0 / elapsed, "wall_seconds": elapsed}, \
+        {"bytes": size, "chunk_size": comm.sdram_chunk_size}
+
+
+def bench_store_reticle(bench):
+    comm = bench.comm
+    size = bench.options.reticle_size
+    address = 0x200000
+    rng = random.Random(2)
+    image = [rng.getrandbits(8) for i in range(size)]
+    start = time.perf_counter()
+    comm.store_reticle(address, image)
+    elapsed = time.perf_counter() - start
+    require(bytes(bench.simulator.model.sdram[address:address+size]) == bytes(image),
+            'store_reticle wrote wrong data')
+    return {"kb_per_second": size / 1024.0 / elapsed, "wall_seconds": elapsed}, \
+        {"bytes": size, "chunk_size": comm.sdram_chunk_size}
+
+
+def bench_erase_qspi(bench):
+    '''
+    An unaligned range, so the plan mixes 4K, 32K and 64K erases. device
+    seconds is the time spent in commands, the rest is status polling.
+    '''
+    comm = bench.comm
+    address, size = bench.options.erase_range
+    plan = []
+
+    def recorder(method, label):
+        def erase(dest_addr, block_num):
+            plan.append('%s x%d at 0x%x' % (label, block_num, dest_addr))
+            return method(dest_addr, block_num)
+        return erase
+
+    for name, label in ERASE_METHODS:
+        setattr(comm, name, recorder(getattr(comm, name), label))
+    ring = TraceRing()
+    comm.set_trace(ring)
+    try:
+        start = time.perf_counter()
+        ret = comm.erase_qspi(address, size)
+        elapsed = time.perf_counter() - start
+    finally:
+        comm.set_trace(None)
+        for name, label in ERASE_METHODS:
+            delattr(comm, name)
+    require(ret != -1, 'erase_qspi failed')
+    transactions = ring.snapshot()
+    return {
+        "wall_seconds": elapsed,
+        "device_seconds": sum(t.total() for t in transactions),
+    }, {
+        "plan": plan,
+        "erase_commands": len(plan),
+        "status_polls": sum(1 for t in transactions if t.cmd == QSPI_STATUS),
+        "range": [hex(address), hex(size)],
+    }
+
+
+def bench_get_all_defaults(bench):
+    '''GET / and the /registers/batch request of the "Get All Defaults" button'''
+    import app
+    client = app.app.test_client()
+    port = bench.simulator.port
+    body = {"com_port": port, "baud_rate": bench.baud_rate,
+            "operations": [{"op": "read", "address": address} for address in DEFAULT_REGISTERS]}
+
+    def load(i):
+        require(client.get('/').status_code == 200, 'GET / failed')
+        response = client.post('/registers/batch', json=body)
+        require(response.status_code == 200, 'Get All Defaults failed: %s' % response.get_json())
+
+    try:
+        timed(load, bench.options.warmup)
+        samples = timed(load, max(bench.options.samples // 10, 10))
+    finally:
+        app.serial_pool.close_all()
+    return latency_metrics(samples), {"registers": len(DEFAULT_REGISTERS)}
+
+
+SCENARIOS = (
+    ('fpga_read', bench_fpga_read),
+    ('fpga_write', bench_fpga_write),
+    ('register_ops', bench_register_ops),
+    ('read_data_sdram', bench_read_data_sdram),
+    ('store_reticle', bench_store_reticle),
+    ('erase_qspi', bench_erase_qspi),
+    ('get_all_defaults', bench_get_all_defaults),
+)
+
+
+def run(options):
+    faults = Faults(drop_rate=options.drop_rate)
+    simulator = DeviceSimulator(baud_rate=options.baud, latency=options.latency, faults=faults,
+                                seed=options.seed)
+    port = simulator.start()
+    ser = serial.Serial(port, options.baud or 115200, timeout=5)
+    comm = SensorComm(ser, dev_name='Athena640', idd='new')
+    comm.job = QuietJob()
+    bench = Bench(simulator, comm, options)
+    results = {}
+    try:
+        for name, scenario in SCENARIOS:
+            if options.scenario and name not in options.scenario:
+                continue
+            start = time.perf_counter()
+            # erase_qspi and friends print as they go
+            with contextlib.redirect_stdout(io.StringIO()):
+                metrics, info = scenario(bench)
+            results[name] = {"metrics": metrics, "info": info,
+                             "seconds": time.perf_counter() - start}
+            print('%-18s %s' % (name, ' '.join('%s=%.4g' % item for item in sorted(metrics.items()))),
+                  file=sys.stderr)
+    finally:
+        ser.close()
+        simulator.stop()
+    return {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "baud": options.baud,
+            "latency": options.latency,
+            "drop_rate": options.drop_rate,
+            "samples": options.samples,
+            "sdram_size": options.sdram_size,
+            "reticle_size": options.reticle_size,
+            "erase_range": [hex(value) for value in options.erase_range],
+        },
+        "simulator": simulator.stats,
+        "results": results,
+    }
+
+
+def higher_is_better(metric):
+    return metric.endswith('_per_second')
+
+
+def compare(current, baseline, tolerance=0.2):
+    '''
+    Changes of every metric present in both runs, worst first. change is
+    the relative change in the direction of better, a regression is a
+    change below -tolerance.
+    '''
+    changes = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric, value in result['metrics'].items():
+            old = base['metrics'].get(metric)
+            if not old or value is None:
+                continue
+            change = (value - old) / old
+            if not higher_is_better(metric):
+                change = -change
+            changes.append({"scenario": name, "metric": metric, "baseline": old,
+                            "current": value, "change": change,
+                            "regression": change < -tolerance})
+    changes.sort(key=lambda c: c['change'])
+    return changes
+
+
+def _erase_range(text):
+    address, size = text.split(':')
+    return int(address, 0), int(size, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Device stack benchmarks on the simulator')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--save-baseline', help='also write the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change counted as a regression')
+    parser.add_argument('--scenario', action='append',
+                        choices=[name for name, scenario in SCENARIOS], help='run only these')
+    parser.add_argument('--baud', type=int, default=115200,
+                        help='simulated link speed, 0 to measure the host side alone')
+    parser.add_argument('--latency', type=float, default=0.0005, help='device seconds per command')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='replies the device drops')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--samples', type=int, default=500, help='commands per latency scenario')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--sdram-size', type=int, default=0x8000)
+    parser.add_argument('--reticle-size', type=int, default=0x4000)
+    parser.add_argument('--erase-range', type=_erase_range, default=(0x10C000, 0x5F000),
+                        help='address:size')
+    options = parser.parse_args()
+
+    results = run(options)
+    for path in (options.output, options.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if not options.baseline:
+        return 0
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != results['settings']:
+        print('Warning: baseline was run with different settings', file=sys.stderr)
+    changes = compare(results, baseline, options.tolerance)
+    for c in changes:
+        print('%-18s %-28s %12.4g -> %-12.4g %+6.1f%%%s' % (
+            c['scenario'], c['metric'], c['baseline'], c['current'], 100 * c['change'],
+            '  REGRESSION' if c['regression'] else ''))
+    return 1 if any(c['regression'] for c in changes) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,40 @@
+import math
 import random as rn
 import serial
 import time
 import logging
+import os
 import sys
+from collections import OrderedDict, deque
+from device_metrics import DEVICE_METRICS
+from packet_encoder import PacketEncoder
+from frame_parser import FrameParser, OldFrameParser
+from command_journal import CommandJournal, SENT, RECEIVED
+from command_trace import Transaction
+from device_response import Response
+from timeout_policy import TIMEOUT_POLICY
 
 logger_d = logging.getLogger(__name__)
 
-cmd_log_file = "./cmd_log.txt"
+# Every byte on the wire goes to the CMD_JOURNAL file, if set
+journal_file = os.environ.get('CMD_JOURNAL')
+COMMAND_JOURNAL = CommandJournal(journal_file) if journal_file else None
+
+# Deadline timeouts are rounded up to this, setting ser.timeout costs a
+# termios round trip
+TIMEOUT_STEP = 0.01
+
+class DeadlineExceeded(Exception):
+    pass
 
 class CMD:
+    # Packets kept in flight by send_receive_pipelined, 1 is stop-and-wait
+    pipeline_window = 4
+    # Sink for per stage timings, see command_trace
+    trace = None
+    # Learns read timeouts from measured round trips, None keeps the port's
+    timeout_policy = TIMEOUT_POLICY
+
     def __init__(self, ser=None, dev_name=None, idd='old'):
         self.ser = ser
         self.idd = idd
@@ -17,6 +43,13 @@ class CMD:
         self.mem_cmd_type = 0
         self.dev_name = dev_name
         self.logger = logger_d
+        self.metrics = DEVICE_METRICS
+        self.journal = COMMAND_JOURNAL
+        self.deadline = None
+        self.attempt_deadline = None
+        self.read_timeout = None if ser==None else ser.timeout
+        self.collecting = None
+        self.trace_marks = None
         logFormatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s]  %(message)s")
         consoleHandler = logging.StreamHandler(sys.stdout)
         consoleHandler.setFormatter(logFormatter)
@@ -25,8 +58,14 @@ class CMD:
         
         if(self.idd=='new'):
             self.init_cmd_new_idd()
+            self.encoder = PacketEncoder(self.idd, self.header, self.dev_id, self.dev_no,
+                                         self.footer1, self.footer2)
+            self.framer = FrameParser(self.response_header, self.dev_id, self.dev_no,
+                                      self.footer1, self.footer2)
         else:
             self.init_cmd_old_idd()
+            self.encoder = PacketEncoder(self.idd, self.header, self.dev_id, self.dev_no)
+            self.framer = OldFrameParser(self.header, self.dev_id, self.dev_no)
     
     def __del__(self):
         handlers = self.logger.handlers[:]
@@ -124,6 +163,113 @@ class CMD:
     
     def set_port(self, ser_port):
         self.ser = ser_port
+        self.read_timeout = None if ser_port==None else ser_port.timeout
+
+    def port_name(self):
+        if(self.ser!=None):
+            return self.ser.port
+        return self.dev_name
+
+    def set_read_timeout(self, timeout):
+        '''
+        The port's read timeout. read_bytes shortens ser.timeout for
+        deadlines, so it has to be changed here rather than on the port.
+        '''
+        self.read_timeout = timeout
+        if(self.ser!=None and self.ser.timeout!=timeout):
+            self.ser.timeout = timeout
+
+    def set_deadline(self, deadline):
+        '''
+        deadline is a time.monotonic() value. Until it is cleared with None,
+        serial reads never wait past it and send_receive_response raises
+        DeadlineExceeded instead of retrying once it has passed.
+        '''
+        self.deadline = deadline
+
+    def deadline_passed(self):
+        return self.deadline!=None and time.monotonic()>=self.deadline
+
+    def set_attempt_timeout(self, timeout):
+        '''Bounds the reads for the reply to the packet just sent, None lifts it'''
+        self.attempt_deadline = None if timeout==None else time.monotonic()+timeout
+
+    def read_bytes(self, size):
+        '''
+        ser.read that never waits past the deadline. Under a deadline the
+        port's timeout is only ever shortened, rounded up to TIMEOUT_STEP,
+        and a read that ran out on a timeout shorter than the time left is
+        repeated, so the port is not reconfigured on every read.
+        '''
+        while(1):
+            deadline = self.deadline
+            if(self.attempt_deadline!=None and (deadline==None or self.attempt_deadline<deadline)):
+                deadline = self.attempt_deadline
+            if(deadline==None):
+                if(self.ser.timeout!=self.read_timeout):
+                    self.ser.timeout = self.read_timeout
+                return self.ser.read(size)
+            remaining = deadline - time.monotonic()
+            if(remaining<=0):
+                return b''
+            current = self.ser.timeout
+            if(current==None or current>remaining+TIMEOUT_STEP
+               or (self.read_timeout!=None and current>self.read_timeout)):
+                timeout = math.ceil(remaining/TIMEOUT_STEP)*TIMEOUT_STEP
+                if(self.read_timeout!=None):
+                    timeout = min(timeout, self.read_timeout)
+                self.ser.timeout = timeout
+            data = self.ser.read(size)
+            if(len(data)!=0 or self.ser.timeout==self.read_timeout):
+                return data
+
+    def set_trace(self, sink):
+        '''sink is called with a command_trace.Transaction per command, None stops tracing'''
+        self.trace = sink
+
+    def emit_trace(self, status):
+        marks = self.trace_marks
+        self.trace_marks = None
+        if(marks!=None and self.trace!=None):
+            self.trace(Transaction(self.port_name(), self.mem_cmd_id, self.sequence, status, marks))
+
+    def baud_rate(self):
+        if(self.ser!=None):
+            return self.ser.baudrate
+        return None
+
+    def wire_time(self, packet):
+        '''
+        Seconds packet and its reply spend on the wire at the port's baud
+        rate, 10 bits per byte. SDRAM reads return the bytes asked for and
+        pings echo their payload, other replies carry a few bytes.
+        '''
+        baud_rate = self.baud_rate()
+        if(not baud_rate):
+            return 0.0
+        if(self.idd=='new'):
+            cmd = packet[7]<<8 | packet[8]
+            payload = packet[9:-3]
+            reply = 13
+            sdram_read = cmd==self.GET_SDRAM_DATA and packet[6]==0x52
+        else:
+            cmd = packet[3] | packet[4]<<8
+            payload = packet[7:-1]
+            reply = 8
+            sdram_read = cmd==self.GET_SDRAM_DATA
+        if(sdram_read and len(payload)>=2):
+            reply += payload[0]<<8 | payload[1]
+        elif(cmd==self.PING_CMD):
+            reply += len(payload)
+        else:
+            reply += 4
+        return (len(packet) + reply) * 10.0 / baud_rate
+
+    def cmd_key(self, cmd):
+        # FPGA register commands carry the register address in the low bits
+        if((cmd & 0xF000) in (self.FPGA_RD_REGS, self.FPGA_WR_REGS)):
+            return cmd & 0xF000
+        return cmd
     
     def set_devname(self, dev_name):
         self.dev_name = dev_name
@@ -137,264 +283,343 @@ class CMD:
         
     def write_packet(self, cmd):
         if(self.ser!=None): 
+            marks = self.trace_marks
             self.ser.flushInput()
             self.ser.flushOutput()
-            self.ser.write(bytearray(cmd))
-            print("Command : ",[hex(i) for i in cmd])
+            self.framer.clear()
+            if(marks!=None):
+                marks.append(('flushed', time.perf_counter()))
+            self.ser.write(cmd)
+            if(marks!=None):
+                marks.append(('written', time.perf_counter()))
+            self.metrics.inc('device_bytes_sent_total', self.port_name(), len(cmd))
             self.last_cmd = cmd
-            with open(cmd_log_file, 'a+') as f:
-                f.write('\n COMND : \t')
-                for byte in cmd:
-                    f.write(hex(byte) + ", ")
+            if(self.journal!=None):
+                self.journal.record(SENT, self.port_name(), cmd)
+
+    def receive_frame(self):
+        '''
+        Returns the next valid response frame as a memoryview, valid until
+        the next call, or None when nothing more arrives before the timeout.
+        Bytes are pulled in bulk, whatever is waiting plus what the frame
+        being assembled still needs.
+        '''
+        framer = self.framer
+        metrics = self.metrics
+        port = self.port_name()
+        marks = self.trace_marks
+        first = marks!=None
+        try:
+            while(1):
+                frame = framer.next_frame()
+                if(frame!=None):
+                    break
+                size = min(max(self.ser.in_waiting, framer.needed()), framer.free())
+                data = self.read_bytes(size)
+                metrics.inc('device_bytes_received_total', port, len(data))
+                # Raw, so noise and broken replies the framer drops are kept too
+                if(self.journal!=None and len(data)!=0):
+                    self.journal.record(RECEIVED, port, data)
+                if(first and len(data)!=0):
+                    marks.append(('first_byte', time.perf_counter()))
+                    first = False
+                if(len(data)==0):
+                    frame = self.resync_frame()
+                    if(frame==None):
+                        metrics.inc('device_timeouts_total', port)
+                        return None
+                    break
+                framer.feed(data)
+        finally:
+            self.record_framer_stats(port)
+        if(marks!=None):
+            marks.append(('frame', time.perf_counter()))
+        return frame
+
+    def resync_frame(self):
+        # Nothing more is coming, a stray header byte may hide a frame behind it
+        while(self.framer.resync()):
+            frame = self.framer.next_frame()
+            if(frame!=None):
+                return frame
+        return None
+
+    def record_framer_stats(self, port):
+        skipped, checksum_failures, footer_failures = self.framer.drain_stats()
+        if(skipped):
+            self.metrics.inc('device_header_resyncs_total', port, skipped)
+        if(checksum_failures):
+            self.metrics.inc('device_checksum_failures_total', port, checksum_failures)
+        if(footer_failures):
+            self.metrics.inc('device_footer_failures_total', port, footer_failures)
 
     def read_packet(self):
-        
-        rt_cnt  = 0
-        rt_max  = 10 
-        
-        rd_header   = 0
-        rd_sequence = 0
-        rd_dev_id   = 0
-        rd_dev_num  = 0
-        rd_length   = 0
-        rd_cmd_id   = 0
-        rd_cmd_type = 0
-        
         if(self.ser==None):
             return 
         
-        rd_cmd0 = bytearray (self.ser.read(5)) 
-        if(len(rd_cmd0)!=5):
-            return -1, None 
-
         while(1):
-            
-            if(rt_cnt > rt_max): # return if max number of tries over
-                return -1, None 
-            
-            rd_header   = rd_cmd0[0]
-            rd_sequence = rd_cmd0[2] + (rd_cmd0[1] << 8)
-            rd_dev_id   = rd_cmd0[3]
-            rd_dev_num  = rd_cmd0[4]
-            
-            # rd_sequence = 10
-                        
-            if(rd_header == self.response_header\
-               and rd_sequence == self.sequence\
-               and rd_dev_id   == self.dev_id\
-               and rd_dev_num  == self.dev_no ):
-                
+            frame = self.receive_frame()
+            if(frame==None):
+                return -1, None
+            if(self.idd!='new'):
+                return self.match_old_frame(frame)
+            rd_sequence = frame[1]<<8 | frame[2]
+            if(rd_sequence==self.sequence):
                 break
-            
-            print("\n\nRESPONSE  : ", [hex(i) for i in rd_cmd0])
-            
-            print("\nRECEIVED HEADER")
-            print("rd_header   : ",hex(rd_header))
-            print("rd_sequence : ",hex(rd_sequence))
-            print("rd_dev_id   : ",hex(rd_dev_id))
-            print("rd_dev_name : ",hex(rd_dev_num))
-            
-            print("\nEXPECTED Header")
-            print("rd_header   : ",hex(self.response_header))
-            print("rd_sequence : ",hex(self.sequence))
-            print("rd_dev_id   : ",hex(self.dev_id))
-            print("rd_dev_name : ",hex(self.dev_no ))
-            
-            rd_cmd1 = self.ser.read(1) 
-            if(len(rd_cmd1)!=1):
-                return -1, None # return if buffer dosnt have any data
-                    
-            temp_rrd_cmd0 = rd_cmd0
-            rd_cmd0 = temp_rrd_cmd0[1:] + rd_cmd1
-            
-            rt_cnt = rt_cnt +1
-         
-        rd_cmd2 = self.ser.read(1) 
-        if(len(rd_cmd2) != 1):
-            return -1, None 
-        
-        rd_length = rd_cmd2[0]
-        
-        expected_bytes_avail = rd_length+3
-        rd_cmd3 = self.ser.read(expected_bytes_avail)
-        
-        if(len(rd_cmd3) != expected_bytes_avail):
-            return -1, None
-        
-        rd_csm     = rd_cmd3[-3]
-        rd_footer1 = rd_cmd3[-2]
-        rd_footer2 = rd_cmd3[-1]
-        
-        rd_cmd_type  = rd_cmd3[0]
-        rd_cmd_id    = rd_cmd3[3] + (rd_cmd3[2] << 8)  
-
-        crc = 0
-        crc = crc + rd_dev_id + rd_dev_num + rd_length
-        for data in rd_cmd3 [0: -3]:            
-            crc = crc + data
-        crc = crc%256
-        
-        response = rd_cmd0 + rd_cmd2 + rd_cmd3
-        with open(cmd_log_file, 'a+') as f:
-            f.write('\n REPLY : \t')
-            for byte in response:
-                f.write(hex(byte) + ", ")
-
-        if(rd_csm == crc\
-           and rd_footer1  == self.footer1\
-           and rd_footer2  == self.footer2\
-           and rd_cmd_id   == self.mem_cmd_id\
+            # Late reply to an earlier command, keep looking
+            self.metrics.inc('device_response_mismatches_total', self.port_name())
+
+        rd_cmd_type = frame[6]
+        rd_cmd_id   = frame[8]<<8 | frame[9]
+        if(rd_cmd_id   == self.mem_cmd_id\
            and rd_cmd_type == self.mem_cmd_type):
-            
-            print("response : ", [hex(i) for i in rd_cmd0 + rd_cmd2 + rd_cmd3])
-                        
-            return 0, rd_cmd0 + rd_cmd2 + rd_cmd3
-        print("\n\nCOMMAND SEND       : ", [hex(i) for i in self.last_cmd])
-        print("COORUPTED RESPONSE  : ", [hex(i) for i in rd_cmd0 + rd_cmd2 + rd_cmd3])
-        print("\nRECEIVED Footer ERROR ")       
-        print("rd_cmd_id    : ",hex(rd_cmd_id))
-        print("rd_cmd_type  : ",hex(rd_cmd_type))
-        print("rd_csm       : ",hex(rd_csm))
-        print("rd_footer1   : ",hex(rd_footer1))
-        print("rd_footer2   : ",hex(rd_footer2))        
-        print("\nEXPECTED Footer")        
-        print("rd_cmd_id    : ",hex(self.mem_cmd_id)) 
-        print("rd_cmd_type  : ",hex(self.mem_cmd_type))
-        print("rd_csm       : ",hex(crc))
-        print("rd_footer1   : ",hex(self.footer1))
-        print("rd_footer2   : ",hex(self.footer2))
-        
-        with open(cmd_log_file, 'a+') as f:
-            f.write("\n\nCOORUPTED RESPONSE  : ")
-            f.write("\nRECEIVED Footer ERROR ")       
-            f.write("\nrd_cmd_id    : "+str(hex(rd_cmd_id)))
-            f.write("\nrd_cmd_type  : "+str(hex(rd_cmd_type)))
-            f.write("\nrd_csm       : "+str(hex(rd_csm)))
-            f.write("\nrd_footer1   : "+str(hex(rd_footer1)))
-            f.write("\nrd_footer2   : "+str(hex(rd_footer2))) 
-            
-            f.write("\n\nEXPECTED Footer")        
-            f.write("\nrd_cmd_id    : "+str(hex(self.mem_cmd_id))) 
-            f.write("\nrd_cmd_type  : "+str(hex(self.mem_cmd_type)))
-            f.write("\nrd_csm       : "+str(hex(crc)))
-            f.write("\nrd_footer1   : "+str(hex(self.footer1)))
-            f.write("\nrd_footer2   : "+str(hex(self.footer2)))
-            f.write("\n")
+            return 0, frame
         
+        self.metrics.inc('device_response_mismatches_total', self.port_name())
+        self.logger.warning('Response to command 0x%04x/0x%02x carries 0x%04x/0x%02x'
+                            %(self.mem_cmd_id, self.mem_cmd_type, rd_cmd_id, rd_cmd_type))
         return -1, None
         
+    def match_old_frame(self, frame):
+        # Old IDD replies carry no sequence, only the command or 0xDEAD
+        rd_cmd_id = frame[3] | frame[4]<<8
+        if(rd_cmd_id==self.mem_cmd_id or rd_cmd_id==0xDEAD):
+            return 0, frame
+        self.metrics.inc('device_response_mismatches_total', self.port_name())
+        self.logger.warning('Response to command 0x%04x carries 0x%04x'%(self.mem_cmd_id, rd_cmd_id))
+        return -1, None
+
+    def parse_response(self, rd_cmd):
+        return Response(rd_cmd, self.idd)
+
     def split_num(self, data, split_way=4, endian=0):
-        l = []
-        mask = 0xFF
-        for i in range(split_way):
-            l.append((data & (mask << (8*i))) >> (8*i))
-        if(endian==0):
-            return l[::-1]
-        else:
-            return l
+        # endian 0 is most significant byte first
+        data = data & ((1 << (8*split_way)) - 1)
+        return data.to_bytes(split_way, 'big' if endian==0 else 'little')
         
+    def build_packet(self, method, *args):
+        '''
+        Runs a single packet command method such as fpga_read or
+        get_sdram_data without sending anything and returns its packet
+        '''
+        self.collecting = []
+        try:
+            getattr(self, method)(*args)
+            packets = self.collecting
+        finally:
+            self.collecting = None
+        if(len(packets)!=1):
+            raise ValueError('%s does not send exactly one packet'%method)
+        return packets[0]
+
+    def call_pipelined(self, calls, window=None, retry=2):
+        '''
+        calls is a list of (method, args) of single packet commands, the
+        responses come back in the same order, None where a command failed
+        '''
+        if(window==None):
+            window = self.pipeline_window
+        if(self.idd!='new' or window<=1):
+            return [getattr(self, method)(*args) for method, args in calls]
+        packets = [self.build_packet(method, *args) for method, args in calls]
+        return self.send_receive_pipelined(packets, window, retry)
+
+    def send_receive_pipelined(self, packets, window=None, retry=2):
+        '''
+        Sends packets keeping up to window of them in flight and matches
+        every reply to its packet by sequence number. The device answers in
+        order, so a reply also tells that every packet sent before it and
+        still outstanding got lost. Lost packets are resent up to retry
+        attempts in total, the responses are returned in packet order with
+        None for a packet that failed.
+        '''
+        if(self.idd!='new'):
+            raise ValueError('Pipelining needs the new IDD framing')
+        if(window==None):
+            window = self.pipeline_window
+        if(window<=1):
+            responses = []
+            for packet in packets:
+                # read_packet checks the reply against the last built packet
+                self.sequence = packet[1]<<8 | packet[2]
+                self.mem_cmd_type = packet[6]
+                self.mem_cmd_id = packet[7]<<8 | packet[8]
+                responses.append(self.send_receive_response(packet, retry))
+            return responses
+
+        metrics = self.metrics
+        port = self.port_name()
+        trace = self.trace
+        policy = self.timeout_policy
+        self.trace_marks = None
+        responses = [None]*len(packets)
+        attempts = [0]*len(packets)
+        pending = deque(range(len(packets)))
+        in_flight = OrderedDict()
+        # The device answers in order, the oldest packet is only being
+        # worked on once the reply before it came back
+        last_reply = 0
+        self.ser.reset_input_buffer()
+        self.framer.clear()
+        while(pending or in_flight):
+            while(pending and len(in_flight)<window and not self.deadline_passed()):
+                i = pending.popleft()
+                packet = packets[i]
+                if(attempts[i]>0):
+                    metrics.inc('device_command_retries_total', port)
+                attempts[i] += 1
+                self.ser.write(packet)
+                metrics.inc('device_bytes_sent_total', port, len(packet))
+                if(self.journal!=None):
+                    self.journal.record(SENT, port, packet)
+                in_flight[packet[1]<<8 | packet[2]] = (i, time.perf_counter())
+            if(not in_flight):
+                break
+
+            if(policy!=None):
+                i, sent_at = next(iter(in_flight.values()))
+                packet = packets[i]
+                timeout = policy.timeout(port, self.cmd_key(packet[7]<<8 | packet[8]), attempts[i]-1,
+                                         wire=self.wire_time(packet))
+                if(timeout==None):
+                    self.attempt_deadline = None
+                else:
+                    started = max(sent_at, last_reply)
+                    self.attempt_deadline = time.monotonic() + started + timeout - time.perf_counter()
+
+            lost = []
+            frame = self.receive_frame()
+            if(frame==None):
+                # Nothing more is coming, everything outstanding is lost
+                if(policy!=None and self.attempt_deadline!=None
+                   and time.monotonic()>=self.attempt_deadline):
+                    i, sent_at = next(iter(in_flight.values()))
+                    packet = packets[i]
+                    policy.timed_out(port, self.cmd_key(packet[7]<<8 | packet[8]))
+                lost = list(in_flight.values())
+                in_flight.clear()
+            else:
+                sequence = frame[1]<<8 | frame[2]
+                if(sequence not in in_flight):
+                    # Late reply to a packet that was already given up on
+                    metrics.inc('device_response_mismatches_total', port)
+                    continue
+                while(1):
+                    rd_sequence, entry = in_flight.popitem(last=False)
+                    if(rd_sequence==sequence):
+                        break
+                    lost.append(entry)
+                i, sent_at = entry
+                packet = packets[i]
+                cmd = packet[7]<<8 | packet[8]
+                if(frame[6]==packet[6] and (frame[8]<<8 | frame[9])==cmd):
+                    received_at = time.perf_counter()
+                    responses[i] = self.parse_response(frame)
+                    metrics.observe(port, self.cmd_key(cmd), received_at-sent_at)
+                    if(policy!=None and attempts[i]==1):
+                        policy.observe(port, self.cmd_key(cmd), received_at-max(sent_at, last_reply),
+                                       self.wire_time(packet))
+                    last_reply = received_at
+                    if(trace!=None):
+                        trace(Transaction(port, cmd, sequence, 'ok', [('written', sent_at),
+                              ('frame', received_at), ('parsed', time.perf_counter())]))
+                else:
+                    metrics.inc('device_response_mismatches_total', port)
+                    lost.append(entry)
+
+            retry_first = []
+            for i, sent_at in lost:
+                if(attempts[i]<retry and not self.deadline_passed()):
+                    retry_first.append(i)
+                else:
+                    metrics.inc('device_command_failures_total', port)
+            pending.extendleft(sorted(retry_first, reverse=True))
+
+        self.attempt_deadline = None
+        if(pending or (None in responses and self.deadline_passed())):
+            metrics.inc('device_deadline_exceeded_total', port)
+            raise DeadlineExceeded('Deadline exceeded with %d of %d packets answered'
+                                   %(len(packets)-responses.count(None), len(packets)))
+        return responses
+
     def send_receive_response(self, cmd, retry=2):
+        if(self.collecting!=None):
+            self.trace_marks = None
+            self.collecting.append(cmd)
+            return None
+        port = self.port_name()
+        key = self.cmd_key(self.mem_cmd_id)
+        policy = self.timeout_policy
+        wire = 0.0 if policy==None else self.wire_time(cmd)
+        start = time.perf_counter()
+        if(self.trace!=None and self.trace_marks==None):
+            self.trace_marks = [('start', start)]
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         for i in range(retry):            
+            if(self.deadline_passed()):
+                break
+            if(i>0):
+                self.metrics.inc('device_command_retries_total', port)
+            if(policy!=None):
+                self.set_attempt_timeout(policy.timeout(port, key, i, wire=wire))
+            sent = time.perf_counter()
             self.write_packet(cmd)
-            self.logger.debug([hex(i) for i in cmd])            
+            if(debug):
+                self.logger.debug([hex(i) for i in cmd])
             status, rd_cmd = self.read_packet()
        
-            response = {}
             if(status==0):
-                response['data'] = []
-                if(self.idd=='old'):
-                    response['header'] = rd_cmd[0]
-                    response['packet_sequence'] = 0
-                    response['device_id'] = rd_cmd[1]
-                    response['device_number'] = rd_cmd[2]
-                    response['cmd_type'] = 0x57
-                    response['cmd'] = (rd_cmd[4] <<8 | rd_cmd[3])
-                    if(response['cmd']==0xDEAD):
-                        response['cmd_status'] = 1
-                    else:
-                        response['cmd_status'] = 0
-                    response['length'] = (rd_cmd[6] <<8 | rd_cmd[5])
-                    for i in range(response['length']):
-                        response['data'].append(rd_cmd[i+7])
-                    response['chksum'] = rd_cmd[response['length']+1]
-                    response['footer1'] = 255
-                    response['footer2'] = 255
-                else:
-                    response['header'] = rd_cmd[0]
-                    response['packet_sequence'] = (rd_cmd[1]<<8 | rd_cmd[2])
-                    response['device_id'] = rd_cmd[3]
-                    response['device_number'] = rd_cmd[4]
-                    response['length'] = rd_cmd[5]
-                    response['cmd_type'] = rd_cmd[6]
-                    response['cmd_status'] = rd_cmd[7]
-                    response['cmd'] = (rd_cmd[8] <<8 | rd_cmd[9])
-                    for i in range(response['length']-4):
-                        response['data'].append(rd_cmd[i+10])
-                    response['chksum'] = rd_cmd[-3]
-                    response['footer1'] = rd_cmd[-2]
-                    response['footer2'] = rd_cmd[-1]
-               
-                self.logger.debug([hex(i) for i in rd_cmd])
+                response = self.parse_response(rd_cmd)
+                if(debug):
+                    self.logger.debug([hex(i) for i in rd_cmd])
+                end = time.perf_counter()
+                self.metrics.observe(port, key, end-start)
+                if(policy!=None and i==0):
+                    # Only unambiguous samples, a retried packet has the same sequence
+                    policy.observe(port, key, end-sent, wire)
+                if(self.trace_marks!=None):
+                    self.trace_marks.append(('parsed', end))
+                    self.emit_trace('ok')
+                self.attempt_deadline = None
                 return response 
             else:
+                if(policy!=None and self.attempt_deadline!=None
+                   and time.monotonic()>=self.attempt_deadline):
+                    policy.timed_out(port, key)
                 self.logger.warning('Read Unsuccessful')
                 
+        self.attempt_deadline = None
+        self.metrics.inc('device_command_failures_total', port)
+        deadline_passed = self.deadline_passed()
+        if(self.trace_marks!=None):
+            self.emit_trace('deadline' if deadline_passed else 'failed')
+        if(deadline_passed):
+            self.metrics.inc('device_deadline_exceeded_total', port)
+            raise DeadlineExceeded('Deadline exceeded waiting for response to command 0x%04x'%self.mem_cmd_id)
         self.logger.critical('Communication Link seems to be broken')
         return None
      
 
     def con_cmd(self, cmd, cmd_type, length, data):
-        
-        pkt =[]
-        pkt.append(self.header)
-        self.sequence += 1
+        # sequence is 16 bits on the wire, wrap it so replies still match
+        self.sequence = (self.sequence + 1) & 0xFFFF
         self.mem_cmd_id = cmd
         self.mem_cmd_type = cmd_type
-        
-        if(self.idd=='old'):
-            pkt.append(self.dev_id)
-            pkt.append(self.dev_no)
-            pkt.append(cmd & 0xFF)
-            pkt.append(cmd>>8)
-            pkt.append(length & 0xFF)
-            pkt.append(length >> 8)
-            if(length!=0):
-                pkt.extend(data)
-            
-            crc = 0
-            for i in range(len(pkt)-1):
-                crc=crc+pkt[i+1]
-            crc = crc%256
-            crc = ~crc & 0xFF
-            crc = (crc+1)%256
-            return pkt+[crc]
-        
-        else:
-            pkt.append((self.sequence >> 8) & 0xFF)
-            pkt.append((self.sequence & 0xFF))
-            pkt.append(self.dev_id)
-            pkt.append(self.dev_no)
-            pkt.append((length+3) & 0xFF)
-            pkt.append(cmd_type)
-            pkt.append(cmd>>8)
-            pkt.append(cmd & 0xFF)
-            if(length!=0):
-                pkt.extend(data)
-            
-            crc = 0
-            for i in range(len(pkt)-1-2):
-                crc=crc+pkt[i+1+2]
-            crc = crc%256
-            return pkt+[crc, self.footer1, self.footer2]
+        if(self.trace==None):
+            return self.encoder.encode(self.sequence, cmd, cmd_type, length, data)
+        start = time.perf_counter()
+        packet = self.encoder.encode(self.sequence, cmd, cmd_type, length, data)
+        self.trace_marks = [('encode', start), ('encoded', time.perf_counter())]
+        return packet
 
-    def ping(self, ping_length):
+    def ping(self, ping_length, retry=2):
         self.logger.info('Sending PING command')
         cmd = self.PING_CMD
         cmd_type = 0x57
         length = ping_length
         data = [rn.randint(0,255) for x in range(ping_length)]
         packet = self.con_cmd(cmd, cmd_type, length, data)
-        response = self.send_receive_response(packet)
+        response = self.send_receive_response(packet, retry)
         return response
 
     def fpga_read(self, addr):
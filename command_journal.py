@@ -0,0 +1,180 @@
+'''
+Binary journal of every packet sent to and every byte received from the
+devices, turned on by setting CMD_JOURNAL to the file to write. Received
+bytes are recorded as read, before framing, so line noise and broken
+replies are kept. A background thread writes compact records and rotates
+the file by size. Render a journal in the old cmd_log.txt text form, with
+the reads following a packet joined into one reply, with
+
+    python command_journal.py cmd_journal.bin
+    python command_journal.py --verbose --port /dev/ttyUSB0 cmd_journal.bin.1
+    python command_journal.py --reads cmd_journal.bin
+'''
+import argparse
+import atexit
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'CJ01'
+SENT = 0
+RECEIVED = 1
+
+# timestamp, direction, port name length, data length
+RECORD = struct.Struct('<dBBI')
+_LABELS = {SENT: 'COMND', RECEIVED: 'REPLY'}
+
+
+class CommandJournal:
+    '''
+    record() only puts a tuple on a SimpleQueue, so the command path never
+    waits on the disk. The writer thread drains the queue in batches and
+    starts a new file once max_bytes is reached, keeping backup_count old
+    ones as path.1, path.2, ... When more than max_pending records are
+    waiting, new ones are dropped and counted instead.
+    '''
+
+    def __init__(self, path, max_bytes=10*1024*1024, backup_count=5, max_pending=100000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+
+    def record(self, direction, port, data):
+        if self._thread is None:
+            self._start()
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            return
+        self._queue.put((time.time(), direction, port, bytes(data)))
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='command-journal', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self):
+        '''Writes out what is queued and stops the writer thread'''
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _run(self):
+        self._open()
+        try:
+            while True:
+                item = self._queue.get()
+                chunks = []
+                stop = False
+                while item is not None:
+                    timestamp, direction, port, data = item
+                    port = port.encode('utf-8', 'replace')[:255]
+                    chunks.append(RECORD.pack(timestamp, direction, len(port), len(data)))
+                    chunks.append(port)
+                    chunks.append(data)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                else:
+                    stop = True
+                if chunks:
+                    self._file.write(b''.join(chunks))
+                    self._file.flush()
+                    if self._file.tell() >= self.max_bytes:
+                        self._rotate()
+                if stop:
+                    return
+        finally:
+            self._file.close()
+
+
+def read_records(f):
+    '''Yields (timestamp, direction, port, data) from an open journal file'''
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a command journal')
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return
+        timestamp, direction, port_len, data_len = RECORD.unpack(head)
+        port = f.read(port_len).decode('utf-8', 'replace')
+        data = f.read(data_len)
+        if len(data) < data_len:
+            return
+        yield timestamp, direction, port, data
+
+
+def join_reads(records):
+    '''Joins consecutive received records of a port, keeping the first timestamp'''
+    pending = None
+    for record in records:
+        if pending is not None:
+            if record[1] == RECEIVED and pending[1] == RECEIVED and record[2] == pending[2]:
+                pending = (pending[0], RECEIVED, pending[2], pending[3] + record[3])
+                continue
+            yield pending
+        pending = record
+    if pending is not None:
+        yield pending
+
+
+def format_record(timestamp, direction, port, data, verbose=False):
+    line = '\n %s : \t' % _LABELS.get(direction, '?????') + ''.join(hex(b) + ', ' for b in data)
+    if verbose:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+        line = '\n%s.%03d %s' % (stamp, int(timestamp * 1000) % 1000, port) + line
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a command journal as text')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--verbose', action='store_true', help='add timestamp and port')
+    parser.add_argument('--port', help='only records of this port')
+    parser.add_argument('--reads', action='store_true',
+                        help='one reply line per read instead of per packet sent')
+    args = parser.parse_args()
+    for path in args.files:
+        with open(path, 'rb') as f:
+            records = read_records(f)
+            if args.port:
+                records = (r for r in records if r[2] == args.port)
+            if not args.reads:
+                records = join_reads(records)
+            for timestamp, direction, port, data in records:
+                sys.stdout.write(format_record(timestamp, direction, port, data, args.verbose))
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+Per stage timing of CMD transactions. A sink is any callable taking a
+Transaction, install one with CMD.set_trace() (or on the CMD class for every
+connection) and remove it with set_trace(None). Without a sink the command
+path only pays a None check per stage.
+
+    ring = TraceRing()
+    comm.set_trace(ring)
+    comm.fpga_read(0x10)
+    ring.summary()
+'''
+from collections import deque
+
+# start       send_receive_response got a packet not built by con_cmd
+# encode      con_cmd starts building the packet
+# encoded     packet built
+# flushed     serial buffers flushed
+# written     packet handed to the serial port
+# first_byte  first reply bytes read
+# frame       complete reply frame found
+# parsed      reply turned into the response dict
+STAGES = ('start', 'encode', 'encoded', 'flushed', 'written', 'first_byte', 'frame', 'parsed')
+
+
+class Transaction:
+    '''
+    One command with its stage timestamps, time.perf_counter() values in
+    the order they happened. A retried command repeats flushed, written, ...
+    '''
+    __slots__ = ('port', 'cmd', 'sequence', 'status', 'stages')
+
+    def __init__(self, port, cmd, sequence, status, stages):
+        self.port = port
+        self.cmd = cmd
+        self.sequence = sequence
+        self.status = status
+        self.stages = stages
+
+    def total(self):
+        if len(self.stages) < 2:
+            return 0.0
+        return self.stages[-1][1] - self.stages[0][1]
+
+    def durations(self):
+        '''(stage, seconds since the previous stage) for every stage after the first'''
+        return [(stage, t - self.stages[i][1])
+                for i, (stage, t) in enumerate(self.stages[1:])]
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "cmd": "0x%04x" % self.cmd,
+            "sequence": self.sequence,
+            "status": self.status,
+            "total": self.total(),
+            "stages": self.durations(),
+        }
+
+
+class TraceRing:
+    '''Sink keeping the last size transactions'''
+
+    def __init__(self, size=1024):
+        self._records = deque(maxlen=size)
+
+    def __call__(self, transaction):
+        self._records.append(transaction)
+
+    def snapshot(self):
+        return list(self._records)
+
+    def clear(self):
+        self._records.clear()
+
+    def summary(self):
+        '''Count, mean and max seconds spent reaching each stage'''
+        stats = {}
+        for transaction in self.snapshot():
+            for stage, seconds in transaction.durations():
+                entry = stats.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+        return {stage: {"count": count, "mean": total / count, "max": worst}
+                for stage, (count, total, worst) in stats.items()}
@@ -0,0 +1,345 @@
+'''
+Device broker: a single process that owns every serial port and runs the
+SensorComm calls, jobs and telemetry pollers for any number of web
+workers. Workers talk to it over a local Unix socket with BrokerClient,
+which has the same connection() interface as SerialPool, so each device
+still sees strictly ordered traffic while HTTP handling scales across
+processes.
+
+    python device_broker.py --socket /tmp/device_broker.sock
+    DEVICE_BROKER_SOCKET=/tmp/device_broker.sock gunicorn -w 4 app:app
+
+Both sides authenticate with DEVICE_BROKER_AUTHKEY. Without it the broker
+writes a random key next to the socket (<socket>.key, mode 0600) and the
+clients read it from there, so only the broker's user can connect.
+'''
+import argparse
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Listener, Client
+
+import serial
+from serial_pool import SerialPool
+from cmd_cls_v3 import DeadlineExceeded
+from jobs import JobManager
+from telemetry import TelemetryHub
+from device_metrics import DEVICE_METRICS
+
+# Seconds between keepalives on an idle telemetry stream, a failed send
+# is how the broker notices a worker went away
+TELEMETRY_KEEPALIVE = 5
+
+
+
+class BrokerError(Exception):
+    pass
+
+
+def key_path(address):
+    return address + '.key'
+
+
+def write_authkey(address):
+    '''Generates a key for the broker at address into its 0600 key file'''
+    key = os.urandom(32)
+    path = key_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def read_authkey(address):
+    '''DEVICE_BROKER_AUTHKEY if set, otherwise the key the broker at address wrote'''
+    key = os.environ.get('DEVICE_BROKER_AUTHKEY', '').encode()
+    if key:
+        return key
+    try:
+        with open(key_path(address), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise BrokerError('No key for the device broker at %s, set DEVICE_BROKER_AUTHKEY '
+                          'or start the broker first' % address)
+
+
+class DeviceBroker:
+    def __init__(self, address, serial_pool, authkey, job_manager=None, telemetry_hub=None):
+        if not authkey:
+            raise BrokerError('The device broker needs an authkey')
+        self.address = address
+        self.serial_pool = serial_pool
+        self.authkey = authkey
+        # Jobs and telemetry polling run here, next to the ports, so every
+        # worker sees the same jobs and a device has one poller
+        self.job_manager = job_manager or JobManager(serial_pool)
+        self.telemetry_hub = telemetry_hub or TelemetryHub(serial_pool)
+        self.listener = None
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Created owner only, there is no window where others can connect
+        umask = os.umask(0o077)
+        try:
+            self.listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except (OSError, EOFError):
+                    if self.listener is None:
+                        break
+                    continue
+                threading.Thread(target=self._serve_client, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            self.serial_pool.close_all()
+
+    def shutdown(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.close()
+
+    def _serve_client(self, conn):
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'metrics':
+                    conn.send(('ok', DEVICE_METRICS.render()))
+                    continue
+                if message[0] == 'jobs':
+                    self._call_jobs(conn, *message[1:])
+                    continue
+                if message[0] == 'telemetry':
+                    self._stream_telemetry(conn, *message[1:])
+                    return
+                if message[0] != 'open':
+                    conn.send(('error', BrokerError('No device session open')))
+                    continue
+                _, com_port, baud_rate, timeout, budget = message
+                # Deadlines travel as remaining seconds, clocks are per process
+                deadline = None if budget is None else time.monotonic() + budget
+                opened = False
+                try:
+                    with self.serial_pool.connection(com_port, baud_rate, timeout,
+                                                     deadline) as comm:
+                        opened = True
+                        conn.send(('ok', None))
+                        self._serve_session(conn, comm)
+                except (serial.SerialException, OSError, DeadlineExceeded) as e:
+                    # Errors inside a session were already reported
+                    if not opened:
+                        conn.send(('error', e))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _call_jobs(self, conn, method, args, kwargs):
+        if method not in RemoteJobManager.methods:
+            conn.send(('error', BrokerError('Unknown method %s' % method)))
+            return
+        try:
+            result = getattr(self.job_manager, method)(*args, **kwargs)
+        except Exception as e:
+            conn.send(('error', e))
+            return
+        conn.send(('ok', result))
+
+    def _stream_telemetry(self, conn, com_port, baud_rate):
+        # The connection carries samples until the worker closes it
+        subscription = self.telemetry_hub.subscribe(com_port, baud_rate)
+        try:
+            conn.send(('ok', None))
+            while True:
+                try:
+                    sample = subscription.get(timeout=TELEMETRY_KEEPALIVE)
+                except queue.Empty:
+                    sample = None
+                conn.send(('ok', sample))
+        finally:
+            self.telemetry_hub.unsubscribe(subscription)
+
+    def _serve_session(self, conn, comm):
+        # The port lock is held for the whole session, so a worker's
+        # write and read-back can not interleave with another worker
+        while True:
+            message = conn.recv()
+            if message[0] == 'close':
+                conn.send(('ok', None))
+                return
+            _, method, args, kwargs = message
+            if method.startswith('_') or not callable(getattr(comm, method, None)):
+                conn.send(('error', BrokerError('Unknown method %s' % method)))
+                continue
+            try:
+                result = getattr(comm, method)(*args, **kwargs)
+            except (serial.SerialException, OSError) as e:
+                conn.send(('error', e))
+                raise
+            except Exception as e:
+                conn.send(('error', e))
+                continue
+            conn.send(('ok', result))
+
+
+def _request(conn, message):
+    conn.send(message)
+    status, result = conn.recv()
+    if status == 'error':
+        raise result
+    return result
+
+
+class RemoteSensorComm:
+    '''Forwards SensorComm method calls to the broker'''
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return _request(self._conn, ('call', name, args, kwargs))
+        return call
+
+
+def _connect(address, authkey):
+    # Without a key given the key file is read on every connect, so clients
+    # pick up the new key of a restarted broker
+    return Client(address, family='AF_UNIX', authkey=authkey or read_authkey(address))
+
+
+class BrokerClient:
+    '''authkey None reads the key with read_authkey'''
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    @contextmanager
+    def connection(self, com_port, baud_rate, timeout=None, deadline=None):
+        budget = None if deadline is None else deadline - time.monotonic()
+        conn = _connect(self.address, self.authkey)
+        try:
+            _request(conn, ('open', com_port, int(baud_rate), timeout, budget))
+            yield RemoteSensorComm(conn)
+            _request(conn, ('close',))
+        finally:
+            conn.close()
+
+    def metrics_text(self):
+        conn = _connect(self.address, self.authkey)
+        try:
+            return _request(conn, ('metrics',))
+        finally:
+            conn.close()
+
+    def close(self, com_port, baud_rate):
+        pass
+
+    def close_all(self):
+        pass
+
+
+class RemoteJobManager:
+    '''JobManager interface for jobs that run in the broker'''
+
+    methods = ('submit', 'get', 'list', 'result', 'cancel', 'wait')
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    def __getattr__(self, name):
+        if name not in self.methods:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            conn = _connect(self.address, self.authkey)
+            try:
+                return _request(conn, ('jobs', name, args, kwargs))
+            finally:
+                conn.close()
+        return call
+
+
+class RemoteTelemetrySubscription:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get(self, timeout=None):
+        '''Same as TelemetrySubscription.get, raises queue.Empty on timeout'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not self._conn.poll(remaining):
+                raise queue.Empty
+            status, sample = self._conn.recv()
+            if status == 'error':
+                raise sample
+            # None is the broker's keepalive
+            if sample is not None:
+                return sample
+
+    def close(self):
+        self._conn.close()
+
+
+class RemoteTelemetryHub:
+    '''TelemetryHub interface for the pollers that run in the broker'''
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    def subscribe(self, com_port, baud_rate):
+        conn = _connect(self.address, self.authkey)
+        try:
+            _request(conn, ('telemetry', com_port, int(baud_rate)))
+        except BaseException:
+            conn.close()
+            raise
+        return RemoteTelemetrySubscription(conn)
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+
+    def stop(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial device broker')
+    parser.add_argument('--socket', default=os.environ.get('DEVICE_BROKER_SOCKET',
+                                                           '/tmp/device_broker.sock'))
+    parser.add_argument('--dev-name', default='Athena640')
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--idle-timeout', type=float,
+                        default=float(os.environ.get('SERIAL_IDLE_TIMEOUT', 60)))
+    parser.add_argument('--telemetry-interval', type=float,
+                        default=float(os.environ.get('TELEMETRY_INTERVAL', 1.0)))
+    args = parser.parse_args()
+
+    authkey = os.environ.get('DEVICE_BROKER_AUTHKEY', '').encode() or write_authkey(args.socket)
+    pool = SerialPool(dev_name=args.dev_name, idd='new', timeout=args.timeout,
+                      idle_timeout=args.idle_timeout)
+    broker = DeviceBroker(args.socket, pool, authkey=authkey,
+                          telemetry_hub=TelemetryHub(pool, interval=args.telemetry_interval))
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
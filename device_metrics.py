@@ -0,0 +1,76 @@
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+COUNTERS = {
+    'device_command_retries_total': 'Commands re-sent by send_receive_response',
+    'device_command_failures_total': 'Commands without a valid reply after all retries',
+    'device_header_resyncs_total': 'Bytes skipped looking for a valid response frame',
+    'device_checksum_failures_total': 'Responses with a bad checksum',
+    'device_footer_failures_total': 'Responses with bad footer bytes',
+    'device_response_mismatches_total': 'Responses for a different command id or type',
+    'device_timeouts_total': 'Serial reads that timed out before all bytes arrived',
+    'device_deadline_exceeded_total': 'Commands abandoned because the request deadline passed',
+    'device_bytes_sent_total': 'Bytes written to the serial port',
+    'device_bytes_received_total': 'Bytes read from the serial port',
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class DeviceMetrics:
+    '''
+    Counters and per-command latency histograms for the device command
+    path, rendered in the Prometheus text exposition format.
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {name: {} for name in COUNTERS}
+        self._histograms = {}
+
+    def inc(self, name, port, amount=1):
+        with self._lock:
+            values = self._counters[name]
+            values[port] = values.get(port, 0) + amount
+
+    def observe(self, port, cmd, seconds):
+        key = (port, cmd)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # one slot per bucket, then sum and count
+                histogram = [0]*(len(self.buckets)+2)
+                self._histograms[key] = histogram
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, help_text in COUNTERS.items():
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s counter' % name)
+                for port, value in sorted(self._counters[name].items()):
+                    lines.append('%s{port="%s"} %s' % (name, _escape(port), value))
+
+            name = 'device_command_duration_seconds'
+            lines.append('# HELP %s Round-trip time of a command including retries' % name)
+            lines.append('# TYPE %s histogram' % name)
+            for (port, cmd), histogram in sorted(self._histograms.items()):
+                labels = 'port="%s",cmd="0x%04x"' % (_escape(port), cmd)
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram[-1]))
+                lines.append('%s_sum{%s} %s' % (name, labels, histogram[-2]))
+                lines.append('%s_count{%s} %d' % (name, labels, histogram[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+DEVICE_METRICS = DeviceMetrics()
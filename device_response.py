@@ -0,0 +1,151 @@
+class Response:
+    '''
+    A device reply, kept as the raw frame and decoded on access. Header
+    fields are properties, the payload is read with u16(), u32() and
+    be_bytes() or as a memoryview through payload. response['data'] and the
+    other keys of the old response dict still work, data is a tuple built
+    on first access and kept. Responses are immutable and pickle as their frame
+    bytes, so they can be cached and sent through the device broker.
+    '''
+    __slots__ = ('frame', 'idd', '_data')
+
+    KEYS = ('header', 'packet_sequence', 'device_id', 'device_number', 'cmd_type',
+            'cmd', 'cmd_status', 'length', 'data', 'chksum', 'footer1', 'footer2')
+
+    def __init__(self, frame, idd='new'):
+        # Frames from the FrameParser are views into its buffer, keep a copy
+        if(not isinstance(frame, bytes)):
+            frame = bytes(frame)
+        object.__setattr__(self, 'frame', memoryview(frame))
+        object.__setattr__(self, 'idd', idd)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Response is immutable')
+
+    def __reduce__(self):
+        return (Response, (self.frame.tobytes(), self.idd))
+
+    @property
+    def header(self):
+        return self.frame[0]
+
+    @property
+    def packet_sequence(self):
+        if(self.idd=='new'):
+            return self.frame[1]<<8 | self.frame[2]
+        return 0
+
+    @property
+    def device_id(self):
+        return self.frame[3] if self.idd=='new' else self.frame[1]
+
+    @property
+    def device_number(self):
+        return self.frame[4] if self.idd=='new' else self.frame[2]
+
+    @property
+    def cmd_type(self):
+        return self.frame[6] if self.idd=='new' else 0x57
+
+    @property
+    def cmd(self):
+        if(self.idd=='new'):
+            return self.frame[8]<<8 | self.frame[9]
+        return self.frame[4]<<8 | self.frame[3]
+
+    @property
+    def cmd_status(self):
+        if(self.idd=='new'):
+            return self.frame[7]
+        return 1 if self.cmd==0xDEAD else 0
+
+    @property
+    def length(self):
+        if(self.idd=='new'):
+            return self.frame[5]
+        return self.frame[6]<<8 | self.frame[5]
+
+    @property
+    def payload(self):
+        if(self.idd=='new'):
+            return self.frame[10:self.frame[5]+6]
+        return self.frame[7:7+self.length]
+
+    @property
+    def data(self):
+        try:
+            return self._data
+        except AttributeError:
+            object.__setattr__(self, '_data', tuple(self.payload))
+            return self._data
+
+    @property
+    def chksum(self):
+        if(self.idd=='new'):
+            return self.frame[-3]
+        return self.frame[7+self.length]
+
+    @property
+    def footer1(self):
+        return self.frame[-2] if self.idd=='new' else 0xFF
+
+    @property
+    def footer2(self):
+        return self.frame[-1] if self.idd=='new' else 0xFF
+
+    def be_bytes(self, offset=0, size=None):
+        '''
+        size payload bytes from offset as a big endian number, offset may be
+        negative like a list index, size defaults to the rest of the payload
+        '''
+        payload = self.payload
+        if(offset<0):
+            offset += len(payload)
+        if(size==None):
+            size = len(payload) - offset
+        if(offset<0 or size<0 or offset+size>len(payload)):
+            raise IndexError('Payload has %d bytes, %d at %d requested'%(len(payload), size, offset))
+        return int.from_bytes(payload[offset:offset+size], 'big')
+
+    def u16(self, offset=0):
+        return self.be_bytes(offset, 2)
+
+    def u32(self, offset=0):
+        return self.be_bytes(offset, 4)
+
+    # The old response dict
+    def __getitem__(self, key):
+        if(key not in self.KEYS):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if(key not in self.KEYS):
+            return default
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def keys(self):
+        return self.KEYS
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.KEYS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if(isinstance(other, Response)):
+            return self.idd==other.idd and self.frame==other.frame
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.idd, self.frame.tobytes()))
+
+    def __repr__(self):
+        return 'Response(cmd=0x%04x, status=%d, frame=%s)'%(self.cmd, self.cmd_status, self.frame.hex())
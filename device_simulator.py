@@ -0,0 +1,494 @@
+'''
+Simulated camera on a Linux pseudo-terminal, speaking the same new IDD
+(0xE0/0xE1 framing with sequence numbers and footers) and old IDD framing
+as the firmware, so SensorComm, the pool and the web app can be run, load
+tested and benchmarked without hardware.
+
+    python device_simulator.py --latency 0.001 --drop-rate 0.01
+
+prints the pty path to use as com_port. The simulated link is paced by the
+baud rate (10 bits per byte) plus a processing latency per command, and
+faults (dropped replies or bytes, bad checksums, stale replies, line noise)
+are injected at the configured rates.
+'''
+import argparse
+import os
+import random
+import select
+import threading
+import time
+import tty
+import pty
+from collections import deque
+
+NEW_HEADER = 0xE0
+NEW_RESPONSE_HEADER = 0xE1
+OLD_HEADER = 0xFE
+DEV_ID = 0x3E
+DEV_NO = 0xFF
+FOOTER1 = 0xFF
+FOOTER2 = 0xFE
+
+READ = 0x52
+WRITE = 0x57
+STATUS_OK = 0x00
+STATUS_ERROR = 0x01
+
+# Old IDD command ids, as (new IDD command, type)
+OLD_COMMANDS = {
+    0x6000: (0x6000, WRITE), 0x6004: (0x6004, WRITE), 0x6008: (0x6004, READ),
+    0x7004: (0x7004, WRITE), 0x7008: (0x7004, READ),
+    0x7104: (0x7104, WRITE), 0x7108: (0x7104, READ),
+    0x3004: (0x3004, WRITE), 0x3008: (0x3004, READ),
+}
+
+FPGA_DEFAULTS = {
+    0x10: 0x00030001,   # firmware version
+    0x41: 0x1F40,       # sensor temperature
+    0x69: 0x0400, 0x70: 0x3C00, 0x71: 0x2000, 0x74: 0x0001, 0x93: 0x2000,
+    0xD0: 0x80, 0xD4: 0x80, 0xD5: 0x00123456, 0xD6: 0x00000001,
+}
+
+ATHENA_DEFAULTS = {
+    0x1: 0x40, 0x2: 0x1000, 0x3: 0x8, 0x4: 0x20, 0x6: 0x5, 0x9: 0x100, 0xA: 0x1000,
+    0xC: 0x80, 0x11: 0x1F00, 0x12: 0x1F10, 0x13: 0x1F20, 0x14: 0x0800, 0x15: 0x0800,
+    0x16: 12, 0x17: 3, 0x18: 640*512, 0x19: 0x2000, 0x1A: 0x0400, 0x1B: 0x3C00,
+}
+
+# Fuel gauge (LTC2943 register layout) at 0x64, HDC2010 at 0x40
+I2C_DEFAULTS = {
+    0x64: {0x00: 0x01, 0x01: 0x3C, 0x02: 0x7F, 0x03: 0xFF, 0x08: 0x64, 0x09: 0x64,
+           0x0E: 0x80, 0x0F: 0x40, 0x14: 0x95, 0x15: 0x00},
+    # 25 C with the firmware's 18 C correction, humidity 40 %, TI ids
+    0x40: {0x00: 0xC7, 0x01: 0x80, 0x02: 0x66, 0x03: 0x66, 0x0E: 0x00, 0x0F: 0x00,
+           0xFC: 0x49, 0xFD: 0x54, 0xFE: 0xD0, 0xFF: 0x07},
+}
+
+QSPI_SIZE = 0x4000000
+SDRAM_SIZE = 0x3000000
+SNAPSHOT_ADDRESS = 0x2000000
+FRAME_COLUMNS = 664
+FRAME_ROWS = 519
+
+
+class Faults:
+    '''
+    Rates are probabilities per reply, byte_drop_rate per reply byte.
+    lost_requests and lost_replies pick single commands instead, as
+    (command, n) for the n-th request of that command (counting from 1,
+    command as sent on the wire): a lost request never reaches the device,
+    a lost reply is sent after the command has been carried out.
+    '''
+
+    def __init__(self, drop_rate=0.0, byte_drop_rate=0.0, bad_checksum_rate=0.0,
+                 stale_rate=0.0, noise_rate=0.0, lost_requests=(), lost_replies=()):
+        self.drop_rate = drop_rate
+        self.byte_drop_rate = byte_drop_rate
+        self.bad_checksum_rate = bad_checksum_rate
+        self.stale_rate = stale_rate
+        self.noise_rate = noise_rate
+        self.lost_requests = set(lost_requests)
+        self.lost_replies = set(lost_replies)
+
+
+class DeviceModel:
+    '''
+    State of the simulated camera: FPGA registers, Athena sensor parameters,
+    I2C devices, SDRAM and the QSPI flash with its busy time. handle() runs
+    one command and returns (status, reply data).
+    '''
+
+    def __init__(self, erase_seconds_per_4k=0.002, transfer_bytes_per_second=4e6,
+                 snapshot_seconds_per_frame=0.005):
+        self.fpga = dict(FPGA_DEFAULTS)
+        self.athena = dict(ATHENA_DEFAULTS)
+        self.i2c = {dev: dict(regs) for dev, regs in I2C_DEFAULTS.items()}
+        self.i2c_16b = {}
+        self.sensor_i2c = {}
+        self.spi = {}
+        self.sdram = bytearray(SDRAM_SIZE)
+        self.sdram_address = 0
+        self.qspi = bytearray(b'\xFF') * QSPI_SIZE
+        self.qspi_busy_until = 0.0
+        self.erase_seconds_per_4k = erase_seconds_per_4k
+        self.transfer_bytes_per_second = transfer_bytes_per_second
+        self.snapshot_seconds_per_frame = snapshot_seconds_per_frame
+        self.snapshots = 0
+        self.lock = threading.Lock()
+
+    def handle(self, cmd, cmd_type, payload, order='big'):
+        with self.lock:
+            if cmd == 0xB0B0:
+                return STATUS_OK, bytes(payload)
+            if cmd & 0xF000 == 0x5000:
+                return self._fpga(cmd & 0xFFF, cmd_type, payload, order)
+            handler = self.HANDLERS.get(cmd)
+            if handler is None:
+                return STATUS_ERROR, b''
+            try:
+                return handler(self, cmd, cmd_type, payload, order)
+            except (IndexError, ValueError):
+                return STATUS_ERROR, b''
+
+    def _fpga(self, address, cmd_type, payload, order):
+        if cmd_type == WRITE:
+            self.fpga[address] = int.from_bytes(payload[:4], order)
+            return STATUS_OK, bytes(payload[:4])
+        return STATUS_OK, self.fpga.get(address, 0).to_bytes(4, order)
+
+    def _sdram_address(self, cmd, cmd_type, payload, order):
+        self.sdram_address = int.from_bytes(payload[:4], order) % SDRAM_SIZE
+        return STATUS_OK, bytes(payload[:4])
+
+    def _sdram_data(self, cmd, cmd_type, payload, order):
+        address = self.sdram_address
+        if cmd_type == READ:
+            size = int.from_bytes(payload[:2], 'big')
+            return STATUS_OK, bytes(self.sdram[address:address+size])
+        self.sdram[address:address+len(payload)] = payload
+        return STATUS_OK, b'\x00'
+
+    def _i2c(self, cmd, cmd_type, payload, order):
+        registers = self.i2c.setdefault(payload[0], {})
+        register = payload[1]
+        if cmd_type == READ:
+            return STATUS_OK, bytes(registers.get((register+i) & 0xFF, 0) for i in range(payload[2]))
+        for i, value in enumerate(payload[2:]):
+            registers[(register+i) & 0xFF] = value
+        return STATUS_OK, b'\x00'
+
+    def _i2c_16b(self, cmd, cmd_type, payload, order):
+        key = (payload[0], payload[1])
+        if cmd_type == READ:
+            value = self.i2c_16b.get(key, b'\x00\x00')
+            return STATUS_OK, (value * payload[2])[:payload[2]]
+        self.i2c_16b[key] = bytes(payload[2:4])
+        return STATUS_OK, b'\x00'
+
+    def _sensor_i2c(self, cmd, cmd_type, payload, order):
+        device = payload[0]
+        register = payload[1] << 8 | payload[2]
+        if cmd_type == READ:
+            return STATUS_OK, bytes(self.sensor_i2c.get((device, register+i), 0)
+                                    for i in range(payload[3]))
+        for i, value in enumerate(payload[3:]):
+            self.sensor_i2c[(device, register+i)] = value
+        return STATUS_OK, b'\x00'
+
+    def _spi(self, cmd, cmd_type, payload, order):
+        if cmd_type == READ:
+            return STATUS_OK, self.athena.get(payload[0], 0).to_bytes(4, 'big')
+        if len(payload) == 2:
+            # Detector parameter: 4 bit selector, 12 bit value
+            value = int.from_bytes(payload, order)
+            self.spi[value >> 12] = value & 0xFFF
+        else:
+            self.athena[payload[0]] = int.from_bytes(payload[1:4], 'big')
+        return STATUS_OK, b'\x00'
+
+    def _busy(self, seconds):
+        self.qspi_busy_until = max(self.qspi_busy_until, time.monotonic()) + seconds
+
+    def _qspi_status(self, cmd, cmd_type, payload, order):
+        busy = 1 if time.monotonic() < self.qspi_busy_until else 0
+        return STATUS_OK, bytes([busy, 0, 0, 0])
+
+    def _erase(self, cmd, cmd_type, payload, order):
+        block = {0xA000: 0x10000, 0xA001: 0x8000, 0xA002: 0x1000}[cmd]
+        address = int.from_bytes(payload[:4], order)
+        blocks = int.from_bytes(payload[4:6], order)
+        start = address % QSPI_SIZE
+        end = min(start + block*blocks, QSPI_SIZE)
+        self.qspi[start:end] = b'\xFF' * (end - start)
+        self._busy(self.erase_seconds_per_4k * (end - start) / 0x1000)
+        return STATUS_OK, b'\x00'
+
+    def _transfer(self, cmd, cmd_type, payload, order):
+        src = int.from_bytes(payload[0:4], order)
+        dest = int.from_bytes(payload[4:8], order)
+        size = int.from_bytes(payload[8:12], order)
+        if cmd == 0xE000:
+            self.sdram[dest:dest+size] = self.qspi[src:src+size]
+        else:
+            self.qspi[dest:dest+size] = self.sdram[src:src+size]
+        self._busy(size / self.transfer_bytes_per_second)
+        return STATUS_OK, b'\x00'
+
+    def _save(self, cmd, cmd_type, payload, order):
+        # Offset tables, sensor parameter areas and user settings
+        self._busy(self.erase_seconds_per_4k * 16)
+        return STATUS_OK, b'\x00'
+
+    def _snapshot(self, cmd, cmd_type, payload, order):
+        value = int.from_bytes(payload[:4], order)
+        frames = max(value & 0xFF, 1)
+        self.snapshots += 1
+        # A synthetic frame of big endian pixels 0x2000 + (x+y+n) % 1024,
+        # every row is a window into one repeating ramp
+        ramp = b''.join((0x2000 + i).to_bytes(2, 'big') for i in range(0x400)) * 2
+        row_size = FRAME_COLUMNS*2
+        for y in range(FRAME_ROWS):
+            shift = 2*((y + self.snapshots) & 0x3FF)
+            start = SNAPSHOT_ADDRESS + y*row_size
+            self.sdram[start:start+row_size] = ramp[shift:shift+row_size]
+        self._busy(self.snapshot_seconds_per_frame * frames)
+        return STATUS_OK, b'\x00'
+
+    HANDLERS = {
+        0x6000: _sdram_address,
+        0x6004: _sdram_data,
+        0x7004: _i2c,
+        0x7005: _i2c_16b,
+        0x7104: _sensor_i2c,
+        0x3004: _spi,
+        0xA008: _qspi_status,
+        0xA000: _erase, 0xA001: _erase, 0xA002: _erase,
+        0xA003: _transfer, 0xE000: _transfer, 0xE00C: _transfer,
+        0xA004: _save, 0xA005: _save,
+        0xE00D: _save, 0xE00E: _save, 0xE00F: _save, 0xE010: _save,
+        0xE011: _save, 0xE012: _save, 0xE013: _save,
+        0xA00E: _snapshot,
+    }
+
+
+def new_reply(sequence, cmd_type, status, cmd, data):
+    body = bytes([cmd_type, status, cmd >> 8 & 0xFF, cmd & 0xFF]) + bytes(data)
+    frame = bytearray([NEW_RESPONSE_HEADER, sequence >> 8 & 0xFF, sequence & 0xFF,
+                       DEV_ID, DEV_NO, len(body)]) + body
+    frame.append(sum(frame[3:]) & 0xFF)
+    frame += bytes([FOOTER1, FOOTER2])
+    return frame
+
+
+def old_reply(status, cmd, data):
+    if status != STATUS_OK:
+        cmd = 0xDEAD
+    frame = bytearray([OLD_HEADER, DEV_ID, DEV_NO, cmd & 0xFF, cmd >> 8 & 0xFF,
+                       len(data) & 0xFF, len(data) >> 8 & 0xFF]) + bytes(data)
+    frame.append(-sum(frame[1:]) & 0xFF)
+    return frame
+
+
+class DeviceSimulator:
+    '''
+    Serves a DeviceModel on the master side of a pty. Commands are handled
+    in arrival order and every reply leaves once the request has been
+    clocked in at the baud rate, latency has passed and the reply itself
+    has been clocked out, so one slow reply delays the ones behind it just
+    like on a real UART.
+    '''
+
+    def __init__(self, model=None, baud_rate=115200, latency=0.0005, faults=None, seed=None):
+        self.model = model or DeviceModel()
+        self.baud_rate = baud_rate
+        self.latency = latency
+        self.faults = faults or Faults()
+        self.random = random.Random(seed)
+        self.stats = {'commands': 0, 'bad_requests': 0, 'dropped_replies': 0,
+                      'dropped_bytes': 0, 'bad_checksums': 0, 'stale_replies': 0, 'noise': 0,
+                      'lost_requests': 0, 'lost_replies': 0}
+        self._seen = {}
+        self._last_seen = None
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._stop = threading.Event()
+        self._out = deque()
+        self._out_ready = threading.Condition()
+        self._last_reply = None
+        self._threads = []
+
+    def byte_time(self, count):
+        if not self.baud_rate:
+            return 0.0
+        return count * 10.0 / self.baud_rate
+
+    def start(self):
+        '''Opens the pty and returns the path of its device'''
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        for target in (self._read_loop, self._write_loop):
+            thread = threading.Thread(target=target, name='device-simulator', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        with self._out_ready:
+            self._out_ready.notify_all()
+        for thread in self._threads:
+            thread.join(1)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _read_loop(self):
+        buf = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                chunk = os.read(self._master, 4096)
+            except OSError:
+                return
+            arrived = time.monotonic()
+            buf += chunk
+            while buf:
+                consumed = self._parse(buf, arrived)
+                if consumed == 0:
+                    break
+                del buf[:consumed]
+
+    def _parse(self, buf, arrived):
+        '''Handles the packet at the front of buf, returns the bytes used'''
+        if buf[0] == NEW_HEADER:
+            if len(buf) < 6:
+                return 0
+            total = buf[5] + 9
+            if len(buf) < total:
+                return 0
+            packet = bytes(buf[:total])
+            if (buf[3] != DEV_ID or sum(packet[3:-3]) & 0xFF != packet[-3]
+                    or packet[-2] != FOOTER1 or packet[-1] != FOOTER2):
+                self.stats['bad_requests'] += 1
+                return 1
+            sequence = packet[1] << 8 | packet[2]
+            cmd_type = packet[6]
+            cmd = packet[7] << 8 | packet[8]
+            if self._lost_request(cmd):
+                return total
+            status, data = self.model.handle(cmd, cmd_type, packet[9:-3])
+            reply = new_reply(sequence, cmd_type, status, cmd, data)
+        elif buf[0] == OLD_HEADER:
+            if len(buf) < 7:
+                return 0
+            length = buf[5] | buf[6] << 8
+            # Reads carry their arguments, a zero length read has none
+            total = length + 8
+            if len(buf) < total:
+                return 0
+            packet = bytes(buf[:total])
+            if buf[1] != DEV_ID or -sum(packet[1:-1]) & 0xFF != packet[-1]:
+                self.stats['bad_requests'] += 1
+                return 1
+            old_cmd = packet[3] | packet[4] << 8
+            if old_cmd & 0xF000 == 0x4000:
+                cmd, cmd_type = 0x5000 | (old_cmd & 0xFFF), READ
+            else:
+                cmd, cmd_type = OLD_COMMANDS.get(old_cmd, (old_cmd, WRITE))
+            if self._lost_request(old_cmd):
+                return total
+            status, data = self.model.handle(cmd, cmd_type, packet[7:-1], 'little')
+            reply = old_reply(status, old_cmd, data)
+        else:
+            self.stats['bad_requests'] += 1
+            return 1
+        self.stats['commands'] += 1
+        if self._last_seen in self.faults.lost_replies:
+            self.stats['lost_replies'] += 1
+            return total
+        self._send(reply, arrived + self.byte_time(len(packet)) + self.latency)
+        return total
+
+    def _lost_request(self, cmd):
+        count = self._seen.get(cmd, 0) + 1
+        self._seen[cmd] = count
+        self._last_seen = (cmd, count)
+        if self._last_seen in self.faults.lost_requests:
+            self.stats['lost_requests'] += 1
+            return True
+        return False
+
+    def _send(self, reply, due):
+        faults = self.faults
+        rand = self.random.random
+        frames = []
+        if faults.noise_rate and rand() < faults.noise_rate:
+            self.stats['noise'] += 1
+            frames.append(bytes([NEW_RESPONSE_HEADER]) +
+                          bytes(self.random.randrange(256) for i in range(self.random.randrange(1, 16))))
+        if faults.stale_rate and self._last_reply is not None and rand() < faults.stale_rate:
+            self.stats['stale_replies'] += 1
+            frames.append(self._last_reply)
+        self._last_reply = bytes(reply)
+        if faults.drop_rate and rand() < faults.drop_rate:
+            self.stats['dropped_replies'] += 1
+        else:
+            if faults.bad_checksum_rate and rand() < faults.bad_checksum_rate:
+                self.stats['bad_checksums'] += 1
+                checksum = -3 if reply[0] == NEW_RESPONSE_HEADER else -1
+                reply[checksum] ^= 0x5A
+            if faults.byte_drop_rate:
+                kept = bytes(b for b in reply if rand() >= faults.byte_drop_rate)
+                self.stats['dropped_bytes'] += len(reply) - len(kept)
+                reply = kept
+            frames.append(bytes(reply))
+        if frames:
+            with self._out_ready:
+                self._out.append((due, b''.join(frames)))
+                self._out_ready.notify()
+
+    def _write_loop(self):
+        line_free = 0.0
+        while not self._stop.is_set():
+            with self._out_ready:
+                while not self._out and not self._stop.is_set():
+                    self._out_ready.wait(0.1)
+                if self._stop.is_set():
+                    return
+                due, data = self._out.popleft()
+            # The UART sends one reply after the other
+            done = max(due, line_free) + self.byte_time(len(data))
+            wait = done - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            line_free = done
+            try:
+                os.write(self._master, data)
+            except OSError:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated camera on a pseudo-terminal')
+    parser.add_argument('--baud', type=int, default=115200,
+                        help='pace the link like this baud rate, 0 for no pacing')
+    parser.add_argument('--latency', type=float, default=0.0005, help='seconds per command')
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--byte-drop-rate', type=float, default=0.0)
+    parser.add_argument('--bad-checksum-rate', type=float, default=0.0)
+    parser.add_argument('--stale-rate', type=float, default=0.0)
+    parser.add_argument('--noise-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    faults = Faults(args.drop_rate, args.byte_drop_rate, args.bad_checksum_rate,
+                    args.stale_rate, args.noise_rate)
+    simulator = DeviceSimulator(baud_rate=args.baud, latency=args.latency, faults=faults,
+                                seed=args.seed)
+    print(simulator.start(), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        print(simulator.stats)
+
+
+if __name__ == '__main__':
+    main()
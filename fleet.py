@@ -0,0 +1,50 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Fleet:
+    '''
+    Runs one operation on many devices at once. Devices are given as a list
+    of ports or as a named group from a JSON file mapping group names to
+    port lists. max_workers bounds how many devices are talked to at the
+    same time, so a large fleet can not exhaust threads.
+    '''
+
+    def __init__(self, max_workers=8, groups_file=None):
+        self.max_workers = max_workers
+        self.groups_file = groups_file
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='fleet')
+
+    def groups(self):
+        if not self.groups_file or not os.path.exists(self.groups_file):
+            return {}
+        with open(self.groups_file) as f:
+            return json.load(f)
+
+    def resolve_ports(self, ports=None, group=None):
+        if ports:
+            return list(ports)
+        if group is not None:
+            groups = self.groups()
+            if group not in groups:
+                raise ValueError('Unknown group %s' % group)
+            return list(groups[group])
+        raise ValueError('Either ports or group is required')
+
+    def _timed(self, fn, port):
+        started = time.monotonic()
+        try:
+            result = fn(port)
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        result["com_port"] = port
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 3)
+        return result
+
+    def run(self, ports, fn):
+        '''Calls fn(port) for every port, results come back in port order'''
+        futures = [self.executor.submit(self._timed, fn, port) for port in ports]
+        return [future.result() for future in futures]
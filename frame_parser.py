@@ -0,0 +1,165 @@
+class FrameParser:
+    '''
+    Splits the byte stream coming from a device into new IDD response frames.
+    Received bytes go into one fixed buffer, the parser looks for the
+    response header with bytes.find and checks device id, length, checksum
+    and footers in place, so skipping line noise is a scan over the buffer
+    instead of one read per byte. Frames are returned as memoryviews into the
+    buffer, they are only valid until the next feed() or next_frame() call.
+    '''
+
+    # header, sequence (2), dev id, dev no, length
+    HEAD_SIZE = 6
+
+    def __init__(self, header=0xE1, dev_id=0x3E, dev_no=0xFF, footer1=0xFF, footer2=0xFE,
+                 capacity=4096):
+        self.header = header
+        self.dev_id = dev_id
+        self.dev_no = dev_no
+        self.footer1 = footer1
+        self.footer2 = footer2
+        # Never resized, views handed out would block that
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.skipped = 0
+        self.checksum_failures = 0
+        self.footer_failures = 0
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
+
+    def available(self):
+        return self.end - self.start
+
+    def free(self):
+        return len(self.buf) - self.available()
+
+    def feed(self, data):
+        size = len(data)
+        if(self.end + size > len(self.buf)):
+            # Move what is left to the front
+            remaining = self.end - self.start
+            if(remaining + size > len(self.buf)):
+                raise ValueError('Frame buffer overflow')
+            self.buf[0:remaining] = bytes(self.view[self.start:self.end])
+            self.start = 0
+            self.end = remaining
+        self.buf[self.end:self.end+size] = data
+        self.end += size
+
+    def needed(self):
+        '''Bytes still missing before next_frame() can decide on a frame'''
+        available = self.end - self.start
+        if(available < self.HEAD_SIZE or self.buf[self.start] != self.header):
+            return max(self.HEAD_SIZE - available, 1)
+        return max(self.buf[self.start+5] + 9 - available, 1)
+
+    def _skip(self, count):
+        self.start += count
+        self.skipped += count
+
+    def next_frame(self):
+        buf = self.buf
+        while(1):
+            pos = buf.find(self.header, self.start, self.end)
+            if(pos < 0):
+                self.skipped += self.end - self.start
+                self.clear()
+                return None
+            self._skip(pos - self.start)
+            if(self.end - pos < self.HEAD_SIZE):
+                return None
+            if(buf[pos+3] != self.dev_id or buf[pos+4] != self.dev_no):
+                self._skip(1)
+                continue
+            total = buf[pos+5] + 9
+            if(self.end - pos < total):
+                return None
+            frame = self.view[pos:pos+total]
+            if(sum(frame[3:-3]) & 0xFF != frame[-3]):
+                self.checksum_failures += 1
+                self._skip(1)
+                continue
+            if(frame[-2] != self.footer1 or frame[-1] != self.footer2):
+                self.footer_failures += 1
+                self._skip(1)
+                continue
+            self.start = pos + total
+            if(self.start == self.end):
+                self.clear()
+            return frame
+
+    def resync(self):
+        '''
+        Gives up on the frame at the front, for when no more bytes are
+        coming: a stray header byte may be hiding a complete frame behind it.
+        Returns False once the buffer is empty.
+        '''
+        if(self.start == self.end):
+            return False
+        self._skip(1)
+        return True
+
+    def drain_stats(self):
+        '''Returns and resets (skipped bytes, checksum failures, footer failures)'''
+        stats = (self.skipped, self.checksum_failures, self.footer_failures)
+        self.skipped = 0
+        self.checksum_failures = 0
+        self.footer_failures = 0
+        return stats
+
+
+class OldFrameParser(FrameParser):
+    '''
+    The same for old IDD replies: header, dev id, dev no, cmd and length
+    (both little endian), payload and a checksum that makes bytes 1 to the
+    end sum to zero. There is no sequence number and there are no footers.
+    '''
+
+    # header, dev id, dev no, cmd (2), length (2)
+    HEAD_SIZE = 7
+
+    def __init__(self, header=0xFE, dev_id=0x3E, dev_no=0xFF, capacity=4096):
+        FrameParser.__init__(self, header, dev_id, dev_no, None, None, capacity)
+
+    def _total(self, pos):
+        return (self.buf[pos+5] | self.buf[pos+6]<<8) + 8
+
+    def needed(self):
+        available = self.end - self.start
+        if(available < self.HEAD_SIZE or self.buf[self.start] != self.header):
+            return max(self.HEAD_SIZE - available, 1)
+        return max(self._total(self.start) - available, 1)
+
+    def next_frame(self):
+        buf = self.buf
+        while(1):
+            pos = buf.find(self.header, self.start, self.end)
+            if(pos < 0):
+                self.skipped += self.end - self.start
+                self.clear()
+                return None
+            self._skip(pos - self.start)
+            if(self.end - pos < self.HEAD_SIZE):
+                return None
+            if(buf[pos+1] != self.dev_id or buf[pos+2] != self.dev_no):
+                self._skip(1)
+                continue
+            total = self._total(pos)
+            if(total > len(buf)):
+                self._skip(1)
+                continue
+            if(self.end - pos < total):
+                return None
+            frame = self.view[pos:pos+total]
+            if(sum(frame[1:]) & 0xFF != 0):
+                self.checksum_failures += 1
+                self._skip(1)
+                continue
+            self.start = pos + total
+            if(self.start == self.end):
+                self.clear()
+            return frame
@@ -0,0 +1,237 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+REQUIRED = object()
+FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobRejected(Exception):
+    pass
+
+
+def _int(value):
+    return int(str(value), 0)
+
+
+def _int_list(value):
+    if value is None:
+        return None
+    return [int(str(v), 0) for v in value]
+
+
+def _bytes(value):
+    if isinstance(value, str):
+        return list(bytes.fromhex(value))
+    return [int(b) & 0xFF for b in value]
+
+
+# Long running SensorComm methods that can be run as a job, with their
+# parameters as (converter, default)
+JOB_OPERATIONS = {
+    'offset_calib': {'temp': (int, REQUIRED)},
+    'erase_qspi': {'address': (_int, REQUIRED), 'size': (_int, REQUIRED)},
+    'take_snapshot': {'channel': (int, 0), 'mode': (int, 0), 'number_frames': (int, 32)},
+    'get_heating_monitor_data': {'memory_address': (_int, 0x2000000)},
+    'read_data_sdram': {'address': (_int, REQUIRED), 'size': (_int, REQUIRED)},
+    'store_reticle': {'address': (_int, REQUIRED), 'reticle_img': (_bytes, REQUIRED)},
+    'characterize_link': {'repeats': (int, 5), 'baud_rates': (_int_list, None)},
+}
+
+
+def parse_params(operation, params):
+    if operation not in JOB_OPERATIONS:
+        raise ValueError('Unknown operation %s' % operation)
+    params = params or {}
+    kwargs = {}
+    for name, (convert, default) in JOB_OPERATIONS[operation].items():
+        if name not in params:
+            if default is REQUIRED:
+                raise ValueError('Missing parameter %s' % name)
+            kwargs[name] = default
+            continue
+        try:
+            kwargs[name] = convert(params[name])
+        except (TypeError, ValueError):
+            raise ValueError('Invalid value for %s' % name)
+    return kwargs
+
+
+class Job:
+    '''
+    One background operation. The running SensorComm method reports through
+    progress() and sleeps through sleep(), both raise JobCancelled once the
+    job has been cancelled so the operation stops at the next step.
+    '''
+
+    def __init__(self, operation, com_port, baud_rate, kwargs):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.com_port = com_port
+        self.baud_rate = baud_rate
+        self.kwargs = kwargs
+        self.state = 'queued'
+        self.last_progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.future = None
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+
+    def progress(self, stage, done=None, total=None):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        info = {"stage": stage}
+        if done is not None:
+            info["done"] = done
+            info["total"] = total
+            if total:
+                info["percent"] = round(100.0 * done / total, 1)
+        self.update(last_progress=info)
+
+    def sleep(self, seconds):
+        if self._cancel.wait(seconds):
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.to_dict()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "operation": self.operation,
+            "com_port": self.com_port,
+            "baud_rate": self.baud_rate,
+            "state": self.state,
+            "progress": self.last_progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "version": self.version,
+        }
+
+
+class JobManager:
+    '''
+    Runs long device operations in the background. Every device has its own
+    single worker, so jobs on one camera run one after another while jobs on
+    different cameras run side by side, and at most max_queued jobs can be
+    waiting or running per device. The last max_finished finished jobs are
+    kept so their result can still be fetched.
+    '''
+
+    def __init__(self, serial_pool, max_queued=4, max_finished=100):
+        self.serial_pool = serial_pool
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._executors = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, com_port, baud_rate, operation, params=None):
+        kwargs = parse_params(operation, params)
+        baud_rate = int(baud_rate)
+        with self._lock:
+            pending = [job for job in self._jobs.values()
+                       if job.com_port == com_port and not job.finished()]
+            if len(pending) >= self.max_queued:
+                raise JobRejected('%d jobs already pending on %s' % (len(pending), com_port))
+            executor = self._executors.get(com_port)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-%s' % com_port)
+                self._executors[com_port] = executor
+            job = Job(operation, com_port, baud_rate, kwargs)
+            self._jobs[job.id] = job
+            self._prune()
+            job.future = executor.submit(self._run, job)
+        return job.to_dict()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished()]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        if job.cancelled():
+            job.update(state='cancelled', finished_at=time.time())
+            return
+        job.update(state='running', started_at=time.time())
+        try:
+            with self.serial_pool.connection(job.com_port, job.baud_rate) as comm:
+                comm.job = job
+                try:
+                    result = getattr(comm, job.operation)(**job.kwargs)
+                finally:
+                    comm.job = None
+        except JobCancelled:
+            job.update(state='cancelled', finished_at=time.time())
+        except Exception as e:
+            job.update(state='failed', error=str(e), finished_at=time.time())
+        else:
+            job.update(state='succeeded', result=result, finished_at=time.time())
+
+    def _job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get(self, job_id):
+        job = self._job(job_id)
+        return None if job is None else job.to_dict()
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def result(self, job_id):
+        '''Returns (job, result), result is only set for a succeeded job'''
+        job = self._job(job_id)
+        if job is None:
+            return None, None
+        return job.to_dict(), job.result
+
+    def cancel(self, job_id):
+        job = self._job(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        if job.future.cancel():
+            # Never started, the worker will not pick it up any more
+            job.update(state='cancelled', finished_at=time.time())
+        return job.to_dict()
+
+    def wait(self, job_id, version, timeout=None):
+        '''Blocks until the job changes from version, returns its state'''
+        job = self._job(job_id)
+        if job is None:
+            return None
+        return job.wait_for_change(version, timeout)
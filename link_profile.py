@@ -0,0 +1,193 @@
+'''
+Link characterization. CMD.ping sends a random payload of a given size, so
+timing pings of several sizes gives the round trip as a fixed latency plus
+a per byte cost, and the pings that fail give the byte error rate. From
+that model the SDRAM chunk size with the best expected throughput is picked
+and stored per port, together with the fastest baud rate that answered.
+SerialPool applies a stored profile whenever it opens a port.
+'''
+import json
+import os
+import threading
+import time
+
+PING_SIZES = (0, 16, 32, 64, 128, 192, 240)
+# Largest SDRAM transfer the firmware takes in one command, 4 byte aligned
+MAX_CHUNK = 240
+CHUNK_SIZES = tuple(range(32, MAX_CHUNK + 1, 8))
+# Header, sequence, ids, length, type, status, cmd, checksum and footers of
+# a reply plus the request asking for it
+CHUNK_OVERHEAD = 14 + 14
+# Another baud rate has to be this much faster to replace the current one
+BAUD_MARGIN = 1.1
+
+
+class LinkProfile:
+    def __init__(self, latency, seconds_per_byte, byte_error_rate, chunk_size,
+                 baud_rate=None, measured_at=None):
+        self.latency = latency
+        self.seconds_per_byte = seconds_per_byte
+        self.byte_error_rate = byte_error_rate
+        self.chunk_size = chunk_size
+        self.baud_rate = baud_rate
+        self.measured_at = time.time() if measured_at is None else measured_at
+
+    def expected_throughput(self, chunk_size):
+        '''Bytes per second moving chunk_size chunks one command at a time'''
+        size = chunk_size + CHUNK_OVERHEAD
+        success = (1 - self.byte_error_rate) ** size
+        return chunk_size * success / (self.latency + self.seconds_per_byte * size)
+
+    def to_dict(self):
+        return {
+            "latency": self.latency,
+            "seconds_per_byte": self.seconds_per_byte,
+            "bytes_per_second": 1 / self.seconds_per_byte if self.seconds_per_byte > 0 else None,
+            "byte_error_rate": self.byte_error_rate,
+            "chunk_size": self.chunk_size,
+            "baud_rate": self.baud_rate,
+            "measured_at": self.measured_at,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['latency'], values['seconds_per_byte'], values['byte_error_rate'],
+                   values['chunk_size'], values.get('baud_rate'), values.get('measured_at'))
+
+
+def fit_line(points):
+    '''Least squares fit of y = a + b*x, returns (a, b)'''
+    n = len(points)
+    mean_x = sum(x for x, y in points) / n
+    mean_y = sum(y for x, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, y in points)
+    if var_x == 0:
+        return mean_y, 0.0
+    b = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    return mean_y - b * mean_x, b
+
+
+def best_chunk_size(profile, sizes=CHUNK_SIZES):
+    return max(sizes, key=profile.expected_throughput)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure_pings(comm, sizes=PING_SIZES, repeats=5):
+    '''
+    Pings every payload size repeats times, returns the median round trip
+    per size and the bytes sent and lost along the way
+    '''
+    rtts = {}
+    sent_bytes = 0
+    lost_bytes = 0
+    for done, size in enumerate(sizes):
+        comm.report_progress('ping', done, len(sizes))
+        samples = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            # No retries, a lost ping counts towards the error rate
+            response = comm.ping(size, retry=1)
+            elapsed = time.perf_counter() - start
+            sent_bytes += size + CHUNK_OVERHEAD
+            if response is None or response['cmd_status'] != 0:
+                lost_bytes += size + CHUNK_OVERHEAD
+            else:
+                samples.append(elapsed)
+        if samples:
+            rtts[size] = _median(samples)
+    return rtts, sent_bytes, lost_bytes
+
+
+def characterize(comm, sizes=PING_SIZES, repeats=5, baud_rates=None):
+    '''
+    Measures the link of an open SensorComm and returns a LinkProfile.
+    baud_rates, if given, are tried one after another on the open port and
+    the one with the best expected throughput is kept unless the current
+    one is within BAUD_MARGIN of it. The port is left at the baud rate it had.
+
+    The timeout policy is off while measuring: its timeouts are learned
+    from earlier, smaller commands and would count slow pings as lost.
+    '''
+    ser = comm.ser
+    original_baud = ser.baudrate if ser is not None else None
+    candidates = list(baud_rates) if baud_rates else [original_baud]
+    best = None
+    current = None
+    policy = comm.timeout_policy
+    comm.timeout_policy = None
+    try:
+        for baud_rate in candidates:
+            # Only the host side changes, there is no command to switch the
+            # camera's UART. Rates it is not running at get no answers and
+            # are skipped, USB serial bridges that ignore the rate answer at
+            # all of them.
+            if ser is not None and baud_rate is not None and ser.baudrate != baud_rate:
+                ser.baudrate = baud_rate
+            rtts, sent_bytes, lost_bytes = measure_pings(comm, sizes, repeats)
+            if len(rtts) < 2:
+                continue
+            latency, seconds_per_byte = fit_line(sorted(rtts.items()))
+            profile = LinkProfile(max(latency, 0.0), max(seconds_per_byte, 0.0),
+                                  lost_bytes / float(sent_bytes), 0, baud_rate)
+            profile.chunk_size = best_chunk_size(profile)
+            if baud_rate == original_baud:
+                current = profile
+            if best is None or (profile.expected_throughput(profile.chunk_size)
+                                > best.expected_throughput(best.chunk_size)):
+                best = profile
+    finally:
+        comm.timeout_policy = policy
+        if ser is not None and original_baud is not None and ser.baudrate != original_baud:
+            ser.baudrate = original_baud
+    if best is None:
+        raise IOError('Device did not answer enough pings to characterize the link')
+    if current is not None and (current.expected_throughput(current.chunk_size) * BAUD_MARGIN
+                                >= best.expected_throughput(best.chunk_size)):
+        return current
+    return best
+
+
+class LinkProfiles:
+    '''Stored profiles per port, kept in a JSON file'''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._mtime = None
+
+    def _load(self):
+        # Another process (the device broker) may have written new profiles
+        try:
+            mtime = os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != self._mtime:
+            with open(self.path) as f:
+                self._profiles = {port: LinkProfile.from_dict(values)
+                                  for port, values in json.load(f).items()}
+            self._mtime = mtime
+        return self._profiles
+
+    def get(self, port):
+        with self._lock:
+            return self._load().get(port)
+
+    def put(self, port, profile):
+        with self._lock:
+            profiles = self._load()
+            profiles[port] = profile
+            if not self.path:
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({port: p.to_dict() for port, p in profiles.items()}, f, indent=2)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+
+
+LINK_PROFILES = LinkProfiles(os.environ.get('LINK_PROFILES', './link_profiles.json'))
@@ -0,0 +1,80 @@
+import struct
+
+_SEQUENCE = struct.Struct('>H')
+_OLD_LENGTH = struct.Struct('<H')
+
+
+class PacketEncoder:
+    '''
+    Builds command packets from per command templates. A template holds every
+    byte that only depends on the command, its type and the payload length,
+    together with their share of the checksum, so encoding a packet is one
+    copy of the template plus the sequence number, payload and checksum.
+    Each packet is its own bytearray, the pipelined path keeps several of
+    them in flight at once.
+    '''
+
+    def __init__(self, idd, header, dev_id, dev_no, footer1=0xFF, footer2=0xFE,
+                 max_templates=1024):
+        self.idd = idd
+        self.header = header
+        self.dev_id = dev_id
+        self.dev_no = dev_no
+        self.footer1 = footer1
+        self.footer2 = footer2
+        self.max_templates = max_templates
+        self._templates = {}
+        # Offset of the payload, the checksum follows right after it
+        self.payload_offset = 9 if idd=='new' else 7
+
+    def _template(self, cmd, cmd_type, length, size):
+        if(self.idd=='new'):
+            # header, sequence, dev id, dev no, length, type, cmd, payload, checksum, footers
+            buf = bytearray(size + 12)
+            buf[0] = self.header
+            buf[3] = self.dev_id
+            buf[4] = self.dev_no
+            buf[5] = (length + 3) & 0xFF
+            buf[6] = cmd_type
+            buf[7] = (cmd >> 8) & 0xFF
+            buf[8] = cmd & 0xFF
+            buf[-2] = self.footer1
+            buf[-1] = self.footer2
+            fixed = sum(buf[3:9])
+        else:
+            # header, dev id, dev no, cmd (LE), length (LE), payload, checksum
+            buf = bytearray(size + 8)
+            buf[0] = self.header
+            buf[1] = self.dev_id
+            buf[2] = self.dev_no
+            buf[3] = cmd & 0xFF
+            buf[4] = (cmd >> 8) & 0xFF
+            _OLD_LENGTH.pack_into(buf, 5, length & 0xFFFF)
+            fixed = sum(buf[1:7])
+        if(len(self._templates)>=self.max_templates):
+            self._templates.clear()
+        template = (bytes(buf), fixed)
+        self._templates[(cmd, cmd_type, length, size)] = template
+        return template
+
+    def encode(self, sequence, cmd, cmd_type, length, data):
+        '''
+        Same bytes as CMD.con_cmd always produced: data is only sent when
+        length is non zero, the length field is taken from length.
+        '''
+        if(length==0):
+            data = b''
+        size = len(data)
+        template = self._templates.get((cmd, cmd_type, length, size))
+        if(template==None):
+            template = self._template(cmd, cmd_type, length, size)
+        buf, fixed = template
+        pkt = bytearray(buf)
+        offset = self.payload_offset
+        pkt[offset:offset+size] = data
+        if(self.idd=='new'):
+            _SEQUENCE.pack_into(pkt, 1, sequence)
+            pkt[offset+size] = (fixed + sum(data)) & 0xFF
+        else:
+            pkt[offset+size] = -(fixed + sum(data)) & 0xFF
+        return pkt
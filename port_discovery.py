@@ -0,0 +1,201 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial.tools.list_ports
+
+from cmd_cls_v3 import DeadlineExceeded
+
+# Probe timeouts one probe may take, waiting for the port included
+PROBE_BUDGET = 4
+
+
+class PortDiscovery:
+    '''
+    Finds the serial ports that have a camera on them. Ports are probed
+    concurrently with a short timeout and the result, including FW version
+    and serial number of responsive devices, is cached per port. Probing
+    only happens in a background thread watching the port list:
+
+    - a port is probed when its device node appears,
+    - a port that did not answer is probed again after retry_interval
+      seconds, doubling with every further miss up to max_retry_interval,
+    - a responsive port gets a ping every validate_interval seconds, so an
+      unplugged or wedged camera stops being listed.
+
+    A port busy with a job keeps its last result. start() and stop() are
+    called by the application, see app.py.
+    '''
+
+    def __init__(self, serial_pool, baud_rate=115200, probe_timeout=0.5,
+                 interval=2.0, max_workers=16, retry_interval=10.0,
+                 max_retry_interval=600.0, validate_interval=10.0):
+        self.serial_pool = serial_pool
+        self.baud_rate = baud_rate
+        self.probe_timeout = probe_timeout
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.validate_interval = validate_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='discovery')
+        self.devices = {}
+        self.ports = []
+        # com_port: (misses, time.monotonic() of the next probe) for ports
+        # that did not answer, and of the next ping for those that did
+        self._schedule = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._scanned = threading.Event()
+        self._force = False
+        self._forcing = False
+
+    def list_ports(self):
+        return [port.device for port in serial.tools.list_ports.comports()]
+
+    def _connection(self, com_port):
+        # Bounds the wait for a port held by a job or a download as well
+        deadline = time.monotonic() + PROBE_BUDGET * self.probe_timeout
+        return self.serial_pool.connection(com_port, self.baud_rate, timeout=self.probe_timeout,
+                                           deadline=deadline)
+
+    def _busy(self, com_port, info, talked):
+        with self._lock:
+            previous = self.devices.get(com_port)
+        if not talked and previous is not None:
+            return dict(previous, busy=True)
+        return info
+
+    def probe(self, com_port):
+        info = {"com_port": com_port, "baud_rate": self.baud_rate,
+                "responsive": False, "probed_at": time.time()}
+        talked = False
+        try:
+            with self._connection(com_port) as cmd_gen:
+                talked = True
+                if cmd_gen.ping_device():
+                    info["responsive"] = True
+                    fw_version = cmd_gen.read_register('firmware_version')
+                    if fw_version != -1:
+                        info["fw_version"] = '.'.join(str(b) for b in fw_version.to_bytes(4, 'big'))
+                    info["serial_num"] = cmd_gen.get_device_serial_num_new()
+        except DeadlineExceeded as e:
+            info["error"] = str(e)
+            return self._busy(com_port, info, talked)
+        except Exception as e:
+            info["error"] = str(e)
+        if talked and not info["responsive"]:
+            # Do not keep ports without a camera open in the pool
+            self.serial_pool.close(com_port, self.baud_rate)
+        return info
+
+    def validate(self, com_port):
+        '''Pings a port found responsive before, returns its updated info'''
+        with self._lock:
+            info = dict(self.devices[com_port])
+        info.pop("busy", None)
+        talked = False
+        try:
+            with self._connection(com_port) as cmd_gen:
+                talked = True
+                info["responsive"] = cmd_gen.ping_device()
+        except DeadlineExceeded:
+            return self._busy(com_port, info, talked)
+        except Exception as e:
+            info["responsive"] = False
+            info["error"] = str(e)
+        if not info["responsive"]:
+            self.serial_pool.close(com_port, self.baud_rate)
+        return info
+
+    def _reschedule(self, info, now, first_miss=False):
+        com_port = info["com_port"]
+        if info.get("busy"):
+            return
+        if info["responsive"]:
+            self._schedule[com_port] = (0, now + self.validate_interval)
+            return
+        misses = 1 if first_miss else self._schedule.get(com_port, (0, None))[0] + 1
+        delay = min(self.retry_interval * 2**(misses-1), self.max_retry_interval)
+        self._schedule[com_port] = (misses, now + delay)
+
+    def refresh(self, force=False):
+        # Only one scan at a time, a second caller just waits for its result
+        with self._refresh_lock:
+            ports = self.list_ports()
+            now = time.monotonic()
+            with self._lock:
+                known = set(self.ports)
+                due = set(p for p in known if p in self.devices
+                          and self._schedule.get(p, (0, now))[1] <= now)
+                responsive = set(p for p in due if self.devices[p]["responsive"])
+            if force:
+                to_probe = ports
+                to_validate = []
+            else:
+                to_probe = [p for p in ports if p not in known or (p in due and p not in responsive)]
+                to_validate = [p for p in ports if p in responsive]
+            results = list(self.executor.map(self.probe, to_probe))
+            validated = list(self.executor.map(self.validate, to_validate))
+            now = time.monotonic()
+            with self._lock:
+                for gone in known - set(ports):
+                    self.devices.pop(gone, None)
+                    self._schedule.pop(gone, None)
+                for info in results:
+                    self.devices[info["com_port"]] = info
+                    # A node that appeared again starts without misses
+                    self._reschedule(info, now, first_miss=info["com_port"] not in known)
+                for info in validated:
+                    self.devices[info["com_port"]] = info
+                    self._reschedule(info, now, first_miss=True)
+                self.ports = ports
+        self._scanned.set()
+        return self.snapshot()
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.ports), [self.devices[p] for p in self.ports if p in self.devices]
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name='port-discovery',
+                                            daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        self._wake.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def request_refresh(self):
+        '''Has the background thread probe every port again right away'''
+        self._force = True
+        self._wake.set()
+
+    def scanning(self):
+        return not self._scanned.is_set() or self._force or self._forcing
+
+    def wait_scanned(self, timeout):
+        '''Waits up to timeout seconds for the first scan, returns whether it is done'''
+        return self._scanned.wait(timeout)
+
+    def _watch(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._forcing, self._force = self._force, False
+            try:
+                self.refresh(force=self._forcing)
+            except Exception:
+                pass
+            self._forcing = False
+            self._wake.wait(self.interval)
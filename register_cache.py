@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import time
+
+from register_map import REGISTER_MAP
+
+# FW version and serial number do not change while a device is connected
+IMMUTABLE_REGISTERS = tuple(REGISTER_MAP.immutable())
+
+
+class RegisterCache:
+    '''
+    Per-device cache of FPGA register responses. Entries are filled by
+    successful reads and updated by successful write acks, so GETs can be
+    answered without touching the serial port. default_ttl (seconds) bounds
+    how long a mutable register is trusted, None keeps it until invalidated.
+    Immutable registers are kept until the device is invalidated.
+    '''
+
+    def __init__(self, default_ttl=None, immutable=IMMUTABLE_REGISTERS):
+        self.default_ttl = default_ttl
+        self.immutable = set(immutable)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _valid(self, response):
+        return (response is not None
+                and response['cmd_status'] == 0
+                and len(response.payload) >= 4)
+
+    def get(self, device, address):
+        with self._lock:
+            entry = self._entries.get((device, address))
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[(device, address)]
+                return None
+            return response
+
+    def put(self, device, address, response, ttl=None):
+        if not self._valid(response):
+            return
+        if address in self.immutable:
+            expires_at = None
+        else:
+            ttl = self.default_ttl if ttl is None else ttl
+            expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[(device, address)] = (response, expires_at)
+
+    def invalidate(self, device=None, address=None):
+        with self._lock:
+            if device is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if key[0] == device and (address is None or key[1] == address):
+                    del self._entries[key]
+
+    def etag(self, device, address, response):
+        tag = '%s:%x:%s' % (device, address, response.payload[-4:].hex())
+        return hashlib.sha1(tag.encode()).hexdigest()
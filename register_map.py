@@ -0,0 +1,239 @@
+FPGA = 'fpga'
+ATHENA = 'athena'
+I2C = 'i2c'
+
+
+def _compile_raw(width):
+    # Value is taken big endian from the last width bytes of the payload,
+    # which is where every read command puts it
+    if(width==1):
+        return lambda d: d[-1]
+    if(width==2):
+        return lambda d: (d[-2]<<8) | d[-1]
+    if(width==3):
+        return lambda d: (d[-3]<<16) | (d[-2]<<8) | d[-1]
+    if(width==4):
+        return lambda d: (d[-4]<<24) | (d[-3]<<16) | (d[-2]<<8) | d[-1]
+    return lambda d: int.from_bytes(bytes(d[-width:]), 'big')
+
+
+def _compile_decoder(width, mask, shift, signed, scale, offset):
+    raw = _compile_raw(width)
+    bits = width*8
+    if(mask==None and shift==0 and not signed and scale==1 and offset==0):
+        return raw
+
+    def decode(d):
+        value = raw(d)
+        if(mask!=None):
+            value &= mask
+        value >>= shift
+        if(signed and value & (1 << (bits-shift-1))):
+            value -= 1 << (bits-shift)
+        if(scale!=1 or offset!=0):
+            return value*scale + offset
+        return value
+    return decode
+
+
+def _compile_encoder(width, mask, shift, scale, offset):
+    bits = width*8
+
+    def encode(value):
+        if(scale!=1 or offset!=0):
+            value = int(round((value - offset)/scale))
+        value = int(value) << shift
+        if(mask!=None):
+            value &= mask
+        elif(value<0):
+            value &= (1 << bits) - 1
+        return value
+    return encode
+
+
+class Register:
+    '''
+    One entry of the register map. bus is FPGA, ATHENA (sensor parameters
+    over SPI) or I2C, in which case dev_addr selects the I2C device and the
+    value is read one byte per register starting at address. width is in
+    bytes, mask and shift select the field, signed/scale/offset convert
+    the raw field to the returned value. error is returned when the read
+    fails.
+    '''
+
+    def __init__(self, name, bus, address, width=4, mask=None, shift=0,
+                 signed=False, scale=1, offset=0, dev_addr=None,
+                 byte_order='big', writable=False, immutable=False, error=-1):
+        self.name = name
+        self.bus = bus
+        self.address = address
+        self.width = width
+        self.mask = mask
+        self.shift = shift
+        self.signed = signed
+        self.scale = scale
+        self.offset = offset
+        self.dev_addr = dev_addr
+        self.byte_order = byte_order
+        self.writable = writable
+        self.immutable = immutable
+        self.error = error
+        self.decode = _compile_decoder(width, mask, shift, signed, scale, offset)
+        self.encode = _compile_encoder(width, mask, shift, scale, offset)
+
+    def read_calls(self):
+        '''The commands reading this register, as (method, args)'''
+        if(self.bus==FPGA):
+            return [('fpga_read', (self.address,))]
+        elif(self.bus==ATHENA):
+            return [('get_sensor_param_athena', (self.address,))]
+        return [('i2c_read', (self.dev_addr, self.address+i, 1)) for i in range(self.width)]
+
+    def raw_from_responses(self, responses):
+        '''Returns the payload bytes holding the value or None on failure'''
+        if(self.bus!=I2C):
+            response = responses[0]
+            if(response==None):
+                return None
+            payload = response.payload
+            if(len(payload)<self.width):
+                return None
+            return payload[-self.width:]
+        data = []
+        for response in responses:
+            if(response==None or len(response.payload)<1):
+                return None
+            data.append(response.payload[0])
+        if(self.byte_order=='little'):
+            data.reverse()
+        return data
+
+    def read_raw(self, comm):
+        responses = []
+        for method, args in self.read_calls():
+            response = getattr(comm, method)(*args)
+            if(response==None):
+                return None
+            responses.append(response)
+        return self.raw_from_responses(responses)
+
+    def read(self, comm):
+        data = self.read_raw(comm)
+        if(data==None):
+            return self.error
+        return self.decode(data)
+
+    def write(self, comm, value):
+        if(not self.writable):
+            raise ValueError('Register %s is read only'%self.name)
+        data = self.encode(value)
+        if(self.bus==FPGA):
+            return comm.fpga_write(self.address, data)
+        elif(self.bus==ATHENA):
+            return comm.set_sensor_param_athena(self.address, data)
+        wr_data = list(data.to_bytes(self.width, 'big'))
+        if(self.byte_order=='little'):
+            wr_data.reverse()
+        return comm.i2c_write(self.dev_addr, self.address, wr_data)
+
+
+class RegisterMap:
+    def __init__(self, registers):
+        self.registers = {}
+        self.by_address = {}
+        for register in registers:
+            self.registers[register.name] = register
+            self.by_address[(register.bus, register.dev_addr, register.address)] = register
+
+    def __getitem__(self, name):
+        return self.registers[name]
+
+    def __contains__(self, name):
+        return name in self.registers
+
+    def lookup(self, bus, address, dev_addr=None):
+        return self.by_address.get((bus, dev_addr, address))
+
+    def immutable(self, bus=FPGA):
+        return [r.address for r in self.registers.values()
+                if r.bus==bus and r.immutable]
+
+    def read(self, comm, name):
+        return self.registers[name].read(comm)
+
+    def read_many(self, comm, names):
+        # All reads go out pipelined, one UART turnaround for the lot
+        registers = [self.registers[name] for name in names]
+        reads = [register.read_calls() for register in registers]
+        responses = comm.call_pipelined([call for calls in reads for call in calls])
+        values = {}
+        for register, calls in zip(registers, reads):
+            data = register.raw_from_responses(responses[:len(calls)])
+            responses = responses[len(calls):]
+            values[register.name] = register.error if data==None else register.decode(data)
+        return values
+
+    def write(self, comm, name, value):
+        return self.registers[name].write(comm, value)
+
+
+REGISTER_MAP = RegisterMap([
+    # FPGA registers
+    Register('firmware_version', FPGA, 0x10, width=4, immutable=True),
+    Register('sensor_temp_raw', FPGA, 0x41, width=2),
+    Register('image_flip', FPGA, 0x43, writable=True),
+    Register('agc_mode', FPGA, 0x51, writable=True),
+    Register('polarity', FPGA, 0x52, writable=True),
+    Register('test_pattern', FPGA, 0x53, writable=True),
+    Register('nuc_enable', FPGA, 0x54, writable=True),
+    Register('row_filter', FPGA, 0x55, writable=True),
+    Register('palette', FPGA, 0x58, writable=True),
+    Register('reticle_type', FPGA, 0x66, writable=True),
+    Register('reticle_colour', FPGA, 0x67, writable=True),
+    Register('image_min', FPGA, 0x69, width=2),
+    Register('image_max', FPGA, 0x70, width=2),
+    Register('image_average_raw', FPGA, 0x71, width=2),
+    Register('temp_area', FPGA, 0x74, width=2),
+    Register('digital_zoom', FPGA, 0x86, writable=True),
+    Register('nuc_mode', FPGA, 0x91, writable=True),
+    Register('num_image_for_avg', FPGA, 0x92, writable=True),
+    Register('image_average', FPGA, 0x93, width=2),
+    Register('brightness', FPGA, 0xD0, writable=True),
+    Register('contrast', FPGA, 0xD4, writable=True),
+    Register('device_serial_num_low', FPGA, 0xD5, width=4, immutable=True),
+    Register('device_serial_num', FPGA, 0xD6, width=4, immutable=True),
+
+    # Athena sensor parameters
+    Register('override_sensor_param', ATHENA, 0x0, width=1),
+    Register('detector_bias', ATHENA, 0x1, width=1, mask=0xFF, writable=True),
+    Register('global_offset_forced', ATHENA, 0x2, width=2, mask=0xFFFF, writable=True),
+    Register('temp_sense_offset', ATHENA, 0x3, width=1, mask=0xF, writable=True),
+    Register('heating_compensation', ATHENA, 0x4, width=1, mask=0xFF, writable=True),
+    Register('sensor_gain', ATHENA, 0x6, width=1, shift=2),
+    Register('store_line_num', ATHENA, 0x9, width=2, writable=True),
+    Register('global_offset', ATHENA, 0xA, width=2),
+    Register('intergration_time_start', ATHENA, 0xC, width=2, mask=0x3FF, writable=True),
+    Register('meta1_avg', ATHENA, 0x11, width=2),
+    Register('meta2_avg', ATHENA, 0x12, width=2),
+    Register('meta3_avg', ATHENA, 0x13, width=2),
+    Register('blind_pix_avg_frame', ATHENA, 0x14, width=2),
+    Register('blind_pix_avg_row', ATHENA, 0x15, width=2),
+    Register('dark_pixel_count', ATHENA, 0x16, width=4),
+    Register('saturated_pixel_count', ATHENA, 0x17, width=4),
+    Register('frame_pixel_count', ATHENA, 0x18, width=4),
+    Register('img_avg', ATHENA, 0x19, width=2),
+    Register('image_min_value', ATHENA, 0x1A, width=2, mask=0x3FFF, writable=True),
+    Register('image_max_value', ATHENA, 0x1B, width=2, mask=0x3FFF, writable=True),
+    Register('coarse_offset_dc', ATHENA, 0x23, width=1),
+
+    # Fuel gauge, I2C device 0x64
+    Register('fuel_gauge_status', I2C, 0x00, width=1, dev_addr=0x64, error=None),
+    Register('fuel_gauge_control', I2C, 0x01, width=1, dev_addr=0x64, writable=True, error=None),
+    Register('fuel_gauge_charge', I2C, 0x02, width=2, dev_addr=0x64, error=None),
+    Register('fuel_gauge_voltage', I2C, 0x08, width=2, dev_addr=0x64, error=None),
+    Register('fuel_gauge_current', I2C, 0x0E, width=2, dev_addr=0x64, error=None),
+    Register('fuel_gauge_temperature', I2C, 0x14, width=2, dev_addr=0x64, error=None),
+
+    # HDC2010 temperature sensor, I2C device 0x40, LSB first
+    Register('hdc2010_temperature', I2C, 0x00, width=2, dev_addr=0x40, byte_order='little'),
+])
@@ -1,15 +1,62 @@
 from cmd_cls_v3 import CMD
+from register_map import REGISTER_MAP
+from link_profile import LINK_PROFILES, characterize
 import serial
 import time
 #import logging
 
 class SensorComm(CMD):
+
+    register_map = REGISTER_MAP
+    # Bytes per get_sdram_data / set_sdram_data2, tuned by characterize_link
+    sdram_chunk_size = 240
+    # Set by the job runner, receives progress and can cancel the operation
+    job = None
+    # (address, data) of the last pipelined SDRAM write, see sdram_pairs
+    last_sdram_write = None
+
+    def report_progress(self, stage, done=None, total=None):
+        if(done==None):
+            self.logger.info(stage)
+        if(self.job!=None):
+            self.job.progress(stage, done, total)
+        elif(done!=None):
+            self.printProgressBar(done, total)
+
+    def apply_link_profile(self, profile):
+        if(profile!=None and profile.chunk_size):
+            self.sdram_chunk_size = profile.chunk_size
+
+    def characterize_link(self, repeats=5, baud_rates=None):
+        '''
+        Measures the link with pings of several sizes (and baud rates), then
+        stores and applies the chunk size with the best expected throughput
+        '''
+        profile = characterize(self, repeats=repeats, baud_rates=baud_rates)
+        LINK_PROFILES.put(self.port_name(), profile)
+        self.apply_link_profile(profile)
+        return profile.to_dict()
+
+    def wait(self, seconds):
+        if(self.job!=None):
+            self.job.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def read_register(self, name):
+        return self.register_map.read(self, name)
+
+    def read_registers(self, names):
+        return self.register_map.read_many(self, names)
+
+    def write_register(self, name, value):
+        return self.register_map.write(self, name, value)
         
     def toggle_test_pattern(self):
         response = self.fpga_read(0x53)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 response=self.fpga_write(0x53,data)
             else:
                 self.logger.info('Warning, command error, %d'%response['cmd_status'])
@@ -35,7 +82,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x54)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 response=self.fpga_write(0x54,data) 
             else:
                 self.logger.info('Warning, command error')
@@ -48,7 +95,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x55)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 response=self.fpga_write(0x55,data)         
             else:
                 self.logger.info('Warning, command error')
@@ -65,7 +112,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x56)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 response=self.fpga_write(0x56,data)
             else:
                 self.logger.info('Warning, command error')
@@ -95,7 +142,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x57)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 self.fpga_write(0x57,data)
             else:
                 self.logger.info('Warning, command error')
@@ -104,13 +151,13 @@ class SensorComm(CMD):
                 
 
     def set_palette(self, palette_type):
-        response=self.fpga_write(0x58, palette_type)
+        self.write_register('palette', palette_type)
 
     def toggle_sharpening(self):
         response = self.fpga_read(0x62)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 self.fpga_write(0x62,data)    
             else:
                 self.logger.info('Warning, command error')
@@ -132,7 +179,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x64)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 self.fpga_write(0x64,data)    
             else:
                 self.logger.info('Warning, command error')
@@ -143,7 +190,7 @@ class SensorComm(CMD):
         response = self.fpga_read(0x52)
         if(response!=None):
             if(response['cmd_status']==0):
-                data = 1-response['data'][-1]
+                data = 1-response.payload[-1]
                 self.fpga_write(0x52,data)   
             else:
                 self.logger.info('Warning, command error')
@@ -172,10 +219,10 @@ class SensorComm(CMD):
             self.fpga_write(0x86,0)
 
     def set_brightness(self, brightness_value):
-        self.fpga_write(0xd0, brightness_value)
+        self.write_register('brightness', brightness_value)
 
     def set_contrast(self, conrtast_value):
-        self.fpga_write(0xd4, conrtast_value)
+        self.write_register('contrast', conrtast_value)
 
     def set_brightness_contrast(self, brightness_value, conrtast_value):
         self.set_brightness(brightness_value)
@@ -202,93 +249,41 @@ class SensorComm(CMD):
         time.sleep(0.5)
         
     def set_fuel_gauge_control_reg(self, value):
-        self.i2c_write(0x64, 0x01, [value])
-    
+        self.write_register('fuel_gauge_control', value)
+
     def get_fuel_gauge_control_reg(self):
-        response = self.i2c_read(0x64, 0x01, 1)
-        if(response==None):
-            return None
-        data = response['data'][0]
-        return data
-    
+        return self.read_register('fuel_gauge_control')
+
     def get_fuel_gauge_status_reg(self):
-        response = self.i2c_read(0x64, 0x00, 1)
-        if(response==None):
-            return None
-        data = response['data'][0]
-        return data
-    
+        return self.read_register('fuel_gauge_status')
+
     def get_fuel_gauge_voltage(self):
-        response = self.i2c_read(0x64, 0x08, 1)
-        if(response==None):
-            return None
-        data_msb = response['data'][0]
-        response = self.i2c_read(0x64, 0x09, 1)
-        if(response==None):
-            return None
-        data_lsb = response['data'][0]
-        data = data_msb << 8 | data_lsb
-        return data
-    
+        return self.read_register('fuel_gauge_voltage')
+
     def get_fuel_gauge_current(self):
-        response = self.i2c_read(0x64, 0x0E, 1)
-        if(response==None):
-            return None
-        data_msb = response['data'][0]
-        response = self.i2c_read(0x64, 0x0F, 1)
-        if(response==None):
-            return None
-        data_lsb = response['data'][0]
-        data = data_msb << 8 | data_lsb
-        return data
-    
+        return self.read_register('fuel_gauge_current')
+
     def get_fuel_gauge_charge(self):
-        response = self.i2c_read(0x64, 0x02, 1)
-        if(response==None):
-            return None
-        data_msb = response['data'][0]
-        response = self.i2c_read(0x64, 0x03, 1)
-        if(response==None):
-            return None
-        data_lsb = response['data'][0]
-        data = data_msb << 8 | data_lsb
-        return data
-    
+        return self.read_register('fuel_gauge_charge')
+
     def get_fuel_gauge_temperature(self):
-        response = self.i2c_read(0x64, 0x14, 1)
-        if(response==None):
-            return None
-        data_msb = response['data'][0]
-        response = self.i2c_read(0x64, 0x15, 1)
-        if(response==None):
-            return None
-        data_lsb = response['data'][0]
-        data = data_msb << 8 | data_lsb
-        return data
-    
+        return self.read_register('fuel_gauge_temperature')
+
     def set_image_flip(self, flip):
-        response = self.fpga_write(0x43, flip)
-            
+        self.write_register('image_flip', flip)
+
     def set_global_offset_forced(self, data):
-        addr = 0x2
-        data = (data & 0xFFFF)
-        self.set_sensor_param_athena(addr, data)
-        
+        self.write_register('global_offset_forced', data)
+
     def set_detector_bias(self, data):
-        addr = 0x1
-        data = (data & 0xFF)
-        self.set_sensor_param_athena(addr, data)
-    
+        self.write_register('detector_bias', data)
+
     def set_heating_compensation(self, data):
-        addr = 0x4
-        data = (data & 0xFF)
-        self.set_sensor_param_athena(addr, data)
+        self.write_register('heating_compensation', data)
 
     def set_temp_sense_offset(self, data):
-        addr = 0x3
-        data = (data & 0xF)
-        self.set_sensor_param_athena(addr, data)
-    
+        self.write_register('temp_sense_offset', data)
+
     def set_coarse_offset_dc(self, data):
         addr = 0x5
         data = (data & 0xFF)
@@ -300,15 +295,11 @@ class SensorComm(CMD):
         self.set_sensor_param_athena(addr, data)
         
     def set_intergration_time_start(self, data):
-        addr = 0xc
-        data = data & 0x3FF
-        self.set_sensor_param_athena(addr, data)
-        
+        self.write_register('intergration_time_start', data)
+
     def set_store_line_num(self, data):
-        # addr = 0x10*2+0x2
-        addr = 9
-        self.set_sensor_param_athena(addr, data)
-        
+        self.write_register('store_line_num', data)
+
     def set_avergae_coarse_gain(self, data):
         addr = 0x10*2+0x1
         self.set_sensor_param_athena(addr, data)
@@ -370,148 +361,47 @@ class SensorComm(CMD):
         self.set_sensor_param_athena(addr, data)
     
     def set_image_min_value(self,data):
-        addr = 0x10+10
-        data = data & 0x3FFF
-        self.set_sensor_param_athena(addr, data)
-    
+        self.write_register('image_min_value', data)
+
     def set_image_max_value(self,data):
-        addr = 0x10+11
-        data = data & 0x3FFF
-        self.set_sensor_param_athena(addr, data)
-    
+        self.write_register('image_max_value', data)
+
     def get_image_min_value(self):
-        addr = 0x10+10
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                image_min_value = (response['data'][-2]<<8) | response['data'][-1]
-                return image_min_value
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('image_min_value')
+
     def get_store_line_num(self):
-        addr = 9
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                line_num = (response['data'][-2]<<8) | response['data'][-1]
-                return line_num
-            except:
-                return -1
-        return -1
+        return self.read_register('store_line_num')
 
     def get_intergration_time_start(self):
-        addr = 0xc
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                sensor_integration_time = (response['data'][-2]<<8) | response['data'][-1]
-                return sensor_integration_time
-            except:
-                return -1
-        return -1
+        return self.read_register('intergration_time_start')
 
     def get_image_max_value(self):
-        addr = 0x10+11
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                image_max_value = (response['data'][-2]<<8) | response['data'][-1]
-                return image_max_value
-            except:
-                return -1
-        return -1
-    
-        
+        return self.read_register('image_max_value')
+
     def get_detector_bias(self):
-        addr = 0x1
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                detector_bias = response['data'][-1]
-                return detector_bias
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('detector_bias')
+
     def get_global_offset_forced(self):
-        addr = 0x2
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                global_offset = (response['data'][-2]<<8) | response['data'][-1]
-                return global_offset
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('global_offset_forced')
+
     def get_global_offset(self):
-        addr = 0xA
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                global_offset = (response['data'][-2]<<8) | response['data'][-1]
-                return global_offset
-            except:
-                return -1
-        return -1
-        
+        return self.read_register('global_offset')
+
     def get_heating_compensation(self):
-        addr = 0x4
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                heating_compensation = response['data'][-1]
-                return heating_compensation
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('heating_compensation')
+
     def get_temp_sense_offset(self):
-        addr = 0x3
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try: 
-                temp_sense_offset = response['data'][-1]
-                return temp_sense_offset
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('temp_sense_offset')
+
     def get_override_sensor_param(self):
-        addr = 0x0
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                override_sensor_param = response['data'][-1]
-                return override_sensor_param
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('override_sensor_param')
+
     def get_coarse_offset_dc(self):
-        addr = 0x10*2+0x3
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                coarse_offset_dc = response['data'][-1]
-                return coarse_offset_dc
-            except:
-                return -1
-        return -1
+        return self.read_register('coarse_offset_dc')
 
     def get_sensor_gain(self):
-        addr = 0x6
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                sensor_gain = response['data'][-1]
-                return sensor_gain >> 2
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('sensor_gain')
+
     def enable_blind_pix_subtraction(self):
         addr = 0x10
         data = 0x01
@@ -524,191 +414,54 @@ class SensorComm(CMD):
         
         
     def get_meta1_avg(self):
-        addr = 0x11
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                meta1_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return meta1_avg
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('meta1_avg')
+
     def get_meta2_avg(self):
-        addr = 0x12
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                meta2_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return meta2_avg
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('meta2_avg')
+
     def get_meta3_avg(self):
-        addr = 0x13
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                meta3_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return meta3_avg
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('meta3_avg')
+
     def get_blind_pix_avg_frame(self):
-        addr = 0x14
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                blind_pix_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return blind_pix_avg
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('blind_pix_avg_frame')
+
     def get_blind_pix_avg_row(self):
-        addr = 0x15
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                blind_pix_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return blind_pix_avg
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('blind_pix_avg_row')
+
     def get_img_avg(self):
-        addr = 0x19
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                img_avg = (response['data'][-2]<<8) | response['data'][-1]
-                return img_avg
-            except:
-                return -1
-        return -1
-        
+        return self.read_register('img_avg')
+
     def get_dark_pixel_count(self):
-        addr = 0x16
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                dark_pixel_count = (response['data'][-4]<<24) | (response['data'][-3]<<16) | (response['data'][-2]<<8) | response['data'][-1]
-                return dark_pixel_count
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('dark_pixel_count')
+
     def get_saturated_pixel_count(self):
-        addr = 0x17
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                saturated_pixel_count = (response['data'][-4]<<24) | (response['data'][-3]<<16) | (response['data'][-2]<<8) | response['data'][-1]
-                return saturated_pixel_count
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('saturated_pixel_count')
+
     def get_frame_pixel_count(self):
-        addr = 0x18
-        response = self.get_sensor_param_athena(addr)
-        if(response!=None):
-            try:
-                frame_pixel_count = (response['data'][-4]<<24) | (response['data'][-3]<<16) | (response['data'][-2]<<8) | response['data'][-1]
-                return frame_pixel_count
-            except:
-                return -1
-        return -1
-        
+        return self.read_register('frame_pixel_count')
+
     def get_image_minmax(self):
-        min_value, max_value = None, None
-        response=self.fpga_read(0x69)
-        if(response!=None):
-            try:
-                min_value = (response['data'][-2] << 8) | response['data'][-1]
-            except:
-                return -1, -1
-        response=self.fpga_read(0x70)
-        if(response!=None):
-            try:
-                max_value = (response['data'][-2] << 8) | response['data'][-1]
-            except:
-                return -1, -1
-        if(min_value==None or max_value==None):
+        values = self.read_registers(['image_min', 'image_max'])
+        if(values['image_min']==-1 or values['image_max']==-1):
             return -1, -1
-        else:
-            return min_value, max_value
+        return values['image_min'], values['image_max']
     
     def get_image_average(self):
-        average = None
-        response = self.fpga_read(0x93)
-        if(response!=None):
-            try:
-                average=(response['data'][-2]<<8 | response['data'][-1])                
-                if(average==None):
-                    return -1
-                else:
-                    return average
-            except:
-                return -1
-        return -1
-                
+        return self.read_register('image_average')
+
     def get_image_average_raw(self):
-        average = None
-        response = self.fpga_read(0x71)
-        if(response!=None):
-            try:
-                average=(response['data'][-2]<<8 | response['data'][-1])
-                if(average==None):
-                    return -1
-                else:
-                    return average
-            except: 
-                return -1
-        return -1
-    
+        return self.read_register('image_average_raw')
+
     def get_device_serial_num(self):
-        serial_num = None
-        response = self.fpga_read(0xD6)
-        if(response!=None):
-            try:
-                if(response!=None):
-                    serial_num=(response['data'][-4]<<24 | response['data'][-3]<<16 |\
-                                response['data'][-2]<<8 | response['data'][-1])
-                    return serial_num
-                else:
-                    return -1
-            except:
-                return -1
-        return -1
-            
+        return self.read_register('device_serial_num')
+
     def get_device_serial_num_new(self):
-        serial_num1 = None
-        serial_num2 = None
-        response = self.fpga_read(0xD5)
-        if(response!=None):
-            try:
-                serial_num1=(response['data'][-4]<<24 | response['data'][-3]<<16 |\
-                            response['data'][-2]<<8 | response['data'][-1])
-            except:
-                return -1
-        else:
+        values = self.read_registers(['device_serial_num_low', 'device_serial_num'])
+        serial_num1 = values['device_serial_num_low']
+        serial_num2 = values['device_serial_num']
+        if(serial_num1==-1 or serial_num2==-1):
             return -1
-        
-        response = self.fpga_read(0xD6)
-        if(response!=None):
-            try:
-                serial_num2=(response['data'][-4]<<24 | response['data'][-3]<<16 |\
-                            response['data'][-2]<<8 | response['data'][-1])
-            except:
-                return -1
-        else:
-            return -1
-        
-        serial_num = ((serial_num2 & 0xFF) << 24) | (serial_num1 & 0x00FFFFFF)
-        return serial_num
+        return ((serial_num2 & 0xFF) << 24) | (serial_num1 & 0x00FFFFFF)
         
     def init_temp_sensor(self):
         #HDC2010 output data rate select
@@ -719,19 +472,12 @@ class SensorComm(CMD):
         self.i2c_write(0x40, 0xf, [0x03])
     
     def get_temp_sensor_data(self):
-        
-        try:
-            # Read LSB
-            value1 = self.i2c_read(0x40, 0x00, 1)
-            #read MSB
-            value2 = self.i2c_read(0x40, 0x01, 1)
-            value = (value2['data'][-1] <<8) | value1['data'][-1]
-            #The following values were inferred from experiments
-            value_temp = ((value*165)/2**16) - 40 -18            
-            return value, value_temp
-        
-        except:
+        value = self.read_register('hdc2010_temperature')
+        if(value==-1):
             return -1
+        #The following values were inferred from experiments
+        value_temp = ((value*165)/2**16) - 40 -18            
+        return value, value_temp
 
     def shutter_close(self):
         shutter_dev_addr = 0x52
@@ -774,36 +520,13 @@ class SensorComm(CMD):
             self.fpga_write(0x54, 3)        
 
     def get_sensor_temp_raw(self):
-        temp = None
-        response = self.fpga_read(0x41)
-        if(response!=None):
-            temp = (response['data'][-2] << 8) | response['data'][-1]
-            return temp
-        return -1
+        return self.read_register('sensor_temp_raw')
 
     def get_temp_area(self):
-        temp = None
-        response = self.fpga_read(0x74)
-        if(response!=None):
-            try:
-                temp = (response['data'][-2] << 8) | response['data'][-1]
-                return temp
-            except:
-                return -1
-        return -1
-    
+        return self.read_register('temp_area')
+
     def get_device_firmware_version(self):
-        serial_num = None
-        response = self.fpga_read(0x10)
-        if(response!=None):
-            try:
-                serial_num=(response['data'][-4]<<24 | response['data'][-3]<<16 |\
-                            response['data'][-2]<<8 | response['data'][-1])
-                return serial_num
-            except:
-                return -1
-        else:
-            return -1
+        return self.read_register('firmware_version')
 
     def switch_temp_area(self, value):
         if(value==0):
@@ -873,6 +596,7 @@ class SensorComm(CMD):
                     qspi_start_address += num_blocks_64k_erase*0x10000
                     print('64K Blocks %d'%num_blocks_64k_erase)
                     print('qspi_address = %x'%qspi_start_address)
+                    self.report_progress('erase', qspi_start_address-address, size)
                 else:
                     num_blocks_32k_erase = (qspi_end_address - qspi_start_address)>>15
                     if(num_blocks_32k_erase>0):
@@ -886,6 +610,7 @@ class SensorComm(CMD):
                         qspi_start_address += num_blocks_32k_erase*0x8000
                         print('32K Blocks %d'%num_blocks_32k_erase)
                         print('qspi_address = %x'%qspi_start_address)
+                        self.report_progress('erase', qspi_start_address-address, size)
                     else:
                         num_blocks_4k_erase = (qspi_end_address - qspi_start_address)>>12
                         self.erase_qspi_4KB(qspi_start_address, num_blocks_4k_erase)
@@ -898,6 +623,7 @@ class SensorComm(CMD):
                         qspi_start_address += num_blocks_4k_erase*0x1000
                         print('4K Blocks %d'%num_blocks_4k_erase)
                         print('qspi_address = %x'%qspi_start_address)
+                        self.report_progress('erase', qspi_start_address-address, size)
             #32K boundary        
             elif(boundary==0x8000):
                 num_blocks_32k_erase = (qspi_end_address - qspi_start_address)>>15
@@ -912,6 +638,7 @@ class SensorComm(CMD):
                     qspi_start_address += 1*0x8000
                     print('32K Blocks 1')
                     print('qspi_address = %x'%qspi_start_address)
+                    self.report_progress('erase', qspi_start_address-address, size)
                 else:
                     num_blocks_4k_erase = ((qspi_end_address - qspi_start_address)>>12)
                     self.erase_qspi_4KB(qspi_start_address, num_blocks_4k_erase)
@@ -924,6 +651,7 @@ class SensorComm(CMD):
                     qspi_start_address += num_blocks_4k_erase*0x1000
                     print('4K Blocks %d'%num_blocks_4k_erase)
                     print('qspi_address = %x'%qspi_start_address)
+                    self.report_progress('erase', qspi_start_address-address, size)
             #4K boundary        
             elif((boundary & 0x0FFF)==0):
                 num_blocks_4k_erase = ((qspi_end_address - qspi_start_address)>>12)
@@ -942,6 +670,7 @@ class SensorComm(CMD):
                         qspi_start_address += num_blocks*0x1000
                         print('4K Blocks %d'%num_blocks)
                         print('qspi_address = %x'%qspi_start_address)
+                        self.report_progress('erase', qspi_start_address-address, size)
                     #if below 32K boundary check if blocks are greater than 64K    
                     elif(num_blocks_4k_erase>=16):
                         num_blocks = (((qspi_start_address & 0xFFFF0000)+0x10000) - qspi_start_address)>>12
@@ -955,6 +684,7 @@ class SensorComm(CMD):
                         qspi_start_address += num_blocks*0x1000
                         print('4K Blocks %d'%num_blocks)
                         print('qspi_address = %x'%qspi_start_address)
+                        self.report_progress('erase', qspi_start_address-address, size)
                     else:
                         self.erase_qspi_4KB(qspi_start_address, num_blocks_4k_erase)
                         ret = self.qspi_success_status(sleeptime_max=num_blocks_4k_erase*100)
@@ -966,6 +696,7 @@ class SensorComm(CMD):
                         qspi_start_address += num_blocks_4k_erase*0x1000
                         print('4K Blocks %d'%num_blocks_4k_erase)
                         print('qspi_address = %x'%qspi_start_address)
+                        self.report_progress('erase', qspi_start_address-address, size)
                 else:
                     self.erase_qspi_4KB(qspi_start_address, num_blocks_4k_erase)
                     ret = self.qspi_success_status(sleeptime_max=num_blocks_4k_erase*100)
@@ -977,6 +708,7 @@ class SensorComm(CMD):
                     qspi_start_address += num_blocks_4k_erase*0x1000
                     print('4K Blocks %d'%num_blocks_4k_erase)
                     print('qspi_address = %x'%qspi_start_address)
+                    self.report_progress('erase', qspi_start_address-address, size)
             
 
     def qspi_success_status(self, sleeptime_max=50):
@@ -985,12 +717,13 @@ class SensorComm(CMD):
         while(unsuccessful):
             unsuccessful = False
             response=self.get_qspi_status()
-            for i in range(response['length']-4-3):
-                if(response['data'][i]!=0):
+            payload = response.payload
+            for i in range(response.length-4-3):
+                if(payload[i]!=0):
                     unsuccessful = True
             if(unsuccessful==False):
                 break
-            time.sleep(0.1)
+            self.wait(0.1)
             sleeptime += 10
             if(sleeptime>sleeptime_max):
                 unsuccessful = True
@@ -1009,7 +742,9 @@ class SensorComm(CMD):
             return
         if(response!=None):
             if(mode!=4):
-                time.sleep(number_frames//2)
+                self.report_progress('Capturing %d frames'%number_frames)
+                self.wait(number_frames//2)
+            self.report_progress('Storing snapshots in QSPI Flash')
             while(1):
                 if(mode==4):
                     sleeptime = 200
@@ -1038,7 +773,7 @@ class SensorComm(CMD):
     
     def capture_save_offset_table(self, table):
         self.perform_nuc1pt_apply()
-        time.sleep(3)
+        self.wait(3)
         self.save_offset_table(table)
     
     def capture_save_frame(self, table):
@@ -1127,12 +862,13 @@ class SensorComm(CMD):
         #take the column 3 values and store it in a array
         address = memory_address+2*2
         for i in range(519):
+            self.report_progress('read', i, 519)
             self.set_sdram_addr(address);
             response = self.get_sdram_data(4); #get value stored in column
-            value = (response['data'][-2] << 8) | response['data'][-1]
+            value = response.u16(-2)
             heating_monitor_array[i] = value
             address = address+664*2
-            time.sleep(0.1)
+            self.wait(0.1)
             
         return heating_monitor_array
 
@@ -1153,7 +889,7 @@ class SensorComm(CMD):
             if(i>39 and i<321):
                 self.set_sdram_addr(address);
                 response = self.get_sdram_data(4); #get value stored in column
-                value = (response['data'][-2] << 8) | response['data'][-1]
+                value = response.u16(-2)
                 heating_monitor_array[i] = value
                 # address = address+664*2
                 # time.sleep(0.1)
@@ -1163,18 +899,99 @@ class SensorComm(CMD):
         return heating_monitor_array
         
     def store_reticle(self, address, reticle_img):
+        '''
+        Writes the whole image, a last chunk shorter than sdram_chunk_size
+        included; the tail used to be dropped. Raises IOError naming the
+        address when a chunk cannot be written, a job then ends as failed.
+        '''
         reticle_img_len = len(reticle_img)
-        #Send 240 bytes at once
-        x = reticle_img_len//240
-
-        for i in range(x):
-            self.printProgressBar(i,x)
-            response=self.set_sdram_addr(address)
-            response=self.set_sdram_data2(reticle_img[i*240:(i+1)*240])
-            #increment address by 240
-            address = address+240
-    
+        chunk = self.sdram_chunk_size
+        x = (reticle_img_len+chunk-1)//chunk
+        #Address and data pairs for one pipeline window go out together
+        step = max(self.pipeline_window//2, 1)
+
+        for i in range(0, x, step):
+            self.report_progress('write', i, x)
+            pairs = [(address+j*chunk, reticle_img[j*chunk:(j+1)*chunk]) for j in range(i, min(i+step, x))]
+            for (addr, data), response in zip(pairs, self.sdram_pairs('set_sdram_data2', pairs)):
+                if(response==None):
+                    raise IOError('SDRAM write failed at 0x%x'%addr)
     
+    def sdram_pairs(self, method, pairs):
+        '''
+        Runs set_sdram_addr followed by method for each (address, arg) pair,
+        pipelined. The two only make sense together, so a pair with a failed
+        half is run again on its own afterwards. Returns the responses of
+        method, None where the pair failed again.
+
+        The device keeps the last address it was given, so when an address
+        packet is lost the data packet behind it still goes to the address
+        of an earlier pair. For writes that pair is written again as well,
+        the last one of the previous call when the batch has none.
+        '''
+        calls = []
+        for addr, arg in pairs:
+            calls.append(('set_sdram_addr', (addr,)))
+            calls.append((method, (arg,)))
+        responses = self.call_pipelined(calls, retry=1)
+        writing = method!='get_sdram_data'
+        redo = set()
+        redo_previous = False
+        for i in range(len(pairs)):
+            if(responses[2*i]==None or responses[2*i+1]==None):
+                redo.add(i)
+            if(writing and responses[2*i]==None):
+                j = i-1
+                while(j>=0 and responses[2*j]==None):
+                    j -= 1
+                if(j>=0):
+                    redo.add(j)
+                elif(self.last_sdram_write!=None):
+                    redo_previous = True
+                else:
+                    self.logger.warning('SDRAM address 0x%x lost, data may have gone to an '
+                                        'earlier address'%pairs[i][0])
+        if(redo_previous):
+            addr, arg = self.last_sdram_write
+            self.set_sdram_addr(addr)
+            if(getattr(self, method)(arg)==None):
+                raise IOError('SDRAM at 0x%x may be overwritten and could not be restored'%addr)
+        results = [responses[2*i+1] for i in range(len(pairs))]
+        for i in sorted(redo):
+            addr, arg = pairs[i]
+            if(self.set_sdram_addr(addr)==None):
+                results[i] = None
+            else:
+                results[i] = getattr(self, method)(arg)
+        self.last_sdram_write = pairs[-1] if writing and pairs else None
+        return results
+
+    def read_sdram_chunk(self, address, size):
+        '''Reads up to sdram_chunk_size bytes, returns them as bytes or None'''
+        self.set_sdram_addr(address)
+        response=self.get_sdram_data(size)
+        if(response==None):
+            return None
+        return response.payload.tobytes()
+
+    def read_sdram_block(self, address, size):
+        '''Reads size bytes with pipelined chunk reads, returns bytes or None'''
+        pairs = []
+        while(size>0):
+            chunk = min(size, self.sdram_chunk_size)
+            pairs.append((address, chunk))
+            address += chunk
+            size -= chunk
+        data = bytearray()
+        for response in self.sdram_pairs('get_sdram_data', pairs):
+            if(response==None):
+                return None
+            data += response.payload
+        return bytes(data)
+
+    def sdram_block_size(self):
+        return self.sdram_chunk_size*max(self.pipeline_window//2, 1)
+
     def read_data_sdram(self, address, size):
         if(size%4!=0):
             print('Size not a multiple of 4')
@@ -1182,21 +999,17 @@ class SensorComm(CMD):
         size_ = size
         address_ = address
         data = []
+        block_size = self.sdram_block_size()
         
         while(size_>0):
-            self.printProgressBar((size-size_), size)
-            if(size_>240):
-                self.set_sdram_addr(address_)
-                response=self.get_sdram_data(240)
-                data.extend(response['data'])
-                size_ -=240
-                address_+=240
-            else:
-                self.set_sdram_addr(address_)
-                response=self.get_sdram_data(size_)
-                data.extend(response['data'])
-                address_+=size_
-                size_ = 0
+            self.report_progress('read', size-size_, size)
+            block = min(size_, block_size)
+            block_data = self.read_sdram_block(address_, block)
+            if(block_data==None):
+                raise IOError('SDRAM read failed at 0x%x'%address_)
+            data.extend(block_data)
+            size_ -= block
+            address_ += block
         
         return data
                 
@@ -1236,23 +1049,23 @@ class SensorComm(CMD):
             return -1
         if(temp in t_area[0]):
             table = t_area[0][temp]
-            self.logger.info('Switching to temp area0')
+            self.report_progress('Switching to temp area0')
             self.switch_temp_area(0)
             if(temp in t_area[1]):
-                time.sleep(2*60)
-            self.logger.info('Disabling NUC')
+                self.wait(2*60)
+            self.report_progress('Disabling NUC')
             self.disable_nuc()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values')
             min_value1,max_value1 = self.get_image_minmax()
-            self.logger.info('Enabling NUC')
+            self.report_progress('Enabling NUC')
             self.enable_nuc()
-            time.sleep(3)
-            self.logger.info('Capturing and Saving offset')
+            self.wait(3)
+            self.report_progress('Capturing and Saving offset')
             self.capture_save_offset_table(table)
             tmp = self.get_sensor_temp_raw()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values again')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values again')
             min_value2, max_value2 = self.get_image_minmax()
             
             with open('calib_log_'+self.dev_name+'.log', 'a') as f:
@@ -1264,23 +1077,23 @@ class SensorComm(CMD):
             
         if(temp in t_area[1]):
             table = t_area[1][temp]
-            self.logger.info('Switching to temp area1')
+            self.report_progress('Switching to temp area1')
             self.switch_temp_area(1)
             if((temp in t_area[0]) or(temp in t_area[2])):
-                time.sleep(2*60)
-            self.logger.info('Disabling NUC')
+                self.wait(2*60)
+            self.report_progress('Disabling NUC')
             self.disable_nuc()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values')
             min_value1,max_value1 = self.get_image_minmax()
-            self.logger.info('Enabling NUC')
+            self.report_progress('Enabling NUC')
             self.enable_nuc()
-            time.sleep(3)
-            self.logger.info('Capturing and Saving offset')
+            self.wait(3)
+            self.report_progress('Capturing and Saving offset')
             self.capture_save_offset_table(table)
             tmp = self.get_sensor_temp_raw()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values again')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values again')
             min_value2, max_value2 = self.get_image_minmax()
             
             with open('calib_log_'+self.dev_name+'.log', 'a') as f:
@@ -1292,23 +1105,23 @@ class SensorComm(CMD):
 
         if(temp in t_area[2]):
             table = t_area[2][temp]
-            self.logger.info('Switching to temp area2')
+            self.report_progress('Switching to temp area2')
             self.switch_temp_area(2)
             if((temp in t_area[1]) or (temp in t_area[3]) ):
-                time.sleep(2*60)
-            self.logger.info('Disabling NUC')
+                self.wait(2*60)
+            self.report_progress('Disabling NUC')
             self.disable_nuc()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values')
             min_value1,max_value1 = self.get_image_minmax()
-            self.logger.info('Enabling NUC')
+            self.report_progress('Enabling NUC')
             self.enable_nuc()
-            time.sleep(3)
-            self.logger.info('Capturing and Saving offset')
+            self.wait(3)
+            self.report_progress('Capturing and Saving offset')
             self.capture_save_offset_table(table)
             tmp = self.get_sensor_temp_raw()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values again')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values again')
             min_value2, max_value2 = self.get_image_minmax()
             
             with open('calib_log_'+self.dev_name+'.log', 'a') as f:
@@ -1320,23 +1133,23 @@ class SensorComm(CMD):
  
         if(temp in t_area[3]):
             table = t_area[3][temp]
-            self.logger.info('Switching to temp area3')
+            self.report_progress('Switching to temp area3')
             self.switch_temp_area(3)
             if(temp in t_area[2]) :
-                time.sleep(2*60)
-            self.logger.info('Disabling NUC')
+                self.wait(2*60)
+            self.report_progress('Disabling NUC')
             self.disable_nuc()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values')
             min_value1,max_value1 = self.get_image_minmax()
-            self.logger.info('Enabling NUC')
+            self.report_progress('Enabling NUC')
             self.enable_nuc()
-            time.sleep(3)
-            self.logger.info('Capturing and Saving offset')
+            self.wait(3)
+            self.report_progress('Capturing and Saving offset')
             self.capture_save_offset_table(table)
             tmp = self.get_sensor_temp_raw()
-            time.sleep(3)
-            self.logger.info('Getting IMG min and max values again')
+            self.wait(3)
+            self.report_progress('Getting IMG min and max values again')
             min_value2, max_value2 = self.get_image_minmax()
             
             with open('calib_log_'+self.dev_name+'.log', 'a') as f:
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import serial
+from sensor_comm_v3 import SensorComm
+from cmd_cls_v3 import DeadlineExceeded
+from link_profile import LINK_PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolEntry:
+    def __init__(self, key):
+        self.key = key
+        self.lock = threading.RLock()
+        self.ser = None
+        self.comm = None
+        # Baud rate the last caller asked for and the one the port runs at,
+        # a link profile may override the asked one
+        self.requested = None
+        self.baud_rate = None
+        self.last_used = time.monotonic()
+
+
+class SerialPool:
+    '''
+    Keeps one open SensorComm per com_port so that a request only pays for
+    the packet round-trip. Access to a port is serialized by a per-port
+    lock whatever baud rate the callers ask for, a caller asking for another
+    one switches the open port over. A lost port is reopened on the next use
+    and ports that
+    have not been used for idle_timeout seconds are closed in the background.
+    on_close, if given, is called with (com_port, baud_rate) whenever an
+    open port is closed.
+    '''
+
+    def __init__(self, dev_name='Athena640', idd='new', timeout=5,
+                 idle_timeout=60, comm_cls=SensorComm, on_close=None):
+        self.dev_name = dev_name
+        self.idd = idd
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.comm_cls = comm_cls
+        self.on_close = on_close
+        self._entries = {}
+        self._entries_lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def _get_entry(self, key):
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry(key)
+                self._entries[key] = entry
+            if self._reaper is None and self.idle_timeout:
+                self._reaper = threading.Thread(target=self._reap_idle,
+                                                name='serial-pool-reaper',
+                                                daemon=True)
+                self._reaper.start()
+            return entry
+
+    def _baud_for(self, com_port, baud_rate):
+        # A characterized link runs at the baud rate measured best for it
+        profile = LINK_PROFILES.get(com_port)
+        if profile is not None and profile.baud_rate and profile.baud_rate != baud_rate:
+            logger.info('Using %s at %d baud from its link profile instead of %d',
+                        com_port, profile.baud_rate, baud_rate)
+            return profile, profile.baud_rate
+        return profile, baud_rate
+
+    def _open(self, entry, com_port, baud_rate):
+        profile, effective = self._baud_for(com_port, baud_rate)
+        ser = serial.Serial(com_port, effective, timeout=self.timeout)
+        entry.ser = ser
+        entry.requested = baud_rate
+        entry.baud_rate = effective
+        entry.comm = self.comm_cls(ser, dev_name=self.dev_name, idd=self.idd)
+        entry.comm.apply_link_profile(profile)
+
+    def _switch_baud(self, entry, com_port, baud_rate):
+        # Called with the entry lock held, nobody else is on the wire
+        profile, effective = self._baud_for(com_port, baud_rate)
+        if effective != entry.baud_rate:
+            entry.ser.baudrate = effective
+            entry.baud_rate = effective
+        entry.requested = baud_rate
+
+    def _close(self, entry):
+        if entry.ser is not None:
+            try:
+                entry.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            if self.on_close is not None:
+                self.on_close(entry.key, entry.baud_rate)
+        entry.ser = None
+        entry.comm = None
+        entry.requested = None
+        entry.baud_rate = None
+
+    def baud_rate(self, com_port, baud_rate=None):
+        '''Baud rate the port is open at, None if it is closed'''
+        with self._entries_lock:
+            entry = self._entries.get(com_port)
+        return None if entry is None else entry.baud_rate
+
+    @contextmanager
+    def connection(self, com_port, baud_rate, timeout=None, deadline=None):
+        '''
+        timeout overrides the read timeout for this session only. deadline,
+        a time.monotonic() value, bounds the wait for the port as well as
+        every command sent in the session.
+        '''
+        baud_rate = int(baud_rate)
+        entry = self._get_entry(com_port)
+        if deadline is None:
+            entry.lock.acquire()
+        elif not entry.lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise DeadlineExceeded('Deadline exceeded waiting for %s' % com_port)
+        try:
+            if entry.ser is None or not entry.ser.is_open:
+                self._close(entry)
+                self._open(entry, com_port, baud_rate)
+            elif entry.requested != baud_rate:
+                self._switch_baud(entry, com_port, baud_rate)
+            if timeout is not None:
+                entry.comm.set_read_timeout(timeout)
+            if deadline is not None:
+                entry.comm.set_deadline(deadline)
+            try:
+                yield entry.comm
+            except (serial.SerialException, OSError):
+                # Port was unplugged or went away, reopen it on the next use
+                self._close(entry)
+                raise
+            finally:
+                if deadline is not None and entry.comm is not None:
+                    entry.comm.set_deadline(None)
+                if timeout is not None and entry.comm is not None:
+                    entry.comm.set_read_timeout(self.timeout)
+                entry.last_used = time.monotonic()
+        finally:
+            entry.lock.release()
+
+    def close(self, com_port, baud_rate=None):
+        # The entry stays, callers waiting on its lock must not end up
+        # with a second handle on the port
+        with self._entries_lock:
+            entry = self._entries.get(com_port)
+        if entry is not None:
+            with entry.lock:
+                self._close(entry)
+
+    def close_all(self):
+        self._stop.set()
+        with self._entries_lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            with entry.lock:
+                self._close(entry)
+
+    def _reap_idle(self):
+        interval = max(self.idle_timeout / 2.0, 0.5)
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            with self._entries_lock:
+                entries = list(self._entries.values())
+            for entry in entries:
+                # Skip ports that are busy, they are clearly not idle
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if entry.ser is not None and now - entry.last_used > self.idle_timeout:
+                        self._close(entry)
+                finally:
+                    entry.lock.release()
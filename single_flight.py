@@ -0,0 +1,52 @@
+import threading
+import time
+
+from cmd_cls_v3 import DeadlineExceeded
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Collapses concurrent calls with the same key into one. The first caller
+    runs fn, callers that arrive while it is in flight wait for it and get
+    the same result (or exception) back. deadline, a time.monotonic()
+    value, bounds how long a follower waits; the leader's fn has to keep
+    its own deadline.
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, deadline=None, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded('Deadline exceeded waiting for %r' % (key,))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
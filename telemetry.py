@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+
+
+class TelemetrySubscription:
+    def __init__(self, key, maxsize=16):
+        self.key = key
+        self.queue = queue.Queue(maxsize)
+
+    def publish(self, sample):
+        # A slow client drops its oldest samples instead of stalling the poller
+        while True:
+            try:
+                self.queue.put_nowait(sample)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+
+class TelemetryPoller(threading.Thread):
+    '''
+    Samples the live values of one device every interval seconds and hands
+    each sample to every subscriber, so the serial load does not depend on
+    the number of clients watching.
+    '''
+
+    def __init__(self, serial_pool, com_port, baud_rate, interval=1.0):
+        threading.Thread.__init__(self, name='telemetry-%s' % com_port, daemon=True)
+        self.serial_pool = serial_pool
+        self.com_port = com_port
+        self.baud_rate = baud_rate
+        self.interval = interval
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        sample = {"timestamp": time.time(), "com_port": self.com_port}
+        try:
+            with self.serial_pool.connection(self.com_port, self.baud_rate) as cmd_gen:
+                sample["image_min"], sample["image_max"] = cmd_gen.get_image_minmax()
+                sample["image_average"] = cmd_gen.get_image_average()
+                sample["sensor_temp_raw"] = cmd_gen.get_sensor_temp_raw()
+                sample["temp_area"] = cmd_gen.get_temp_area()
+                sample["fuel_gauge_voltage"] = cmd_gen.get_fuel_gauge_voltage()
+                sample["fuel_gauge_current"] = cmd_gen.get_fuel_gauge_current()
+        except Exception as e:
+            sample["error"] = str(e)
+        return sample
+
+    def add(self, subscription):
+        with self._lock:
+            self.subscribers.append(subscription)
+
+    def remove(self, subscription):
+        with self._lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+            return len(self.subscribers)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            sample = self.sample()
+            with self._lock:
+                subscribers = list(self.subscribers)
+            for subscription in subscribers:
+                subscription.publish(sample)
+            self._stop_event.wait(max(self.interval - (time.monotonic() - started), 0))
+
+
+class TelemetryHub:
+    '''
+    Owns one TelemetryPoller per device. The poller is started by the first
+    subscriber, at that subscriber's baud rate, and stopped when the last
+    one goes away. With the device broker the hub lives in the broker and
+    workers subscribe through device_broker.RemoteTelemetryHub, so there is
+    one poller per device whatever the number of workers.
+    '''
+
+    def __init__(self, serial_pool, interval=1.0):
+        self.serial_pool = serial_pool
+        self.interval = interval
+        self._pollers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, com_port, baud_rate):
+        key = com_port
+        subscription = TelemetrySubscription(key)
+        with self._lock:
+            poller = self._pollers.get(key)
+            if poller is None:
+                poller = TelemetryPoller(self.serial_pool, com_port, int(baud_rate),
+                                         interval=self.interval)
+                self._pollers[key] = poller
+                poller.add(subscription)
+                poller.start()
+            else:
+                poller.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            poller = self._pollers.get(subscription.key)
+            if poller is not None and poller.remove(subscription) == 0:
+                poller.stop()
+                del self._pollers[subscription.key]
+
+    def stop(self):
+        with self._lock:
+            pollers = list(self._pollers.values())
+            self._pollers.clear()
+        for poller in pollers:
+            poller.stop()
@@ -0,0 +1,56 @@
+import os
+import sys
+
+# No stored link profiles from test runs and no probing of the host's ports
+os.environ.setdefault('LINK_PROFILES', '')
+os.environ.setdefault('PORT_DISCOVERY', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import serial
+
+from device_simulator import DeviceSimulator
+from sensor_comm_v3 import SensorComm
+from timeout_policy import TIMEOUT_POLICY
+
+
+@pytest.fixture(autouse=True)
+def fresh_timeout_policy():
+    # The policy is shared by every connection, samples must not leak between tests
+    TIMEOUT_POLICY.reset()
+    yield
+    TIMEOUT_POLICY.reset()
+
+
+@pytest.fixture
+def connect():
+    '''
+    connect(idd='new', timeout=1, **simulator_args) starts a DeviceSimulator
+    and returns it with a SensorComm on its pty
+    '''
+    opened = []
+
+    def connect(idd='new', timeout=1, **simulator_args):
+        simulator = DeviceSimulator(**simulator_args)
+        port = simulator.start()
+        ser = serial.Serial(port, simulator.baud_rate or 115200, timeout=timeout)
+        opened.append((simulator, ser))
+        return simulator, SensorComm(ser, dev_name='test', idd=idd)
+
+    yield connect
+    for simulator, ser in opened:
+        ser.close()
+        simulator.stop()
+
+
+@pytest.fixture
+def app_client():
+    '''A Flask test client of app.py and a DeviceSimulator for it to talk to'''
+    import app
+    simulator = DeviceSimulator(baud_rate=0, latency=0)
+    port = simulator.start()
+    app.register_cache.invalidate(port)
+    yield simulator, app.app.test_client()
+    app.serial_pool.close(port, 115200)
+    app.register_cache.invalidate(port)
+    simulator.stop()
@@ -0,0 +1,38 @@
+import asyncio
+
+from async_sensor_comm import AsyncSensorComm
+
+
+def run_async(simulator, body):
+    async def main():
+        comm = await AsyncSensorComm.open(simulator.port, 115200, dev_name='test', timeout=1)
+        try:
+            return await body(comm)
+        finally:
+            comm.close()
+    return asyncio.run(main())
+
+
+def test_read_register_matches_the_blocking_driver(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    names = ['firmware_version', 'fuel_gauge_charge', 'fuel_gauge_voltage']
+    expected = comm.read_registers(names)
+
+    async def body(async_comm):
+        return await async_comm.read_registers(names)
+
+    assert run_async(simulator, body) == expected
+
+
+def test_read_data_sdram_uses_the_chunk_size(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    address = 0x1000
+    simulator.model.sdram[address:address+400] = bytes(i & 0xFF for i in range(400))
+
+    async def body(async_comm):
+        async_comm.sdram_chunk_size = 96
+        return await async_comm.read_data_sdram(address, 400)
+
+    assert bytes(run_async(simulator, body)) == bytes(simulator.model.sdram[address:address+400])
+    # set_sdram_addr and get_sdram_data for each of 5 chunks
+    assert simulator.stats['commands'] == 10
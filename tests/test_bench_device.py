@@ -0,0 +1,62 @@
+import json
+import sys
+
+import pytest
+
+import bench_device
+
+SMALL = ['--baud', '0', '--latency', '0', '--samples', '20', '--warmup', '2',
+         '--sdram-size', '1024', '--reticle-size', '496', '--erase-range', '0x1F000:0x11000']
+
+
+def bench(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['bench_device.py'] + SMALL + list(args))
+    return bench_device.main()
+
+
+@pytest.fixture(scope='module')
+def results(tmp_path_factory):
+    path = tmp_path_factory.mktemp('bench') / 'baseline.json'
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        assert bench(monkeypatch, '--output', str(path)) == 0
+    return path, json.loads(path.read_text())
+
+
+def test_every_scenario_runs(results):
+    path, run = results
+    assert set(run['results']) == set(name for name, scenario in bench_device.SCENARIOS)
+    for name, result in run['results'].items():
+        assert result['metrics'] and all(value > 0 for value in result['metrics'].values()), name
+    # 4K up to the 64K boundary, then one 64K erase
+    assert run['results']['erase_qspi']['info']['plan'] == ['4K x1 at 0x1f000', '64K x1 at 0x20000']
+    assert run['results']['store_reticle']['info']['bytes'] == 0x1f0
+    assert run['simulator']['commands'] > 0 and run['simulator']['bad_requests'] == 0
+    assert run['settings']['baud'] == 0
+
+
+def test_same_run_is_no_regression(results, monkeypatch, tmp_path):
+    path, run = results
+    assert bench(monkeypatch, '--output', str(tmp_path / 'out.json'),
+                 '--baseline', str(path), '--tolerance', '100') == 0
+
+
+def test_slower_run_is_a_regression(results, monkeypatch, tmp_path, capsys):
+    path, run = results
+    # A baseline ten times faster than anything this run can do
+    for result in run['results'].values():
+        for metric, value in result['metrics'].items():
+            factor = 10 if bench_device.higher_is_better(metric) else 0.1
+            result['metrics'][metric] = value * factor
+    faster = tmp_path / 'faster.json'
+    faster.write_text(json.dumps(run))
+    assert bench(monkeypatch, '--output', str(tmp_path / 'out.json'), '--baseline', str(faster),
+                 '--scenario', 'fpga_read') == 1
+    assert 'REGRESSION' in capsys.readouterr().out
+
+
+def test_compare_direction():
+    baseline = {'results': {'a': {'metrics': {'p50_seconds': 1.0, 'kb_per_second': 100.0}}}}
+    current = {'results': {'a': {'metrics': {'p50_seconds': 2.0, 'kb_per_second': 150.0}}}}
+    changes = {c['metric']: c for c in bench_device.compare(current, baseline, tolerance=0.2)}
+    assert changes['p50_seconds']['change'] == -1.0 and changes['p50_seconds']['regression']
+    assert changes['kb_per_second']['change'] == 0.5 and not changes['kb_per_second']['regression']
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+from command_journal import CommandJournal, RECEIVED, SENT, read_records
+from device_simulator import Faults
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def journal_records(path):
+    with open(path, 'rb') as f:
+        return list(read_records(f))
+
+
+def test_import_writes_no_journal(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('CMD_JOURNAL', None)
+    subprocess.run([sys.executable, '-c', 'import cmd_cls_v3'], cwd=str(tmp_path), env=env,
+                   check=True)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_round_trip_through_the_decoder(connect, tmp_path):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    path = str(tmp_path / 'journal.bin')
+    comm.journal = CommandJournal(path)
+    response = comm.fpga_read(0x10)
+    comm.journal.close()
+
+    records = journal_records(path)
+    assert records[0][1] == SENT and records[0][3] == bytes(comm.last_cmd)
+    assert all(port == simulator.port for timestamp, direction, port, data in records)
+    reply = b''.join(data for timestamp, direction, port, data in records if direction == RECEIVED)
+    assert reply == bytes(response.frame)
+
+    output = subprocess.run([sys.executable, os.path.join(ROOT, 'command_journal.py'), path],
+                            check=True, capture_output=True, text=True).stdout
+    assert output == ('\n COMND : \t' + ''.join(hex(b) + ', ' for b in comm.last_cmd)
+                      + '\n REPLY : \t' + ''.join(hex(b) + ', ' for b in reply) + '\n')
+
+
+def test_broken_replies_are_kept(connect, tmp_path):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.2,
+                              faults=Faults(bad_checksum_rate=1.0))
+    path = str(tmp_path / 'journal.bin')
+    comm.journal = CommandJournal(path)
+    assert comm.fpga_read(0x10) is None
+    comm.journal.close()
+    received = [data for timestamp, direction, port, data in journal_records(path)
+                if direction == RECEIVED]
+    # Every retry's reply reached the journal even though none was valid
+    assert len(received) >= 2
+    assert simulator.stats['bad_checksums'] >= 2
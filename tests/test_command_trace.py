@@ -0,0 +1,86 @@
+from command_trace import STAGES, TraceRing
+from device_simulator import Faults
+
+FPGA_READ_FW = 0x5010
+
+
+def stage_names(transaction):
+    return [stage for stage, t in transaction.stages]
+
+
+def test_ring_records_every_stage(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    ring = TraceRing()
+    comm.set_trace(ring)
+    comm.fpga_read(0x10)
+    comm.fpga_write(0x77, 5)
+    read, write = ring.snapshot()
+    assert stage_names(read) == ['encode', 'encoded', 'flushed', 'written',
+                                 'first_byte', 'frame', 'parsed']
+    assert set(stage_names(read)) <= set(STAGES)
+    assert (read.cmd, read.status, read.port) == (FPGA_READ_FW, 'ok', comm.port_name())
+    assert write.sequence == read.sequence + 1
+    times = [t for stage, t in read.stages]
+    assert times == sorted(times) and read.total() == times[-1] - times[0]
+    assert read.to_dict()["cmd"] == "0x5010"
+    assert [stage for stage, seconds in read.durations()] == stage_names(read)[1:]
+
+
+def test_retry_repeats_the_send_stages(connect):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.2,
+                              faults=Faults(lost_requests=[(FPGA_READ_FW, 1)]))
+    ring = TraceRing()
+    comm.set_trace(ring)
+    assert comm.fpga_read(0x10) is not None
+    transaction, = ring.snapshot()
+    names = stage_names(transaction)
+    assert transaction.status == 'ok'
+    assert names.count('written') == 2 and names.count('flushed') == 2
+    assert names[-1] == 'parsed'
+
+
+def test_failed_command_is_recorded(connect):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.05, faults=Faults(drop_rate=1.0))
+    ring = TraceRing()
+    comm.set_trace(ring)
+    assert comm.fpga_read(0x10) is None
+    transaction, = ring.snapshot()
+    assert transaction.status == 'failed'
+    assert 'frame' not in stage_names(transaction)
+
+
+def test_ring_keeps_the_latest(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    ring = TraceRing(size=3)
+    comm.set_trace(ring)
+    for address in range(5):
+        comm.fpga_read(address)
+    assert [transaction.cmd & 0xFFF for transaction in ring.snapshot()] == [2, 3, 4]
+    summary = ring.summary()
+    assert summary['parsed']['count'] == 3
+    assert summary['written']['max'] >= summary['written']['mean'] >= 0
+    ring.clear()
+    assert ring.snapshot() == []
+
+
+def test_pipelined_commands_are_traced(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    ring = TraceRing()
+    comm.set_trace(ring)
+    comm.read_data_sdram(0, 960)
+    transactions = ring.snapshot()
+    # An address and a data command per 240 byte chunk
+    assert len(transactions) == 8
+    assert all(stage_names(t) == ['written', 'frame', 'parsed'] for t in transactions)
+    assert len(set(t.sequence for t in transactions)) == 8
+
+
+def test_no_sink_no_records(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    ring = TraceRing()
+    comm.set_trace(ring)
+    comm.fpga_read(0x10)
+    comm.set_trace(None)
+    comm.fpga_read(0x10)
+    assert len(ring.snapshot()) == 1
+    assert comm.trace_marks is None
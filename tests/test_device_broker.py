@@ -0,0 +1,48 @@
+import os
+import stat
+import threading
+
+import pytest
+
+from device_broker import BrokerClient, BrokerError, DeviceBroker, write_authkey
+from serial_pool import SerialPool
+
+
+@pytest.fixture
+def broker(tmp_path, monkeypatch, connect):
+    monkeypatch.delenv('DEVICE_BROKER_AUTHKEY', raising=False)
+    simulator, comm = connect(baud_rate=0, latency=0)
+    address = str(tmp_path / 'broker.sock')
+    pool = SerialPool(idle_timeout=0)
+    broker = DeviceBroker(address, pool, authkey=write_authkey(address))
+    thread = threading.Thread(target=broker.serve_forever, daemon=True)
+    thread.start()
+    while broker.listener is None:
+        thread.join(0.01)
+    yield simulator, address
+    # accept() does not wake up when the listener closes, the thread is a daemon
+    broker.shutdown()
+    pool.close_all()
+
+
+def test_socket_and_key_file_are_owner_only(broker):
+    simulator, address = broker
+    assert stat.S_IMODE(os.stat(address + '.key').st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(address).st_mode) & 0o077 == 0
+
+
+def test_client_reads_the_key_file(broker):
+    simulator, address = broker
+    with BrokerClient(address).connection(simulator.port, 115200, timeout=1) as comm:
+        assert comm.ping_device()
+
+
+def test_client_without_a_key_is_refused(tmp_path, monkeypatch):
+    monkeypatch.delenv('DEVICE_BROKER_AUTHKEY', raising=False)
+    with pytest.raises(BrokerError):
+        BrokerClient(str(tmp_path / 'missing.sock')).connection('port', 115200).__enter__()
+
+
+def test_broker_needs_a_key(tmp_path):
+    with pytest.raises(BrokerError):
+        DeviceBroker(str(tmp_path / 'broker.sock'), SerialPool(idle_timeout=0), authkey=b'')
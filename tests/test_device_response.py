@@ -0,0 +1,82 @@
+import pickle
+
+import pytest
+
+from device_response import Response
+from device_simulator import new_reply, old_reply
+
+PAYLOAD = [0x00, 0x01, 0x02, 0x03, 0xA5]
+
+
+@pytest.fixture
+def response():
+    return Response(new_reply(0x1234, 0x52, 0, 0x5010, PAYLOAD))
+
+
+def test_reads_like_the_old_response_dict(response):
+    assert response['header'] == 0xE1
+    assert response['packet_sequence'] == 0x1234
+    assert response['cmd_type'] == 0x52
+    assert response['cmd'] == 0x5010
+    assert response['cmd_status'] == 0
+    assert response['length'] == len(PAYLOAD) + 4
+    assert response['data'] == tuple(PAYLOAD)
+    assert response['data'][-1] == 0xA5 and response['data'][-4:] == (0x01, 0x02, 0x03, 0xA5)
+    assert list(response) == list(Response.KEYS) and 'data' in response
+    assert response.get('missing', 7) == 7
+    with pytest.raises(KeyError):
+        response['missing']
+    assert response.to_dict()['data'] == tuple(PAYLOAD)
+
+
+def test_old_idd_reply():
+    response = Response(old_reply(0, 0x5010, PAYLOAD), idd='old')
+    assert response['cmd'] == 0x5010 and response['data'] == tuple(PAYLOAD)
+    assert response.u32(-4) == 0x010203A5
+
+
+def test_data_is_built_once(response):
+    assert response.data is response.data
+
+
+def test_is_immutable(response):
+    with pytest.raises(AttributeError):
+        response.idd = 'old'
+    with pytest.raises(AttributeError):
+        response.frame = b''
+    with pytest.raises(TypeError):
+        response.data[0] = 1
+    with pytest.raises(TypeError):
+        response['data'] = ()
+    # The payload is a read only view of the frame
+    with pytest.raises(TypeError):
+        response.payload[0] = 1
+    assert response.data == tuple(PAYLOAD)
+
+
+def test_pickles_as_the_frame(response):
+    response.data
+    copy = pickle.loads(pickle.dumps(response))
+    assert copy == response and copy.data == response.data
+
+
+def test_app_reports_payload_bytes(app_client):
+    simulator, client = app_client
+    simulator.model.fpga[0x10] = 0x01020304
+    simulator.model.fpga[0xD0] = 0x0A0B0C0D
+    body = client.get('/get_fw_version', query_string={"com_port": simulator.port,
+                                                       "baud_rate": 115200}).get_json()
+    assert body["fw_version"] == '1.2.3.4'
+    assert body["command_response"] == '0x01,0x02,0x03,0x04'
+    body = client.post('/registers/batch', json={"com_port": simulator.port, "baud_rate": 115200,
+                                                 "operations": [{"op": "read", "address": "0xd0"}]})
+    assert body.get_json()["results"][0]["data"] == [0x0A, 0x0B, 0x0C, 0x0D]
+
+
+def test_toggle_flips_the_last_payload_bit(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    simulator.model.fpga[0x53] = 0
+    comm.toggle_test_pattern()
+    assert simulator.model.fpga[0x53] == 1
+    comm.toggle_test_pattern()
+    assert simulator.model.fpga[0x53] == 0
@@ -0,0 +1,68 @@
+import os
+import time
+
+from device_simulator import DeviceSimulator, Faults, new_reply
+from frame_parser import FrameParser
+from packet_encoder import PacketEncoder
+
+
+def test_new_idd_reply_frames_parse():
+    framer = FrameParser()
+    framer.feed(new_reply(0x1234, 0x52, 0, 0x5010, b'\x00\x03\x00\x01'))
+    frame = framer.next_frame()
+    assert frame is not None
+    assert frame[1] << 8 | frame[2] == 0x1234
+    assert bytes(frame[10:14]) == b'\x00\x03\x00\x01'
+
+
+def test_register_and_sdram_round_trip(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    comm.fpga_write(0x77, 0x12345678)
+    assert comm.fpga_read(0x77).u32() == 0x12345678
+    assert simulator.model.fpga[0x77] == 0x12345678
+    comm.set_sdram_addr(0x1000)
+    comm.set_sdram_data2(list(range(16)))
+    comm.set_sdram_addr(0x1000)
+    assert comm.get_sdram_data(16).payload.tobytes() == bytes(range(16))
+
+
+def test_qspi_busy_after_erase(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    simulator.model.erase_seconds_per_4k = 0.05
+    comm.erase_qspi_4KB(0x10000, 2)
+    assert comm.get_qspi_status().data[0] == 1
+    time.sleep(0.15)
+    assert comm.get_qspi_status().data[0] == 0
+    assert simulator.model.qspi[0x10000:0x12000] == b'\xFF' * 0x2000
+
+
+def test_qspi_success_status_waits_for_the_erase(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    simulator.model.erase_seconds_per_4k = 0.1
+    comm.erase_qspi_4KB(0x10000, 1)
+    assert comm.qspi_success_status() == 0
+    assert comm.get_qspi_status().payload[0] == 0
+
+
+def test_stale_replies_are_skipped(connect):
+    simulator, comm = connect(baud_rate=0, latency=0, faults=Faults(stale_rate=1.0), seed=1)
+    for address in (0x10, 0xD0, 0xD5):
+        assert comm.fpga_read(address).u32() == simulator.model.fpga[address]
+    assert simulator.stats['stale_replies'] >= 2
+
+
+def test_lost_request_never_reaches_the_device():
+    faults = Faults(lost_requests=[(0x5077, 1)])
+    with DeviceSimulator(baud_rate=0, latency=0, faults=faults) as simulator:
+        fd = os.open(simulator.port, os.O_RDWR | os.O_NOCTTY)
+        try:
+            encoder = PacketEncoder('new', 0xE0, 0x3E, 0xFF)
+            os.write(fd, bytes(encoder.encode(1, 0x5077, 0x57, 4, [0, 0, 0, 1])))
+            os.write(fd, bytes(encoder.encode(2, 0x5077, 0x57, 4, [0, 0, 0, 2])))
+            time.sleep(0.1)
+            reply = os.read(fd, 100)
+        finally:
+            os.close(fd)
+    assert reply[1] << 8 | reply[2] == 2
+    assert simulator.model.fpga[0x77] == 2
+    assert simulator.stats['lost_requests'] == 1
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from device_simulator import DeviceSimulator
+
+MISSING = '/dev/no-such-camera'
+
+
+@pytest.fixture
+def fleet_client():
+    '''Two DeviceSimulators and a Flask test client of app.py'''
+    import app
+    simulators = [DeviceSimulator(baud_rate=0, latency=0) for i in range(2)]
+    for simulator in simulators:
+        app.register_cache.invalidate(simulator.start())
+    yield simulators, app.app.test_client()
+    for simulator in simulators:
+        app.serial_pool.close(simulator.port, 115200)
+        app.register_cache.invalidate(simulator.port)
+        simulator.stop()
+
+
+def test_set_reports_every_device(fleet_client):
+    simulators, client = fleet_client
+    ports = [simulators[0].port, MISSING, simulators[1].port]
+    response = client.post('/fleet/set', json={"ports": ports, "baud_rate": 115200,
+                                               "setting": "brightness", "value": 77})
+    assert response.status_code == 500
+    body = response.get_json()
+    assert body["status"] == "error"
+    results = body["results"]
+    # In the order the ports were given, each with its own latency
+    assert [result["com_port"] for result in results] == ports
+    assert [result["status"] for result in results] == ["success", "error", "success"]
+    assert all(result["latency_ms"] >= 0 for result in results)
+    assert results[0]["value"] == 77 and results[2]["value"] == 77
+    assert [simulator.model.fpga[0xD0] for simulator in simulators] == [77, 77]
+
+
+def test_devices_are_driven_in_parallel(fleet_client):
+    simulators, client = fleet_client
+    simulators[1].latency = 0.3
+    response = client.post('/fleet/set', json={"ports": [simulator.port for simulator in simulators],
+                                               "baud_rate": 115200, "setting": "contrast", "value": 3})
+    assert response.status_code == 200
+    fast, slow = response.get_json()["results"]
+    # The slow camera does not hold up the fast one
+    assert slow["latency_ms"] >= 300 and fast["latency_ms"] < 300
+
+
+def test_batch_on_a_group(fleet_client, tmp_path, monkeypatch):
+    import app
+    simulators, client = fleet_client
+    groups = tmp_path / 'groups.json'
+    groups.write_text(json.dumps({"lab": [simulator.port for simulator in simulators]}))
+    monkeypatch.setattr(app.fleet, 'groups_file', str(groups))
+    simulators[1].model.fpga[0xD4] = 9
+    assert client.get('/fleet/groups').get_json()["groups"] == json.loads(groups.read_text())
+    response = client.post('/fleet/registers/batch', json={
+        "group": "lab", "baud_rate": 115200,
+        "operations": [{"op": "write", "name": "brightness", "value": 5},
+                       {"op": "read", "name": "contrast"}]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == ["success", "success"]
+    assert [result["results"][1]["decoded"] for result in results] == \
+        [simulators[0].model.fpga.get(0xD4, 0), 9]
+    assert [simulator.model.fpga[0xD0] for simulator in simulators] == [5, 5]
+
+
+def test_unknown_group_or_setting_is_rejected(fleet_client):
+    simulators, client = fleet_client
+    assert client.post('/fleet/set', json={"group": "nope", "baud_rate": 115200,
+                                           "setting": "brightness", "value": 1}).status_code == 400
+    assert client.post('/fleet/set', json={"ports": [simulators[0].port], "baud_rate": 115200,
+                                           "setting": "gain", "value": 1}).status_code == 400
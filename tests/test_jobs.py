@@ -0,0 +1,93 @@
+import json
+import time
+
+import app
+
+# get_heating_monitor_data sleeps 0.1 s per row for 519 rows
+LONG_JOB = 'get_heating_monitor_data'
+
+
+def submit(client, simulator, operation, params=None):
+    return client.post('/jobs', json={"com_port": simulator.port, "baud_rate": 115200,
+                                      "operation": operation, "params": params or {}})
+
+
+def wait_for(client, job_id, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get('/jobs/%s' % job_id).get_json()["job"]
+        if condition(job) or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def finished(job):
+    return job["state"] in ('succeeded', 'failed', 'cancelled')
+
+
+def test_submitted_job_runs_to_its_result(app_client):
+    simulator, client = app_client
+    data = bytes((i * 13) & 0xFF for i in range(960))
+    simulator.model.sdram[0x1000:0x1000 + len(data)] = data
+    response = submit(client, simulator, 'read_data_sdram', {"address": "0x1000", "size": 960})
+    assert response.status_code == 202
+    job_id = response.get_json()["job"]["job_id"]
+    job = wait_for(client, job_id, finished)
+    assert job["state"] == "succeeded"
+    assert job["progress"]["stage"] == "read"
+    body = client.get('/jobs/%s/result' % job_id).get_json()
+    assert bytes(body["result"]) == data
+    assert job_id in [job["job_id"] for job in client.get('/jobs').get_json()["jobs"]]
+
+
+def test_running_job_is_cancelled(app_client):
+    simulator, client = app_client
+    job_id = submit(client, simulator, LONG_JOB).get_json()["job"]["job_id"]
+    wait_for(client, job_id, lambda job: job["progress"] and job["progress"].get("done"))
+    start = time.monotonic()
+    assert client.post('/jobs/%s/cancel' % job_id).status_code == 200
+    job = wait_for(client, job_id, finished)
+    assert job["state"] == "cancelled"
+    # Stops at the next progress report or sleep, not at the end of the job
+    assert time.monotonic() - start < 2
+    assert client.get('/jobs/%s/result' % job_id).status_code == 409
+
+
+def test_full_queue_is_rejected(app_client, monkeypatch):
+    simulator, client = app_client
+    monkeypatch.setattr(app.job_manager, 'max_queued', 2)
+    submit(client, simulator, LONG_JOB)
+    queued = submit(client, simulator, LONG_JOB).get_json()["job"]["job_id"]
+    try:
+        response = submit(client, simulator, LONG_JOB)
+        assert response.status_code == 429
+        # A job that never started is cancelled at once
+        assert client.post('/jobs/%s/cancel' % queued).get_json()["job"]["state"] == "cancelled"
+        assert submit(client, simulator, 'take_snapshot').status_code == 202
+    finally:
+        jobs = [job["job_id"] for job in client.get('/jobs').get_json()["jobs"]]
+        for job_id in jobs:
+            client.post('/jobs/%s/cancel' % job_id)
+        for job_id in jobs:
+            wait_for(client, job_id, finished)
+
+
+def test_bad_requests(app_client):
+    simulator, client = app_client
+    assert submit(client, simulator, 'format_disk').status_code == 400
+    assert submit(client, simulator, 'read_data_sdram', {"address": "0x1000"}).status_code == 400
+    assert submit(client, simulator, 'read_data_sdram',
+                  {"address": "somewhere", "size": 4}).status_code == 400
+    assert client.get('/jobs/nope').status_code == 404
+    assert client.post('/jobs/nope/cancel').status_code == 404
+
+
+def test_events_follow_the_job(app_client):
+    simulator, client = app_client
+    job_id = submit(client, simulator, 'read_data_sdram',
+                    {"address": "0x0", "size": 480}).get_json()["job"]["job_id"]
+    response = client.get('/jobs/%s/events' % job_id)
+    states = [json.loads(line[len('data: '):])["state"]
+              for line in response.get_data(as_text=True).split('\n') if line.startswith('data: ')]
+    # The stream ends with the job
+    assert states[-1] == "succeeded"
@@ -0,0 +1,37 @@
+from link_profile import LINK_PROFILES, LinkProfile, MAX_CHUNK, characterize
+from serial_pool import SerialPool
+from timeout_policy import TIMEOUT_POLICY
+
+
+class QuietJob:
+    def progress(self, stage, done=None, total=None):
+        pass
+
+    def sleep(self, seconds):
+        pass
+
+
+def test_characterize_clean_link_after_small_pings(connect):
+    simulator, comm = connect(baud_rate=115200, latency=0.001, timeout=2)
+    comm.job = QuietJob()
+    for i in range(20):
+        comm.ping(0)
+    profile = characterize(comm, repeats=3)
+    assert profile.byte_error_rate == 0
+    assert profile.chunk_size == MAX_CHUNK
+    assert comm.timeout_policy is TIMEOUT_POLICY
+
+
+def test_pool_reports_the_baud_rate_of_the_profile(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    port = simulator.port
+    LINK_PROFILES.put(port, LinkProfile(0.001, 1e-4, 0.0, 96, 57600))
+    pool = SerialPool(idle_timeout=0)
+    try:
+        with pool.connection(port, 115200) as pooled:
+            assert pooled.ser.baudrate == 57600
+            assert pooled.sdram_chunk_size == 96
+        assert pool.baud_rate(port, 115200) == 57600
+    finally:
+        pool.close_all()
+        LINK_PROFILES._profiles.pop(port, None)
@@ -0,0 +1,71 @@
+import re
+
+from device_simulator import Faults
+
+FPGA_READ_BRIGHTNESS = 0x50D0
+# Histograms are per command class, all FPGA reads share one
+FPGA_READ = 0x5000
+
+
+def metric(client, name, port):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(r'^%s\{port="%s"\} (\S+)$' % (name, re.escape(port)), text, re.M)
+    return float(match.group(1)) if match else 0
+
+
+def histogram_count(client, port, cmd):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(r'^device_command_duration_seconds_count\{port="%s",cmd="0x%04x"\} (\d+)$'
+                      % (re.escape(port), cmd), text, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def read_brightness(client, simulator, times=1):
+    response = client.post('/registers/batch', json={
+        "com_port": simulator.port, "baud_rate": 115200,
+        "operations": [{"op": "read", "address": "0xd0"}]*times})
+    assert response.status_code == 200
+    return response.get_json()["results"]
+
+
+def test_retry_is_counted(app_client):
+    simulator, client = app_client
+    simulator.model.fpga[0xD0] = 12
+    # Enough round trips for a learned timeout, so the retry does not wait the port's
+    read_brightness(client, simulator, 5)
+    retries = metric(client, 'device_command_retries_total', simulator.port)
+    failures = metric(client, 'device_command_failures_total', simulator.port)
+    commands = histogram_count(client, simulator.port, FPGA_READ)
+
+    simulator.faults = Faults(lost_requests=[(FPGA_READ_BRIGHTNESS, 6)])
+    assert read_brightness(client, simulator)[0]["value"] == 12
+    assert simulator.stats['lost_requests'] == 1
+
+    assert metric(client, 'device_command_retries_total', simulator.port) == retries + 1
+    assert metric(client, 'device_command_failures_total', simulator.port) == failures
+    # One command, however many attempts it took
+    assert histogram_count(client, simulator.port, FPGA_READ) == commands + 1
+
+
+def test_failure_is_counted(app_client):
+    simulator, client = app_client
+    read_brightness(client, simulator, 5)
+    failures = metric(client, 'device_command_failures_total', simulator.port)
+    simulator.faults = Faults(drop_rate=1.0)
+    response = client.post('/registers/batch', json={
+        "com_port": simulator.port, "baud_rate": 115200,
+        "operations": [{"op": "read", "address": "0xd0"}]})
+    assert response.get_json()["results"][0]["status"] == "error"
+    assert metric(client, 'device_command_failures_total', simulator.port) == failures + 1
+
+
+def test_exposition_format(app_client):
+    simulator, client = app_client
+    read_brightness(client, simulator)
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE device_command_retries_total counter' in text
+    assert '# TYPE device_command_duration_seconds histogram' in text
+    assert 'device_command_duration_seconds_bucket{port="%s",cmd="0x%04x",le="+Inf"}' \
+        % (simulator.port, FPGA_READ) in text
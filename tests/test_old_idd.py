@@ -0,0 +1,30 @@
+from frame_parser import OldFrameParser
+from device_simulator import old_reply
+
+
+def test_old_frame_parser_skips_noise_and_bad_checksums():
+    framer = OldFrameParser()
+    good = old_reply(0, 0x4010, b'\x01\x00\x03\x00')
+    bad = bytearray(good)
+    bad[-1] ^= 0xFF
+    framer.feed(b'\x00\xFE\x12' + bytes(bad) + bytes(good))
+    frame = framer.next_frame()
+    assert bytes(frame) == bytes(good)
+    assert framer.drain_stats()[1] == 1
+
+
+def test_old_idd_commands(connect):
+    simulator, comm = connect(idd='old', baud_rate=0, latency=0)
+    response = comm.fpga_read(0x10)
+    assert response is not None and response['cmd_status'] == 0
+    assert int.from_bytes(response.payload, 'little') == 0x00030001
+    assert comm.fpga_write(0x77, 0x1234)['cmd_status'] == 0
+    assert simulator.model.fpga[0x77] == 0x1234
+    assert comm.i2c_read(0x40, 0x00, 2).payload.tobytes() == b'\xC7\x80'
+
+
+def test_old_idd_error_reply(connect):
+    simulator, comm = connect(idd='old', baud_rate=0, latency=0)
+    # No such command on the device, it answers 0xDEAD
+    response = comm.send_receive_response(comm.con_cmd(0x1234, 0x57, 0, []))
+    assert response is not None and response['cmd_status'] == 1
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from cmd_cls_v3 import CMD
+from packet_encoder import PacketEncoder
+
+
+def baseline_con_cmd(cmd_cls, sequence, cmd, cmd_type, length, data):
+    '''CMD.con_cmd before the PacketEncoder, sequence is the already incremented counter'''
+    pkt = []
+    pkt.append(cmd_cls.header)
+    if(cmd_cls.idd=='old'):
+        pkt.append(cmd_cls.dev_id)
+        pkt.append(cmd_cls.dev_no)
+        pkt.append(cmd & 0xFF)
+        pkt.append(cmd>>8)
+        pkt.append(length & 0xFF)
+        pkt.append(length >> 8)
+        if(length!=0):
+            pkt.extend(data)
+        crc = 0
+        for i in range(len(pkt)-1):
+            crc=crc+pkt[i+1]
+        crc = crc%256
+        crc = ~crc & 0xFF
+        crc = (crc+1)%256
+        return pkt+[crc]
+    pkt.append((sequence >> 8) & 0xFF)
+    pkt.append((sequence & 0xFF))
+    pkt.append(cmd_cls.dev_id)
+    pkt.append(cmd_cls.dev_no)
+    pkt.append((length+3) & 0xFF)
+    pkt.append(cmd_type)
+    pkt.append(cmd>>8)
+    pkt.append(cmd & 0xFF)
+    if(length!=0):
+        pkt.extend(data)
+    crc = 0
+    for i in range(len(pkt)-1-2):
+        crc=crc+pkt[i+1+2]
+    crc = crc%256
+    return pkt+[crc, cmd_cls.footer1, cmd_cls.footer2]
+
+
+def baseline_split_num(data, split_way=4, endian=0):
+    l = []
+    mask = 0xFF
+    for i in range(split_way):
+        l.append((data & (mask << (8*i))) >> (8*i))
+    if(endian==0):
+        return l[::-1]
+    return l
+
+
+def random_command(rng):
+    length = rng.choice([0, 0, 1, 4, 5, 6, 240, rng.randrange(256)])
+    data = [rng.randrange(256) for i in range(length)]
+    return rng.randrange(0x10000), rng.choice([0x52, 0x57]), length, data
+
+
+@pytest.mark.parametrize('idd', ['new', 'old'])
+def test_packets_match_the_baseline(idd):
+    cmd_cls = CMD(idd=idd)
+    rng = random.Random(idd)
+    sequence = 0
+    for i in range(3000):
+        cmd, cmd_type, length, data = random_command(rng)
+        sequence += 1
+        assert bytes(cmd_cls.con_cmd(cmd, cmd_type, length, data)) == \
+            bytes(baseline_con_cmd(cmd_cls, sequence, cmd, cmd_type, length, data))
+
+
+def test_sequence_wraps_like_the_baseline():
+    cmd_cls = CMD(idd='new')
+    cmd_cls.sequence = 0xFFFD
+    sequence = 0xFFFD
+    packets = []
+    for i in range(4):
+        sequence += 1
+        packet = cmd_cls.con_cmd(0x5010, 0x52, 0, [])
+        assert bytes(packet) == bytes(baseline_con_cmd(cmd_cls, sequence, 0x5010, 0x52, 0, []))
+        packets.append(packet[1] << 8 | packet[2])
+    assert packets == [0xFFFE, 0xFFFF, 0x0000, 0x0001]
+    # The counter itself wraps, replies carry 16 bits
+    assert cmd_cls.sequence == 1
+
+
+def test_known_packets():
+    cmd_cls = CMD(idd='new')
+    # fpga_read(0x10), as shown by the web UI
+    assert bytes(cmd_cls.build_packet('fpga_read', 0x10)) == \
+        bytes([0xE0, 0x00, 0x01, 0x3E, 0xFF, 0x03, 0x52, 0x50, 0x10, 0xF2, 0xFF, 0xFE])
+    old = CMD(idd='old')
+    packet = old.con_cmd(0x4010, 0x52, 4, [1, 2, 3, 4])
+    # Old IDD: checksum is the two's complement of the sum after the header
+    assert (sum(packet[1:]) & 0xFF) == 0
+    assert bytes(packet) == bytes(baseline_con_cmd(old, 1, 0x4010, 0x52, 4, [1, 2, 3, 4]))
+
+
+def test_length_field_is_taken_from_length():
+    cmd_cls = CMD(idd='new')
+    # Data is dropped when length is 0, as con_cmd always did
+    assert bytes(cmd_cls.con_cmd(0x6004, 0x57, 0, [9, 9])) == \
+        bytes(baseline_con_cmd(cmd_cls, 1, 0x6004, 0x57, 0, [9, 9]))
+
+
+def test_templates_are_bounded():
+    encoder = PacketEncoder('new', 0xE0, 0x3E, 0xFF, max_templates=8)
+    for cmd in range(20):
+        encoder.encode(1, cmd, 0x52, 0, b'')
+    assert len(encoder._templates) <= 8
+
+
+@pytest.mark.parametrize('split_way', [1, 2, 3, 4])
+@pytest.mark.parametrize('endian', [0, 1])
+def test_split_num_matches_the_baseline(split_way, endian):
+    cmd_cls = CMD(idd='new')
+    rng = random.Random(split_way)
+    for value in [0, 0xFFFFFFFF, 0x280000000] + [rng.randrange(1 << 34) for i in range(200)]:
+        assert list(cmd_cls.split_num(value, split_way, endian)) == \
+            baseline_split_num(value, split_way, endian)
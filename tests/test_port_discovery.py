@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from device_simulator import DeviceSimulator, Faults
+from port_discovery import PortDiscovery
+from serial_pool import SerialPool
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    simulator = DeviceSimulator(baud_rate=0, latency=0, faults=Faults(drop_rate=1.0))
+    port = simulator.start()
+    pool = SerialPool(idle_timeout=0)
+    discovery = PortDiscovery(pool, probe_timeout=0.2, retry_interval=0)
+    monkeypatch.setattr(discovery, 'list_ports', lambda: [port])
+    yield simulator, pool, discovery
+    discovery.stop()
+    pool.close_all()
+    simulator.stop()
+
+
+def test_port_that_did_not_answer_is_probed_again(discovery):
+    simulator, pool, discovery = discovery
+    ports, devices = discovery.refresh()
+    assert not devices[0]["responsive"]
+    # The camera comes up on a port already known
+    simulator.faults.drop_rate = 0.0
+    ports, devices = discovery.refresh()
+    assert devices[0]["responsive"]
+
+
+def test_busy_port_keeps_its_last_result(discovery):
+    simulator, pool, discovery = discovery
+    simulator.faults.drop_rate = 0.0
+    discovery.refresh()
+    held = threading.Event()
+    release = threading.Event()
+
+    def job():
+        with pool.connection(simulator.port, discovery.baud_rate):
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    try:
+        held.wait(5)
+        start = time.monotonic()
+        ports, devices = discovery.refresh(force=True)
+        assert time.monotonic() - start < 2
+        assert devices[0]["responsive"] and devices[0]["busy"]
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_request_refresh_probes_in_the_background(discovery):
+    simulator, pool, discovery = discovery
+    simulator.faults.drop_rate = 0.0
+    discovery.interval = 60
+    discovery.start()
+    assert discovery.wait_scanned(5)
+    discovery.request_refresh()
+    deadline = time.monotonic() + 5
+    while discovery.scanning() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not discovery.scanning()
+    assert discovery.snapshot()[1][0]["responsive"]
+
+
+def probes_of(discovery, monkeypatch):
+    probed = []
+    probe = discovery.probe
+    monkeypatch.setattr(discovery, 'probe', lambda port: probed.append(port) or probe(port))
+    return probed
+
+
+def test_silent_port_backs_off(discovery, monkeypatch):
+    simulator, pool, discovery = discovery
+    discovery.retry_interval = 0.2
+    probed = probes_of(discovery, monkeypatch)
+    discovery.refresh()
+    discovery.refresh()
+    assert len(probed) == 1
+    time.sleep(0.25)
+    discovery.refresh()
+    assert len(probed) == 2
+    # Twice the wait after the second miss
+    time.sleep(0.25)
+    discovery.refresh()
+    assert len(probed) == 2
+    assert discovery._schedule[simulator.port][0] == 2
+
+
+def test_replugged_port_is_probed_at_once(discovery, monkeypatch):
+    simulator, pool, discovery = discovery
+    discovery.retry_interval = 60
+    probed = probes_of(discovery, monkeypatch)
+    discovery.refresh()
+    monkeypatch.setattr(discovery, 'list_ports', lambda: [])
+    assert discovery.refresh() == ([], [])
+    monkeypatch.setattr(discovery, 'list_ports', lambda: [simulator.port])
+    simulator.faults.drop_rate = 0.0
+    ports, devices = discovery.refresh()
+    assert len(probed) == 2 and devices[0]["responsive"]
+
+
+def test_responsive_port_that_stops_answering_is_dropped(discovery, monkeypatch):
+    simulator, pool, discovery = discovery
+    simulator.faults.drop_rate = 0.0
+    discovery.validate_interval = 0
+    probed = probes_of(discovery, monkeypatch)
+    assert discovery.refresh()[1][0]["responsive"]
+    assert discovery.refresh()[1][0]["responsive"]
+    simulator.faults.drop_rate = 1.0
+    assert not discovery.refresh()[1][0]["responsive"]
+    # Checked with pings, the full probe ran once
+    assert len(probed) == 1
+
+
+def test_stop_ends_the_watcher(discovery):
+    simulator, pool, discovery = discovery
+    discovery.start()
+    thread = discovery._thread
+    discovery.stop(timeout=5)
+    assert not thread.is_alive()
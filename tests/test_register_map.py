@@ -0,0 +1,165 @@
+import pytest
+
+from register_map import REGISTER_MAP, FPGA, ATHENA, I2C
+
+# The decodes the getters did by hand before the register map
+def old8(d):
+    return d[-1]
+
+
+def old16(d):
+    return (d[-2]<<8) | d[-1]
+
+
+def old32(d):
+    return (d[-4]<<24) | (d[-3]<<16) | (d[-2]<<8) | d[-1]
+
+
+# getter, bus, address, hand decode of the read payload, mask the map adds.
+# Masked Athena fields were only masked on write before, now on read too.
+OLD_GETTERS = [
+    ('get_device_firmware_version', FPGA, 0x10, old32, None),
+    ('get_sensor_temp_raw', FPGA, 0x41, old16, None),
+    ('get_image_average_raw', FPGA, 0x71, old16, None),
+    ('get_temp_area', FPGA, 0x74, old16, None),
+    ('get_image_average', FPGA, 0x93, old16, None),
+    ('get_device_serial_num', FPGA, 0xD6, old32, None),
+    ('get_override_sensor_param', ATHENA, 0x0, old8, None),
+    ('get_detector_bias', ATHENA, 0x1, old8, None),
+    ('get_global_offset_forced', ATHENA, 0x2, old16, None),
+    ('get_temp_sense_offset', ATHENA, 0x3, old8, 0xF),
+    ('get_heating_compensation', ATHENA, 0x4, old8, None),
+    ('get_sensor_gain', ATHENA, 0x6, lambda d: d[-1] >> 2, None),
+    ('get_store_line_num', ATHENA, 0x9, old16, None),
+    ('get_global_offset', ATHENA, 0xA, old16, None),
+    ('get_intergration_time_start', ATHENA, 0xC, old16, 0x3FF),
+    ('get_meta1_avg', ATHENA, 0x11, old16, None),
+    ('get_meta2_avg', ATHENA, 0x12, old16, None),
+    ('get_meta3_avg', ATHENA, 0x13, old16, None),
+    ('get_blind_pix_avg_frame', ATHENA, 0x14, old16, None),
+    ('get_blind_pix_avg_row', ATHENA, 0x15, old16, None),
+    ('get_dark_pixel_count', ATHENA, 0x16, old32, None),
+    ('get_saturated_pixel_count', ATHENA, 0x17, old32, None),
+    ('get_frame_pixel_count', ATHENA, 0x18, old32, None),
+    ('get_img_avg', ATHENA, 0x19, old16, None),
+    ('get_image_min_value', ATHENA, 0x1A, old16, 0x3FFF),
+    ('get_image_max_value', ATHENA, 0x1B, old16, 0x3FFF),
+    ('get_coarse_offset_dc', ATHENA, 0x23, old8, None),
+]
+
+# getter, I2C register; the fuel gauge was read MSB first, one byte per read
+OLD_FUEL_GAUGE = [
+    ('get_fuel_gauge_status_reg', 0x00, 1),
+    ('get_fuel_gauge_control_reg', 0x01, 1),
+    ('get_fuel_gauge_charge', 0x02, 2),
+    ('get_fuel_gauge_voltage', 0x08, 2),
+    ('get_fuel_gauge_current', 0x0E, 2),
+    ('get_fuel_gauge_temperature', 0x14, 2),
+]
+
+# setter, bus, address, hand encode before the register map
+OLD_SETTERS = [
+    ('set_brightness', FPGA, 0xD0, lambda v: v),
+    ('set_contrast', FPGA, 0xD4, lambda v: v),
+    ('set_palette', FPGA, 0x58, lambda v: v),
+    ('set_image_flip', FPGA, 0x43, lambda v: v),
+    ('set_global_offset_forced', ATHENA, 0x2, lambda v: v & 0xFFFF),
+    ('set_detector_bias', ATHENA, 0x1, lambda v: v & 0xFF),
+    ('set_heating_compensation', ATHENA, 0x4, lambda v: v & 0xFF),
+    ('set_temp_sense_offset', ATHENA, 0x3, lambda v: v & 0xF),
+    ('set_intergration_time_start', ATHENA, 0xC, lambda v: v & 0x3FF),
+    ('set_store_line_num', ATHENA, 0x9, lambda v: v),
+    ('set_image_min_value', ATHENA, 0x1A, lambda v: v & 0x3FFF),
+    ('set_image_max_value', ATHENA, 0x1B, lambda v: v & 0x3FFF),
+]
+
+
+def pattern(address):
+    return (0xA1B2C3D4 ^ (address * 0x01010101)) & 0xFFFFFFFF
+
+
+@pytest.fixture
+def device(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    model = simulator.model
+    for getter, bus, address, decode, mask in OLD_GETTERS:
+        (model.fpga if bus == FPGA else model.athena)[address] = pattern(address)
+    model.fpga[0xD5] = pattern(0xD5)
+    model.fpga[0x69] = pattern(0x69)
+    model.fpga[0x70] = pattern(0x70)
+    for register in range(0x18):
+        model.i2c.setdefault(0x64, {})[register] = 0x30 + 7*register
+    model.i2c.setdefault(0x40, {}).update({0x00: 0x34, 0x01: 0x62})
+    return simulator, comm
+
+
+def raw_read(comm, bus, address):
+    if bus == FPGA:
+        return comm.fpga_read(address).payload
+    return comm.get_sensor_param_athena(address).payload
+
+
+@pytest.mark.parametrize('getter, bus, address, decode, mask', OLD_GETTERS,
+                         ids=[entry[0] for entry in OLD_GETTERS])
+def test_getter_matches_hand_decode(device, getter, bus, address, decode, mask):
+    simulator, comm = device
+    expected = decode(raw_read(comm, bus, address))
+    if mask is not None:
+        expected &= mask
+    assert getattr(comm, getter)() == expected
+
+
+@pytest.mark.parametrize('getter, register, width', OLD_FUEL_GAUGE,
+                         ids=[entry[0] for entry in OLD_FUEL_GAUGE])
+def test_fuel_gauge_matches_hand_decode(device, getter, register, width):
+    simulator, comm = device
+    data = [comm.i2c_read(0x64, register+i, 1).payload[0] for i in range(width)]
+    expected = data[0] if width == 1 else data[0] << 8 | data[1]
+    assert getattr(comm, getter)() == expected
+
+
+def test_combined_getters_match_hand_decode(device):
+    simulator, comm = device
+    serial_low = old32(comm.fpga_read(0xD5).payload)
+    serial_high = old32(comm.fpga_read(0xD6).payload)
+    assert comm.get_device_serial_num_new() == ((serial_high & 0xFF) << 24) | (serial_low & 0x00FFFFFF)
+    assert comm.get_image_minmax() == (old16(comm.fpga_read(0x69).payload),
+                                       old16(comm.fpga_read(0x70).payload))
+    # HDC2010 is LSB first
+    value = (comm.i2c_read(0x40, 0x01, 1).payload[-1] << 8) | comm.i2c_read(0x40, 0x00, 1).payload[-1]
+    assert comm.get_temp_sensor_data()[0] == value
+
+
+@pytest.mark.parametrize('setter, bus, address, encode', OLD_SETTERS,
+                         ids=[entry[0] for entry in OLD_SETTERS])
+@pytest.mark.parametrize('value', [0, 0x5A, 0x1234, 0xBEEF])
+def test_setter_matches_hand_encode(device, setter, bus, address, encode, value):
+    simulator, comm = device
+    getattr(comm, setter)(value)
+    model = simulator.model
+    assert (model.fpga if bus == FPGA else model.athena)[address] == encode(value)
+
+
+def test_fuel_gauge_control_write(device):
+    simulator, comm = device
+    comm.set_fuel_gauge_control_reg(0x6C)
+    assert simulator.model.i2c[0x64][0x01] == 0x6C
+
+
+def test_failed_reads_return_the_error_value(device):
+    simulator, comm = device
+
+    class Silent:
+        def __getattr__(self, name):
+            return lambda *args: None
+
+    for register in REGISTER_MAP.registers.values():
+        assert register.read(Silent()) == register.error
+
+
+def test_decode_takes_payload_bytes(device):
+    simulator, comm = device
+    response = comm.fpga_read(0x10)
+    raw = REGISTER_MAP['firmware_version'].raw_from_responses([response])
+    assert isinstance(raw, memoryview) and raw.tobytes() == response.payload[-4:].tobytes()
+    assert REGISTER_MAP['fuel_gauge_voltage'].bus == I2C
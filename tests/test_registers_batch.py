@@ -0,0 +1,36 @@
+def batch(client, simulator, operations):
+    return client.post('/registers/batch', json={"com_port": simulator.port, "baud_rate": 115200,
+                                                 "operations": operations})
+
+
+def test_reads_and_writes_in_order(app_client):
+    simulator, client = app_client
+    response = batch(client, simulator, [
+        {"op": "write", "name": "contrast", "value": 42},
+        {"op": "read", "name": "contrast"},
+        {"op": "read", "address": "0xd0"},
+    ])
+    assert response.status_code == 200
+    write, read, brightness = response.get_json()["results"]
+    assert write["status"] == "success" and write["register"] == "0xd4"
+    assert read["decoded"] == 42 and read["name"] == "contrast"
+    assert brightness["register"] == "0xd0"
+
+
+def test_unknown_register_fails_the_batch(app_client):
+    simulator, client = app_client
+    response = batch(client, simulator, [{"op": "read", "name": "no_such_register"},
+                                         {"op": "erase", "address": "0xd0"}])
+    assert response.status_code == 500
+    assert [r["status"] for r in response.get_json()["results"]] == ["error", "error"]
+
+
+def test_batch_write_is_not_served_as_a_read(app_client):
+    simulator, client = app_client
+    args = {"com_port": simulator.port, "baud_rate": 115200}
+    assert client.get('/get_default_contrast', query_string=args).status_code == 200
+    assert batch(client, simulator, [{"op": "write", "address": "0xd4", "value": 7}]).status_code == 200
+    body = client.get('/get_default_contrast', query_string=args).get_json()
+    assert body["value"] == 7
+    # The reply to a read (0x52), not the write ack (0x57)
+    assert body["command_response"].split(',')[6] == '0x52'
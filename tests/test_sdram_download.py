@@ -0,0 +1,64 @@
+import pytest
+
+import app
+from device_simulator import Faults
+
+ADDRESS = 0x40000
+
+
+@pytest.fixture
+def sdram(app_client, monkeypatch):
+    simulator, client = app_client
+    # Failed reads give up after a short wait, the port is opened on first use
+    monkeypatch.setattr(app.serial_pool, 'timeout', 0.3)
+    data = bytes((i * 31 + 7) & 0xFF for i in range(10000))
+    simulator.model.sdram[ADDRESS:ADDRESS + len(data)] = data
+    return simulator, client, data
+
+
+def download(client, simulator, size, address=ADDRESS):
+    return client.get('/sdram', query_string={"com_port": simulator.port, "baud_rate": 115200,
+                                              "addr": hex(address), "size": size})
+
+
+def test_region_streams_byte_exact(sdram):
+    simulator, client, data = sdram
+    response = download(client, simulator, len(data))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert 'sdram_0x40000.bin' in response.headers['Content-Disposition']
+    chunks = list(response.response)
+    # Sent block by block, not built up in memory
+    assert len(chunks) > 1
+    assert b''.join(chunks) == data
+
+
+def test_failure_mid_stream_ends_the_body(sdram):
+    simulator, client, data = sdram
+    response = download(client, simulator, len(data))
+    stream = iter(response.response)
+    received = next(stream)
+    simulator.faults = Faults(drop_rate=1.0)
+    with pytest.raises(IOError, match='SDRAM read failed at 0x'):
+        for chunk in stream:
+            received += chunk
+    response.close()
+    assert 0 < len(received) < len(data)
+    assert received == data[:len(received)]
+    # The port was given back, the next download works
+    simulator.faults = Faults()
+    assert download(client, simulator, 16).data == data[:16]
+
+
+def test_dead_device_gets_an_error_response(sdram):
+    simulator, client, data = sdram
+    simulator.faults = Faults(drop_rate=1.0)
+    response = download(client, simulator, 16)
+    assert response.status_code == 500
+    assert 'SDRAM read failed at 0x40000' in response.get_json()["message"]
+
+
+@pytest.mark.parametrize('size', ['0', '6', 'lots', None])
+def test_bad_size_is_rejected(sdram, size):
+    simulator, client, data = sdram
+    assert download(client, simulator, size).status_code == 400
@@ -0,0 +1,87 @@
+import pytest
+
+from device_simulator import DeviceSimulator, Faults
+from jobs import JobManager
+from serial_pool import SerialPool
+
+SET_SDRAM_ADDR = 0x6000
+SDRAM_DATA = 0x6004
+
+
+def image(size):
+    return [(i * 7 + 3) & 0xFF for i in range(size)]
+
+
+def small_chunks(comm):
+    # Several pipeline windows even for a short image
+    comm.sdram_chunk_size = 32
+    comm.pipeline_window = 4
+
+
+@pytest.mark.parametrize('lost', [(SET_SDRAM_ADDR, n) for n in range(1, 7)]
+                         + [(SDRAM_DATA, n) for n in (1, 4, 6)])
+def test_store_reticle_with_a_lost_request(connect, lost):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.3,
+                              faults=Faults(lost_requests=[lost]))
+    small_chunks(comm)
+    address, img = 0x200000, image(6*32 - 5)
+    comm.store_reticle(address, img)
+    assert simulator.stats['lost_requests'] == 1
+    assert bytes(simulator.model.sdram[address:address+len(img)]) == bytes(img)
+
+
+@pytest.mark.parametrize('lost', [(SET_SDRAM_ADDR, 3), (SDRAM_DATA, 2)])
+def test_store_reticle_with_a_lost_reply(connect, lost):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.3,
+                              faults=Faults(lost_replies=[lost]))
+    small_chunks(comm)
+    address, img = 0x200000, image(6*32)
+    comm.store_reticle(address, img)
+    assert simulator.stats['lost_replies'] == 1
+    assert bytes(simulator.model.sdram[address:address+len(img)]) == bytes(img)
+
+
+@pytest.mark.parametrize('faults', [Faults(lost_requests=[(SET_SDRAM_ADDR, 2)]),
+                                    Faults(lost_requests=[(SDRAM_DATA, 3)]),
+                                    Faults(lost_replies=[(SDRAM_DATA, 5)])])
+def test_read_data_sdram_with_a_lost_packet(connect, faults):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.3, faults=faults)
+    small_chunks(comm)
+    address, img = 0x100000, image(8*32)
+    simulator.model.sdram[address:address+len(img)] = bytes(img)
+    assert bytes(comm.read_data_sdram(address, len(img))) == bytes(img)
+
+
+def test_read_data_sdram_failure_names_the_address(connect):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=0.05, faults=Faults(drop_rate=1.0))
+    small_chunks(comm)
+    address, img = 0x100000, image(64)
+    with pytest.raises(IOError, match='0x100000'):
+        comm.read_data_sdram(address, len(img))
+
+
+def test_store_reticle_writes_the_tail_chunk(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    address, img = 0x200000, image(3*comm.sdram_chunk_size + 17)
+    comm.store_reticle(address, img)
+    assert bytes(simulator.model.sdram[address:address+len(img)]) == bytes(img)
+
+
+def test_store_reticle_failure_fails_the_job():
+    # Every data packet of the single chunk is lost
+    simulator = DeviceSimulator(baud_rate=0, latency=0,
+                                faults=Faults(lost_requests=[(SDRAM_DATA, n) for n in range(1, 10)]))
+    port = simulator.start()
+    pool = SerialPool(timeout=0.3, idle_timeout=0)
+    try:
+        manager = JobManager(pool)
+        job = manager.submit(port, 115200, 'store_reticle',
+                             {'address': 0x200000, 'reticle_img': '00' * 17})
+        job = manager.wait(job['job_id'], job['version'], timeout=30)
+        while job['state'] not in ('succeeded', 'failed', 'cancelled'):
+            job = manager.wait(job['job_id'], job['version'], timeout=30)
+        assert job['state'] == 'failed'
+        assert '0x200000' in job['error']
+    finally:
+        pool.close_all()
+        simulator.stop()
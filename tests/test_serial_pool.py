@@ -0,0 +1,52 @@
+import threading
+
+from device_simulator import DeviceSimulator
+from serial_pool import SerialPool
+
+
+def test_two_baud_rates_share_one_port_lock():
+    simulator = DeviceSimulator(baud_rate=0, latency=0)
+    port = simulator.start()
+    pool = SerialPool(idle_timeout=0, timeout=1)
+    errors = []
+
+    def worker(baud_rate, register):
+        try:
+            for i in range(50):
+                with pool.connection(port, baud_rate) as comm:
+                    assert comm.ser.baudrate == baud_rate
+                    assert comm.fpga_write(register, i) is not None
+                    assert comm.fpga_read(register).u32(-4) == i
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(115200, 0x77)),
+               threading.Thread(target=worker, args=(57600, 0x78))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        assert errors == []
+        assert list(pool._entries) == [port]
+        assert pool.baud_rate(port) in (115200, 57600)
+        assert simulator.stats['bad_requests'] == 0
+    finally:
+        pool.close_all()
+        simulator.stop()
+
+
+def test_close_keeps_the_port_reopenable():
+    simulator = DeviceSimulator(baud_rate=0, latency=0)
+    port = simulator.start()
+    pool = SerialPool(idle_timeout=0, timeout=1)
+    try:
+        with pool.connection(port, 115200) as comm:
+            assert comm.ping_device()
+        pool.close(port)
+        assert pool.baud_rate(port) is None
+        with pool.connection(port, 115200) as comm:
+            assert comm.ping_device()
+    finally:
+        pool.close_all()
+        simulator.stop()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from cmd_cls_v3 import DeadlineExceeded
+from single_flight import SingleFlight
+
+
+def capture(flight, key, fn, **kwargs):
+    try:
+        return flight.do(key, fn, **kwargs)
+    except Exception as e:
+        return e
+
+
+def run_followers(flight, key, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(capture(flight, key, lambda: 'follower ran')))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def leader_in_flight(flight, key, fn):
+    '''Starts fn as the leader, it finishes once release is set'''
+    started = threading.Event()
+    release = threading.Event()
+    outcome = []
+
+    def lead():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    thread = threading.Thread(target=lambda: outcome.append(capture(flight, key, lead)))
+    thread.start()
+    started.wait(5)
+    return thread, release, outcome
+
+
+def test_followers_get_the_leaders_result():
+    flight = SingleFlight()
+    calls = []
+    leader, release, outcome = leader_in_flight(flight, 'k', lambda: calls.append(1) or 'value')
+    followers, results = run_followers(flight, 'k', 5)
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert calls == [1]
+    assert outcome == ['value'] and results == ['value'] * 5
+
+
+def test_followers_get_the_leaders_error():
+    flight = SingleFlight()
+
+    def fail():
+        raise IOError('port gone')
+
+    leader, release, outcome = leader_in_flight(flight, 'k', fail)
+    followers, results = run_followers(flight, 'k', 3)
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert all(isinstance(r, IOError) for r in outcome + results)
+    # The key is free again
+    assert flight.do('k', lambda: 'again') == 'again'
+
+
+def test_follower_gives_up_at_its_deadline():
+    flight = SingleFlight()
+    leader, release, outcome = leader_in_flight(flight, 'k', lambda: 'late')
+    try:
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            flight.do('k', lambda: 'follower ran', deadline=time.monotonic() + 0.1)
+        assert time.monotonic() - start < 1
+    finally:
+        release.set()
+        leader.join(5)
+    assert outcome == ['late']
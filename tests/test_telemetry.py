@@ -0,0 +1,75 @@
+import json
+import threading
+
+from device_broker import DeviceBroker, RemoteTelemetryHub, write_authkey
+from serial_pool import SerialPool
+from telemetry import TelemetryHub
+
+FIELDS = ('image_min', 'image_max', 'image_average', 'sensor_temp_raw', 'temp_area',
+          'fuel_gauge_voltage', 'fuel_gauge_current')
+
+
+def test_subscribers_share_one_poller(connect):
+    simulator, comm = connect(baud_rate=0, latency=0)
+    pool = SerialPool(idle_timeout=0)
+    hub = TelemetryHub(pool, interval=0.05)
+    try:
+        first = hub.subscribe(simulator.port, 115200)
+        second = hub.subscribe(simulator.port, 57600)
+        assert len(hub._pollers) == 1
+        for subscription in (first, second):
+            sample = subscription.get(timeout=5)
+            assert 'error' not in sample
+            assert all(field in sample for field in FIELDS)
+        poller = hub._pollers[simulator.port]
+        hub.unsubscribe(first)
+        assert poller.is_alive()
+        hub.unsubscribe(second)
+        poller.join(5)
+        assert not poller.is_alive() and hub._pollers == {}
+    finally:
+        hub.stop()
+        pool.close_all()
+
+
+def test_workers_share_the_broker_poller(connect, tmp_path, monkeypatch):
+    monkeypatch.delenv('DEVICE_BROKER_AUTHKEY', raising=False)
+    simulator, comm = connect(baud_rate=0, latency=0)
+    address = str(tmp_path / 'broker.sock')
+    pool = SerialPool(idle_timeout=0)
+    broker_hub = TelemetryHub(pool, interval=0.05)
+    broker = DeviceBroker(address, pool, authkey=write_authkey(address), telemetry_hub=broker_hub)
+    thread = threading.Thread(target=broker.serve_forever, daemon=True)
+    thread.start()
+    while broker.listener is None:
+        thread.join(0.01)
+    # Two web workers, each with its own hub client
+    workers = [RemoteTelemetryHub(address), RemoteTelemetryHub(address)]
+    try:
+        subscriptions = [hub.subscribe(simulator.port, 115200) for hub in workers]
+        for subscription in subscriptions:
+            assert subscription.get(timeout=5)['com_port'] == simulator.port
+        assert len(broker_hub._pollers) == 1
+        for hub, subscription in zip(workers, subscriptions):
+            hub.unsubscribe(subscription)
+        # The broker notices on its next send
+        poller = list(broker_hub._pollers.values())[0]
+        poller.join(5)
+        assert not poller.is_alive()
+    finally:
+        broker_hub.stop()
+        broker.shutdown()
+        pool.close_all()
+
+
+def test_sse_stream(app_client):
+    import app
+    simulator, client = app_client
+    response = client.get('/stream/telemetry', buffered=False,
+                          query_string={"com_port": simulator.port, "baud_rate": 115200})
+    assert response.mimetype == 'text/event-stream'
+    event = next(response.response).decode()
+    assert event.startswith('data: ')
+    assert json.loads(event[len('data: '):])['com_port'] == simulator.port
+    response.close()
+    assert simulator.port not in app.telemetry_hub._pollers
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from timeout_policy import TimeoutPolicy
+
+
+def test_wire_time_is_kept_out_of_the_estimate():
+    policy = TimeoutPolicy(min_timeout=0.001, min_samples=2)
+    for i in range(10):
+        policy.observe('p', 1, 0.012, wire=0.010)
+    # A transfer ten times the size keeps the learned 2 ms on top of its own wire time
+    assert policy.timeout('p', 1, wire=0.100) == pytest.approx(0.102, abs=0.002)
+    assert policy.timeout('p', 1, attempt=1, wire=0.100) == pytest.approx(0.104, abs=0.004)
+
+
+@pytest.mark.parametrize('baud_rate', [9600, 115200])
+def test_large_sdram_read_after_small_ones(connect, baud_rate):
+    simulator, comm = connect(baud_rate=baud_rate, latency=0.001, timeout=2)
+    simulator.model.sdram[0:240] = bytes(range(240))
+    for i in range(10):
+        comm.set_sdram_addr(0)
+        assert comm.get_sdram_data(4) is not None
+    commands = simulator.stats['commands']
+    comm.set_sdram_addr(0)
+    response = comm.get_sdram_data(240)
+    assert response is not None and response.payload.tobytes() == bytes(range(240))
+    # Answered on the first attempt, nothing was sent twice
+    assert simulator.stats['commands'] == commands + 2
+
+
+def test_pipelined_reads_after_small_ones(connect):
+    simulator, comm = connect(baud_rate=9600, latency=0.001, timeout=2)
+    comm.sdram_chunk_size = 240
+    simulator.model.sdram[0:960] = bytes(i & 0xFF for i in range(960))
+    for i in range(10):
+        comm.set_sdram_addr(0)
+        comm.get_sdram_data(4)
+    commands = simulator.stats['commands']
+    assert comm.read_sdram_block(0, 960) == bytes(simulator.model.sdram[0:960])
+    assert simulator.stats['commands'] == commands + 8
+
+
+def test_deadline_reads_rarely_reconfigure_the_port(connect, monkeypatch):
+    simulator, comm = connect(baud_rate=0, latency=0, timeout=2)
+    size = 0x4000
+    simulator.model.sdram[0:size] = bytes(i & 0xFF for i in range(size))
+    calls = []
+    reconfigure = type(comm.ser)._reconfigure_port
+    monkeypatch.setattr(type(comm.ser), '_reconfigure_port',
+                        lambda ser, *args: calls.append(1) or reconfigure(ser, *args))
+    comm.set_deadline(time.monotonic() + 30)
+    try:
+        reads = []
+        original = comm.ser.read
+        comm.ser.read = lambda n: reads.append(n) or original(n)
+        assert bytes(comm.read_data_sdram(0, size)) == bytes(simulator.model.sdram[0:size])
+    finally:
+        comm.set_deadline(None)
+    # Without rounding every read would set a new timeout
+    assert len(calls) < len(reads) // 4
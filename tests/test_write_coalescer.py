@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from cmd_cls_v3 import DeadlineExceeded
+from write_coalescer import WriteCoalescer
+
+
+class Device:
+    '''Holds each write until released, records the values written'''
+
+    def __init__(self, error=None):
+        self.written = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.error = error
+
+    def write(self, take_value):
+        self.started.set()
+        self.release.wait(5)
+        value = take_value()
+        self.written.append(value)
+        if self.error is not None:
+            raise self.error
+        return value
+
+
+def start_write(coalescer, device, value, results, **kwargs):
+    def run():
+        try:
+            results.append(coalescer.write('reg', value, device.write, **kwargs))
+        except Exception as e:
+            results.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_followers(coalescer, value):
+    # Followers have joined once the pending value is theirs
+    for i in range(500):
+        with coalescer._lock:
+            if coalescer._pending['reg'].value == value:
+                return
+        time.sleep(0.001)
+
+
+def test_last_write_wins():
+    coalescer = WriteCoalescer()
+    device = Device()
+    results = []
+    threads = [start_write(coalescer, device, 1, results)]
+    device.started.wait(5)
+    for value in (2, 3, 4):
+        threads.append(start_write(coalescer, device, value, results))
+        wait_for_followers(coalescer, value)
+    device.release.set()
+    for thread in threads:
+        thread.join(5)
+    # Every caller sees the one write that went out, with the newest value
+    assert device.written == [4]
+    assert results == [4] * 4
+
+
+def test_write_after_the_value_was_taken_goes_out_again():
+    coalescer = WriteCoalescer()
+    device = Device()
+    device.release.set()
+    assert coalescer.write('reg', 1, device.write) == 1
+    assert coalescer.write('reg', 2, device.write) == 2
+    assert device.written == [1, 2]
+
+
+def test_error_reaches_every_caller():
+    coalescer = WriteCoalescer()
+    device = Device(error=IOError('port gone'))
+    results = []
+    threads = [start_write(coalescer, device, 1, results)]
+    device.started.wait(5)
+    threads.append(start_write(coalescer, device, 2, results))
+    wait_for_followers(coalescer, 2)
+    device.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 2 and all(isinstance(r, IOError) for r in results)
+
+
+def test_joining_caller_gives_up_at_its_deadline():
+    coalescer = WriteCoalescer()
+    device = Device()
+    results = []
+    leader = start_write(coalescer, device, 1, results)
+    device.started.wait(5)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            coalescer.write('reg', 2, device.write, deadline=time.monotonic() + 0.1)
+    finally:
+        device.release.set()
+        leader.join(5)
+    # The value it left behind is still the one written
+    assert device.written == [2] and results == [2]
@@ -0,0 +1,105 @@
+import os
+import threading
+
+
+class RttEstimator:
+    '''Smoothed round-trip time and its variation, as in RFC 6298'''
+    __slots__ = ('srtt', 'rttvar', 'rto', 'samples')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = None
+        self.samples = 0
+
+
+class TimeoutPolicy:
+    '''
+    Learns how long each command takes per port and command class (see
+    CMD.cmd_key) and derives the read timeout of a command from it, the way
+    TCP derives its retransmission timeout: srtt + k*rttvar, clamped to
+    [min_timeout, max_timeout]. Every retry doubles the timeout, and a
+    timeout also doubles the timeout of the next commands of that class
+    until a new sample comes in. Until min_samples replies have been
+    measured the port's own timeout is used, and samples are only taken
+    from commands answered on their first attempt.
+
+    Commands of one class move very different amounts of data (a 4 byte
+    and a 240 byte SDRAM read), so callers pass the wire time of each
+    transfer: it is taken off the samples and added to the timeout, the
+    estimate only covers what is left over.
+    '''
+
+    def __init__(self, min_timeout=0.02, max_timeout=5.0, min_samples=4,
+                 alpha=0.125, beta=0.25, k=4, granularity=0.001):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.granularity = granularity
+        self._estimators = {}
+        self._lock = threading.Lock()
+
+    def _estimator(self, port, key):
+        estimator = self._estimators.get((port, key))
+        if estimator is None:
+            estimator = RttEstimator()
+            self._estimators[(port, key)] = estimator
+        return estimator
+
+    def _clamp(self, timeout):
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def timeout(self, port, key, attempt=0, default=None, wire=0.0):
+        '''
+        Read timeout for attempt (0 for the first send) of a command that
+        spends wire seconds on the line, default when there are not enough
+        samples yet
+        '''
+        with self._lock:
+            estimator = self._estimators.get((port, key))
+            if estimator is None or estimator.samples < self.min_samples:
+                return default
+            rto = estimator.rto
+        return self._clamp(rto * (2 ** attempt)) + wire
+
+    def observe(self, port, key, seconds, wire=0.0):
+        seconds = max(seconds - wire, 0.0)
+        with self._lock:
+            estimator = self._estimator(port, key)
+            if estimator.srtt is None:
+                estimator.srtt = seconds
+                estimator.rttvar = seconds / 2
+            else:
+                estimator.rttvar += self.beta * (abs(estimator.srtt - seconds) - estimator.rttvar)
+                estimator.srtt += self.alpha * (seconds - estimator.srtt)
+            estimator.samples += 1
+            estimator.rto = self._clamp(estimator.srtt + max(self.granularity, self.k * estimator.rttvar))
+
+    def timed_out(self, port, key):
+        '''Backs the timeout off after a command got no reply in time'''
+        with self._lock:
+            estimator = self._estimators.get((port, key))
+            if estimator is not None and estimator.rto is not None:
+                estimator.rto = self._clamp(estimator.rto * 2)
+
+    def reset(self, port=None):
+        with self._lock:
+            if port is None:
+                self._estimators.clear()
+                return
+            for key in [key for key in self._estimators if key[0] == port]:
+                del self._estimators[key]
+
+    def snapshot(self):
+        with self._lock:
+            return {'%s 0x%04x' % key: {"srtt": e.srtt, "rttvar": e.rttvar, "rto": e.rto,
+                                        "samples": e.samples}
+                    for key, e in self._estimators.items()}
+
+
+TIMEOUT_POLICY = TimeoutPolicy(
+    min_timeout=float(os.environ.get('DEVICE_MIN_TIMEOUT', 0.02)),
+    max_timeout=float(os.environ.get('DEVICE_MAX_TIMEOUT', 5.0)))
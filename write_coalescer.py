@@ -0,0 +1,65 @@
+import threading
+import time
+
+from cmd_cls_v3 import DeadlineExceeded
+
+
+class _PendingWrite:
+    def __init__(self, value):
+        self.value = value
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteCoalescer:
+    '''
+    Last-write-wins queue per key. While a write for a key is waiting for
+    the device, newer writes to the same key replace its value instead of
+    queueing behind it. Every caller that joined the pending write gets the
+    result of the one write that was actually sent.
+
+    write_fn is called by the first caller as write_fn(take_value) and must
+    call take_value() once it owns the device; from then on new callers
+    start a fresh pending write. deadline, a time.monotonic() value, bounds
+    how long a joining caller waits, its value may still be written after
+    it gave up.
+    '''
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def write(self, key, value, write_fn, deadline=None):
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = _PendingWrite(value)
+                self._pending[key] = pending
+            else:
+                pending.value = value
+
+        if not leader:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not pending.done.wait(timeout):
+                raise DeadlineExceeded('Deadline exceeded waiting for the write to %r' % (key,))
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        def take_value():
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                return pending.value
+
+        try:
+            pending.result = write_fn(take_value)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            take_value()
+            pending.done.set()
+        return pending.result